@@ -0,0 +1,166 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+# --- 設定 ---
+# API-FOOTBALL のベースURL (検証用のスタブサーバーを使う場合は環境変数で差し替え)
+API_BASE_URL = os.getenv("APISPORTS_BASE_URL", "https://v3.football.api-sports.io")
+
+# リトライ対象とする HTTP ステータス (レート制限 + サーバーエラー)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# ----------------
+
+
+class TokenBucket:
+    """
+    1分あたりのリクエスト数 (requests_per_minute) を超えないように送信間隔を制御するトークンバケット。
+    capacity=1 の場合はリクエストが等間隔に並ぶため、任意の60秒間で上限を超えることがない。
+    複数スレッドから同時に acquire() しても安全。
+    pause() で指定秒数の間トークンの補充を止められる (レート超過の応答を受けた場合に全スレッドの送信を止める)。
+    """
+
+    def __init__(self, requests_per_minute, capacity=1):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute は正の値を指定してください")
+        self.rate = requests_per_minute / 60.0  # 1秒あたりに補充されるトークン数
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する。トークンが無い場合は補充されるまで待機する"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.updated_at:
+                    # pause() による停止中
+                    wait = self.updated_at - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """seconds 秒後までトークンを補充せず、acquire() を待機させる (停止中の場合は長い方に合わせる)"""
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.updated_at:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = max(self.updated_at, now + seconds)
+
+
+class ApiClient:
+    """
+    API-FOOTBALL 用の HTTP クライアント。
+    - 全リクエスト (リトライ含む) が共有のトークンバケットを通るため、レート上限を超えない
+    - 429 / 5xx はバックオフ付きでリトライする (Retry-After ヘッダーがあればそれに従う)
+    - レート超過 (429 / errors.rateLimit) の場合はトークンバケット自体を止め、他のスレッドも送信を待機させる
+    - fetch_many() でスレッドプールによる並列取得を行う
+    - cache (ResponseCache) を渡すと、有効なキャッシュがある場合はAPIを呼ばずにそれを返す
+    """
+
+    def __init__(self, api_key, requests_per_minute=30, max_concurrency=4,
+                 max_retries=5, backoff_base=1.0, backoff_max=60.0,
+                 base_url=API_BASE_URL, timeout=30, cache=None):
+        self.headers = {"x-apisports-key": api_key}
+        self.limiter = TokenBucket(requests_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.cache = cache
+        # requests.Session はスレッドセーフではないため、スレッドごとに保持する
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def _backoff(self, attempt, response=None):
+        """リトライまでの待機秒数を計算する (Retry-After 優先、なければ指数バックオフ + ジッター)"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay * (0.5 + random.random() / 2)
+
+    def _wait_retry(self, attempt, response=None, rate_limited=False):
+        """リトライまで待機する。レート超過はAPIキー全体の制限のため、このスレッドだけでなくトークンバケットを止める"""
+        delay = self._backoff(attempt, response)
+        if rate_limited:
+            # 次の acquire() で (他のスレッドと同様に) 停止が終わるまで待機する
+            self.limiter.pause(delay)
+        else:
+            time.sleep(delay)
+
+    def get(self, path, params=None):
+        """
+        GET リクエストを送信し、JSON を返す。
+        リトライ上限に達した場合は requests.exceptions.RequestException を送出する。
+        """
+        if self.cache is not None:
+            cached = self.cache.get(path, params)
+            if cached is not None:
+                return cached
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self._session().get(url, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self._wait_retry(attempt)
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                self._wait_retry(attempt, response, rate_limited=(response.status_code == 429))
+                continue
+
+            response.raise_for_status()
+            data = response.json()
+
+            # API-FOOTBALL はレート超過を HTTP 200 + errors.rateLimit で返すことがある
+            errors = data.get("errors")
+            if isinstance(errors, dict) and "rateLimit" in errors and attempt < self.max_retries:
+                self._wait_retry(attempt, response, rate_limited=True)
+                continue
+
+            # エラーを含まない応答のみキャッシュする
+            if self.cache is not None and not errors:
+                self.cache.put(path, params, data)
+            return data
+
+    def fetch_many(self, path, params_list):
+        """
+        params_list の各パラメータで並列に GET を行い、完了した順に (params, data, error) を返すジェネレーター。
+        失敗したリクエストは data=None, error=例外 として返す。
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self.get, path, params): params for params in params_list}
+            for future in as_completed(futures):
+                params = futures[future]
+                try:
+                    yield params, future.result(), None
+                except requests.exceptions.RequestException as e:
+                    yield params, None, e
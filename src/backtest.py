@@ -0,0 +1,249 @@
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, log_loss
+
+from feature_snapshot import load_snapshot
+from feature_store import FeatureStore
+from prediction_pipeline1 import (
+    FEATURES, PROJECT_ROOT, TARGET, build_lgb_dataset, feature_engineering, load_final_model_meta, load_match_data,
+    load_params, load_shared_rows, share_training_data, to_train_params,
+)
+
+# --------------------------------------------------------------------------------
+# ウォークフォワードのバックテスト
+# 全シーズンの試合を節 (火曜〜月曜の1週間) ごとに順番に予測する。各節の予測モデルは、
+# その節より前の試合 (expanding: 全期間 / sliding: 直近 window_days 日) で学習する。
+# - 特徴量は一度だけ作成し、全ての節で共有する
+# - ビン分割済みの Dataset を一度だけ作成し、各節は subset() で学習する
+#   (ビンの境界は最初に予測する節より前の試合だけから計算する。以降の試合の分布は使わない)
+# - 各節の学習はプロセスプールで並列に実行する
+#   python src/backtest.py --window expanding --workers 4
+#   python src/backtest.py --window sliding --window-days 365
+#   python src/backtest.py --snapshot      # パイプラインが保存した特徴量のスナップショットを使う
+# --------------------------------------------------------------------------------
+
+# 結果の保存先
+BACKTEST_STEPS_PATH = os.path.join(PROJECT_ROOT, "data", "backtest_steps.csv")
+BACKTEST_PREDICTIONS_PATH = os.path.join(PROJECT_ROOT, "data", "backtest_predictions.csv")
+
+# 早期停止の検証データがないため、各節のモデルは決まった木の数で学習する
+# (モデルレジストリに最終モデルがあれば、CVから決めた最終モデルの木の数を使用する)
+BACKTEST_ROUNDS = 100
+
+# スナップショットから読み込むカラム
+BACKTEST_COLUMNS = [*FEATURES, TARGET, 'date', 'season', 'fixture_id', 'home_team', 'away_team']
+
+# 学習データがこの試合数に満たない節は予測しない
+MIN_TRAIN_ROWS = 100
+
+# キャリブレーション (予測確率と実際の正解率) を集計する区間数
+CALIBRATION_BINS = 10
+
+
+def matchweek_steps(dates, seasons, start_season, window="expanding", window_days=365):
+    """
+    節ごとの (シーズン, 節の開始日・終了日, 学習データの行番号, 予測する行番号) のリストを作成する。
+    節は火曜〜月曜の1週間 (週末の試合と月曜の試合を同じ節にする)。
+    """
+    dates = pd.Series(pd.to_datetime(dates)).reset_index(drop=True)
+    seasons = pd.Series(seasons).reset_index(drop=True)
+    weeks = dates.dt.to_period('W-MON')
+    steps = []
+    for week in np.sort(weeks.unique()):
+        test_mask = (weeks == week).to_numpy()
+        season = int(seasons[test_mask].max())
+        if season < start_season:
+            continue
+        train_mask = (dates < week.start_time).to_numpy()
+        if window == "sliding":
+            train_mask &= (dates >= week.start_time - pd.Timedelta(days=window_days)).to_numpy()
+        if train_mask.sum() < MIN_TRAIN_ROWS:
+            continue
+        steps.append({
+            "season": season,
+            "week_start": week.start_time.strftime('%Y-%m-%d'),
+            "week_end": week.end_time.strftime('%Y-%m-%d'),
+            "train_rows": np.flatnonzero(train_mask),
+            "test_rows": np.flatnonzero(test_mask),
+        })
+    return steps
+
+
+def fit_step(dataset, x_test, train_rows, train_params, num_boost_round):
+    """1つの節の学習データでモデルを学習し、予測する試合の各ラベルの確率を返す"""
+    model = lgb.train(train_params, dataset.subset(train_rows), num_boost_round=num_boost_round)
+    return model.predict(x_test)
+
+
+# ワーカープロセスごとに一度だけ読み込む共有データ
+_worker_data = {}
+
+
+def init_worker(shared):
+    """ワーカープロセスの初期化: 共有した Dataset を読み込む (節ごとには読み込まない)"""
+    _worker_data["shared"] = shared
+    _worker_data["dataset"] = lgb.Dataset(shared["dataset_path"]).construct()
+
+
+def fit_step_shared(train_rows, test_rows, train_params, num_boost_round):
+    """ワーカープロセスで実行する: 共有した Dataset の subset で学習し、共有した特徴量で予測する"""
+    x_test = load_shared_rows(_worker_data["shared"], test_rows)
+    return fit_step(_worker_data["dataset"], x_test, train_rows, train_params, num_boost_round)
+
+
+def run_steps(dataset, input_x, steps, train_params, num_boost_round, n_workers=1):
+    """全ての節を学習・予測し、節ごとの予測確率のリストを返す (n_workers > 1 の場合は並列)"""
+    if n_workers <= 1:
+        return [fit_step(dataset, input_x.iloc[step["test_rows"]], step["train_rows"], train_params, num_boost_round)
+                for step in steps]
+
+    # 各モデルのスレッド数は (CPUコア数 / 並列数) にして、合計がコア数を超えないようにする
+    train_params = {**train_params, "n_jobs": max(1, (os.cpu_count() or 1) // n_workers)}
+    with tempfile.TemporaryDirectory() as directory:
+        shared = share_training_data(dataset, input_x, directory)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(shared,)) as executor:
+            futures = [
+                executor.submit(fit_step_shared, step["train_rows"], step["test_rows"], train_params, num_boost_round)
+                for step in steps
+            ]
+            return [future.result() for future in futures]
+
+
+# --------------------------------------------------------------------------------
+# 評価指標
+# --------------------------------------------------------------------------------
+def calibration_table(y, proba, bins=CALIBRATION_BINS):
+    """予測したラベルの確率 (信頼度) の区間ごとの、平均の信頼度・実際の正解率・試合数"""
+    confidence = proba.max(axis=1)
+    correct = proba.argmax(axis=1) == y
+    bin_index = np.minimum((confidence * bins).astype(int), bins - 1)
+    table = pd.DataFrame({"bin": bin_index, "confidence": confidence, "correct": correct})
+    table = table.groupby("bin").agg(confidence=("confidence", "mean"), accuracy=("correct", "mean"),
+                                      matches=("correct", "size"))
+    table.index = [f"{b / bins:.1f}-{(b + 1) / bins:.1f}" for b in table.index]
+    return table
+
+
+def step_metrics(y, proba, num_class):
+    """1つの節 (または全体) の精度・logloss・Brier スコア・ECE (キャリブレーション誤差)"""
+    onehot = np.eye(num_class)[y]
+    table = calibration_table(y, proba)
+    return {
+        "accuracy": accuracy_score(y, proba.argmax(axis=1)),
+        "log_loss": log_loss(y, proba, labels=range(num_class)),
+        "brier": float(np.mean(np.sum((proba - onehot) ** 2, axis=1))),
+        "ece": float(np.sum(np.abs(table["confidence"] - table["accuracy"]) * table["matches"]) / len(y)),
+    }
+
+
+def backtest(train_df, window="expanding", window_days=365, start_season=None, num_boost_round=BACKTEST_ROUNDS,
+             model_params=None, n_workers=1):
+    """
+    ウォークフォワードのバックテストを実行し、(節ごとの評価, 試合ごとの予測確率, ラベル) を返す。
+    start_season を省略した場合は、最初のシーズンを学習のみに使い、2シーズン目から予測する。
+    """
+    train_df = train_df.sort_values('date', kind='stable').reset_index(drop=True)
+    input_x = train_df[FEATURES]
+    y, target_labels = pd.factorize(train_df[TARGET])
+    if start_season is None:
+        start_season = int(train_df['season'].min()) + 1
+
+    steps = matchweek_steps(train_df['date'], train_df['season'], start_season, window, window_days)
+    if not steps:
+        print("⚠️ 予測できる節がありません。")
+        return pd.DataFrame(), pd.DataFrame(), target_labels
+
+    # 特徴量・ビン分割は全ての節で共有する。ビンの境界とカテゴリの対応は最初に予測する節より前の試合だけから
+    # 計算し、以降の節の特徴量の分布が学習に入らないようにする (以降の試合はその境界でビン分割する)
+    reference_rows = np.flatnonzero((train_df['date'] < pd.Timestamp(steps[0]["week_start"])).to_numpy())
+    dataset = build_lgb_dataset(input_x, y, reference_rows=reference_rows)
+    train_params, _ = to_train_params(model_params or load_params(), len(target_labels))
+    train_params["verbose"] = -1
+
+    print(f"バックテスト: {len(steps)} 節 ({steps[0]['week_start']} ~ {steps[-1]['week_end']}), "
+          f"学習期間: {window}{f' {window_days} 日' if window == 'sliding' else ''}, "
+          f"木の数: {num_boost_round}, 並列数: {n_workers}")
+    start = time.perf_counter()
+    step_probas = run_steps(dataset, input_x, steps, train_params, num_boost_round, n_workers)
+    print(f"✅ 全ての節の学習・予測が完了しました ({time.perf_counter() - start:.1f} 秒)")
+
+    step_results, predictions = [], []
+    for step, proba in zip(steps, step_probas):
+        y_test = y[step["test_rows"]]
+        step_results.append({
+            "season": step["season"], "week_start": step["week_start"], "week_end": step["week_end"],
+            "train_matches": len(step["train_rows"]), "test_matches": len(step["test_rows"]),
+            **step_metrics(y_test, proba, len(target_labels)),
+        })
+        rows = train_df.iloc[step["test_rows"]][['fixture_id', 'date', 'season', 'home_team', 'away_team', TARGET]]
+        rows = rows.assign(**{f"proba_{label}": proba[:, i] for i, label in enumerate(target_labels)},
+                           predicted_result=np.asarray(target_labels)[proba.argmax(axis=1)])
+        predictions.append(rows)
+    return pd.DataFrame(step_results), pd.concat(predictions, ignore_index=True), target_labels
+
+
+def print_summary(df_steps, df_predictions, target_labels):
+    """シーズンごと・全体の評価と、全体のキャリブレーションを表示する"""
+    y = df_predictions[TARGET].astype(str).map({str(l): i for i, l in enumerate(target_labels)}).to_numpy()
+    proba = df_predictions[[f"proba_{label}" for label in target_labels]].to_numpy()
+
+    print("-" * 10, "シーズンごとの結果", "-" * 10)
+    for season in sorted(df_predictions['season'].unique()):
+        mask = (df_predictions['season'] == season).to_numpy()
+        metrics = step_metrics(y[mask], proba[mask], len(target_labels))
+        print(f"{season}: {mask.sum():>4} 試合, 精度 {metrics['accuracy']:.4f}, logloss {metrics['log_loss']:.4f}, "
+              f"Brier {metrics['brier']:.4f}, ECE {metrics['ece']:.4f}")
+    metrics = step_metrics(y, proba, len(target_labels))
+    print(f"全体: {len(y):>4} 試合, 精度 {metrics['accuracy']:.4f}, logloss {metrics['log_loss']:.4f}, "
+          f"Brier {metrics['brier']:.4f}, ECE {metrics['ece']:.4f} ({len(df_steps)} 節)")
+
+    print("-" * 10, "キャリブレーション (予測したラベルの確率 vs 実際の正解率)", "-" * 10)
+    print(calibration_table(y, proba).to_string(float_format=lambda v: f"{v:.3f}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="節ごとのウォークフォワード・バックテスト")
+    parser.add_argument("--window", choices=["expanding", "sliding"], default="expanding",
+                        help="学習期間 (expanding: 予測する節より前の全期間 / sliding: 直近 --window-days 日)")
+    parser.add_argument("--window-days", type=int, default=365, help="sliding の学習期間 (日)")
+    parser.add_argument("--start-season", type=int, default=None, help="予測を開始するシーズン (既定: 2シーズン目)")
+    parser.add_argument("--rounds", type=int, default=None,
+                        help=f"各節のモデルの木の数 (既定: 最終モデルの木の数、なければ {BACKTEST_ROUNDS})")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CV_WORKERS", "1")), help="並列プロセス数")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="特徴量を作成せず、パイプラインの snapshot ステージが保存したスナップショットから読み込む")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        train_df = load_snapshot("train", columns=BACKTEST_COLUMNS)
+    else:
+        matches_df, stats_df = load_match_data()
+        feature_store = FeatureStore()
+        try:
+            train_df, _ = feature_engineering(matches_df, stats_df, feature_store=feature_store)
+        finally:
+            feature_store.close()
+
+    num_boost_round = args.rounds or load_final_model_meta().get("num_boost_round", BACKTEST_ROUNDS)
+    df_steps, df_predictions, target_labels = backtest(
+        train_df, window=args.window, window_days=args.window_days, start_season=args.start_season,
+        num_boost_round=num_boost_round, n_workers=args.workers,
+    )
+    if df_steps.empty:
+        return
+
+    print_summary(df_steps, df_predictions, target_labels)
+    df_steps.to_csv(BACKTEST_STEPS_PATH, index=False)
+    df_predictions.to_csv(BACKTEST_PREDICTIONS_PATH, index=False)
+    print(f"節ごとの評価を {BACKTEST_STEPS_PATH} に、試合ごとの予測を {BACKTEST_PREDICTIONS_PATH} に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+import argparse
+import contextlib
+import io
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from rolling_features import (
+    ROLLING_SPECS, OVERALL_WINDOW, HOME_ROLLING_COLUMNS, AWAY_ROLLING_COLUMNS, HOME_OVERALL_COLUMNS,
+    AWAY_OVERALL_COLUMNS, add_rolling_features, add_team_features, fill_not_started_features,
+)
+from dtype_policy import apply_dtype_policy, memory_mb
+
+# --------------------------------------------------------------------------------
+# パイプライン各処理のベンチマーク
+#   python src/benchmark.py rolling --scales 1 10 100
+#   python src/benchmark.py backfill --scales 1 10 100
+#   python src/benchmark.py team --scales 1 10 100
+#   python src/benchmark.py dtypes --scales 1 10 100
+#   python src/benchmark.py cv --workers 1 4 8 16 --folds 8
+#   python src/benchmark.py dataset --folds 50
+#   python src/benchmark.py rounds --holdout-days 60
+#   python src/benchmark.py snapshot --scales 1 10
+#   python src/benchmark.py sqlload --leagues 1 10 50
+# --------------------------------------------------------------------------------
+
+# 1倍のデータ量 (プレミアリーグ 5シーズン分: 20チーム x 38試合 / 2 x 5)
+BASE_MATCHES = 1900
+BASE_TEAMS = 20
+
+
+def make_matches(scale, seed=0):
+    """ベンチマーク用に scale 倍の試合データ (scale リーグ分) を作成する"""
+    rng = np.random.default_rng(seed)
+    n = BASE_MATCHES * scale
+    league = rng.integers(0, scale, n)
+    home = league * BASE_TEAMS + rng.integers(0, BASE_TEAMS, n)
+    away = league * BASE_TEAMS + (home % BASE_TEAMS + rng.integers(1, BASE_TEAMS, n)) % BASE_TEAMS
+    df = pd.DataFrame({
+        'date': pd.Timestamp('2021-08-01') + pd.to_timedelta(np.sort(rng.integers(0, 5 * 365 * 24, n)), unit='h'),
+        'home_team': pd.Categorical([f"team_{t}" for t in home]),
+        'away_team': pd.Categorical([f"team_{t}" for t in away]),
+        'home_score': rng.poisson(1.5, n).astype(float),
+        'away_score': rng.poisson(1.2, n).astype(float),
+    })
+    # 未開始の試合 (スコアなし) を末尾に含める
+    df.loc[df.index[-n // 20:], ['home_score', 'away_score']] = np.nan
+    df['is_home_win'] = (df['home_score'] > df['away_score']).astype(int)
+    df['is_away_win'] = (df['home_score'] < df['away_score']).astype(int)
+    df['home_goal_difference'] = df['home_score'] - df['away_score']
+    df['away_goal_difference'] = df['away_score'] - df['home_score']
+    return df
+
+
+def rolling_with_transform(df):
+    """従来の実装 (groupby().transform(lambda ...) を特徴量ごとに実行)"""
+    for group_col, target_col, window_size, new_col_name in ROLLING_SPECS:
+        df[new_col_name] = df.groupby(group_col, observed=False)[target_col].transform(
+            lambda x: x.rolling(window=window_size, min_periods=1).sum().shift(1).fillna(0)
+        ).astype(int)
+    return df
+
+
+def make_season_matches(scale, seed=0):
+    """シーズン・ステータス・勝敗 (target) を付けた試合データを作成する"""
+    df = make_matches(scale, seed)
+    # 8月始まりのシーズン (2021〜2025)。未開始の試合は最終シーズンの末尾に含まれる
+    df['season'] = df['date'].dt.year - (df['date'].dt.month < 8).astype(int)
+    df['status'] = np.where(df['home_score'].isna(), 'NS', 'FT')
+    df['target'] = pd.Categorical(np.select(
+        [df['home_score'] > df['away_score'], df['home_score'] < df['away_score']], ['H', 'A'], default='D'
+    ))
+    return df
+
+
+def make_feature_matches(scale, seed=0):
+    """NS試合の補完のベンチマーク用に、チーム単位の特徴量まで計算済みの試合データを作成する"""
+    return add_team_features(make_season_matches(scale, seed))
+
+
+def team_features_with_merges(df):
+    """従来の実装 (ホーム/アウェイ視点をスタックして集計し、4回のマージでワイド形式に戻す)"""
+    df = add_rolling_features(df)
+    df['match_id'] = df.index
+    df_home = df[['match_id', 'season', 'date', 'home_team', 'target']].rename(columns={'home_team': 'team'})
+    df_home['points'] = df_home['target'].map({"H": 3, "D": 1, "A": 0})
+    df_home['is_win'] = (df_home['target'] == 'H').astype(int)
+    df_away = df[['match_id', 'season', 'date', 'away_team', 'target']].rename(columns={'away_team': 'team'})
+    df_away['points'] = df_away['target'].map({"H": 0, "D": 1, "A": 3})
+    df_away['is_win'] = (df_away['target'] == 'A').astype(int)
+    df_stacked = pd.concat([df_home, df_away], ignore_index=True)
+    df_stacked = df_stacked.sort_values(by=['date', 'match_id']).reset_index(drop=True)
+    grouped = df_stacked.groupby(["season", "team"], observed=False)
+    df_stacked['total_points'] = grouped["points"].transform(
+        lambda x: x.rolling(window=OVERALL_WINDOW, min_periods=1).sum().shift(1).fillna(0)).astype(int)
+    for side in ('home', 'away'):
+        points = df_stacked[['match_id', 'team', 'total_points']].rename(
+            columns={'team': f'{side}_team', 'total_points': f'{side}_total_points'})
+        df = pd.merge(df, points, on=['match_id', f'{side}_team'], how='left')
+        df[f'{side}_total_points'] = df[f'{side}_total_points'].astype(int)
+    df["points_difference"] = df['home_total_points'] - df['away_total_points']
+    df_stacked['recent_5_wins_overall'] = grouped['is_win'].transform(
+        lambda x: x.rolling(window=6, min_periods=1).mean().shift(1).fillna(0)).astype(int)
+    df_stacked['season_wins_ave_overall_temp'] = grouped['is_win'].transform(
+        lambda x: (x.rolling(window=OVERALL_WINDOW, min_periods=1).mean().shift(1) * 100).round(2).fillna(0))
+    for side in ('home', 'away'):
+        feature = df_stacked[['match_id', 'team', 'recent_5_wins_overall', 'season_wins_ave_overall_temp']].rename(
+            columns={'team': f'{side}_team', 'recent_5_wins_overall': f'{side}_team_recent_5_wins_overall',
+                     'season_wins_ave_overall_temp': f'{side}_season_wins_ave_overall'})
+        df = pd.merge(df, feature, on=['match_id', f'{side}_team'], how='left')
+    return df
+
+
+def backfill_with_loops(df, season=2025):
+    """
+    従来の実装 (対象シーズンのチームごとに df 全体を絞り込んで代入)。
+    従来は 2025 年シーズンで固定だったため、テストで他のシーズンと比較できるよう season を引数にしている。
+    """
+    teams = df[df["season"] == season]["home_team"].unique()
+    for team in teams:
+        source_df = df[(df["status"] == "FT") & (df["home_team"] == team)].sort_values("date")
+        if not source_df.empty:
+            source_vals = source_df.iloc[-1][HOME_ROLLING_COLUMNS]
+            df.loc[(df["status"] == "NS") & (df["home_team"] == team), HOME_ROLLING_COLUMNS] = source_vals.values
+    for team in teams:
+        source_df = df[(df["status"] == "FT") & (df["away_team"] == team)].sort_values("date")
+        if not source_df.empty:
+            source_vals = source_df.iloc[-1][AWAY_ROLLING_COLUMNS]
+            df.loc[(df["status"] == "NS") & (df["away_team"] == team), AWAY_ROLLING_COLUMNS] = source_vals.values
+    for team in teams:
+        source_df = df[(df["status"] == "FT") & ((df["home_team"] == team) | (df["away_team"] == team))].sort_values("date")
+        if source_df.empty:
+            continue
+        last_row = source_df.iloc[-1]
+        if last_row["home_team"] == team:
+            latest_team_vals = last_row[HOME_OVERALL_COLUMNS].values
+        else:
+            latest_team_vals = last_row[AWAY_OVERALL_COLUMNS].values
+        ns_home_idx = df[(df["status"] == "NS") & (df["home_team"] == team)].index
+        ns_away_idx = df[(df["status"] == "NS") & (df["away_team"] == team)].index
+        if len(ns_home_idx) > 0:
+            df.loc[ns_home_idx, HOME_OVERALL_COLUMNS] = [latest_team_vals] * len(ns_home_idx)
+        if len(ns_away_idx) > 0:
+            df.loc[ns_away_idx, AWAY_OVERALL_COLUMNS] = [latest_team_vals] * len(ns_away_idx)
+    return df
+
+
+def timed(func, df, repeat):
+    """func(df のコピー) の最短実行時間と結果を返す"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        target = df.copy()
+        start = time.perf_counter()
+        result = func(target)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func, df):
+    """func(df のコピー) 実行中に確保されたメモリのピーク (MB) を返す"""
+    target = df.copy()
+    tracemalloc.start()
+    func(target)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+def bench_rolling(scales, repeat):
+    print(f"{'scale':>6} {'matches':>9} {'transform[s]':>13} {'vectorized[s]':>14} {'speedup':>8}  identical")
+    new_cols = [spec[3] for spec in ROLLING_SPECS]
+    for scale in scales:
+        df = make_matches(scale)
+        old_time, old_df = timed(rolling_with_transform, df, repeat)
+        new_time, new_df = timed(add_rolling_features, df, repeat)
+        identical = old_df[new_cols].equals(new_df[new_cols])
+        print(f"{scale:>5}x {len(df):>9} {old_time:>13.3f} {new_time:>14.4f} {old_time / new_time:>7.1f}x  {identical}")
+
+
+def bench_backfill(scales, repeat):
+    print(f"{'scale':>6} {'matches':>9} {'loops[s]':>9} {'as-of[s]':>9} {'speedup':>8}  identical")
+    cols = HOME_ROLLING_COLUMNS + AWAY_ROLLING_COLUMNS + HOME_OVERALL_COLUMNS + AWAY_OVERALL_COLUMNS
+    for scale in scales:
+        df = make_feature_matches(scale)
+        old_time, old_df = timed(backfill_with_loops, df, repeat)
+        new_time, new_df = timed(fill_not_started_features, df, repeat)
+        identical = old_df[cols].equals(new_df[cols])
+        print(f"{scale:>5}x {len(df):>9} {old_time:>9.3f} {new_time:>9.4f} {old_time / new_time:>7.1f}x  {identical}")
+
+
+def bench_team(scales, repeat):
+    print(f"{'scale':>6} {'matches':>9} {'merges[s]':>10} {'long[s]':>9} {'speedup':>8} "
+          f"{'merges[MB]':>11} {'long[MB]':>9}  identical")
+    for scale in scales:
+        df = make_season_matches(scale)
+        old_time, old_df = timed(team_features_with_merges, df, repeat)
+        new_time, new_df = timed(add_team_features, df, repeat)
+        old_peak = peak_memory(team_features_with_merges, df)
+        new_peak = peak_memory(add_team_features, df)
+        identical = old_df.equals(new_df)
+        print(f"{scale:>5}x {len(df):>9} {old_time:>10.3f} {new_time:>9.4f} {old_time / new_time:>7.1f}x "
+              f"{old_peak:>11.1f} {new_peak:>9.1f}  {identical}")
+
+
+def bench_dtypes(scales):
+    print(f"{'scale':>6} {'matches':>9} {'default[MB]':>12} {'policy[MB]':>11} {'ratio':>7}  equal")
+    for scale in scales:
+        # 従来の型 (チーム名は object、整数は int64、欠損値を含む整数は Int64) の特徴量データ
+        df = make_feature_matches(scale)
+        df['home_team'] = df['home_team'].astype(str)
+        df['away_team'] = df['away_team'].astype(str)
+        df[['home_score', 'away_score']] = df[['home_score', 'away_score']].astype("Int64")
+        compact = apply_dtype_policy(df.copy())
+        default_mb, policy_mb = memory_mb(df), memory_mb(compact)
+        numeric = df.select_dtypes('number').columns
+        equal = np.allclose(df[numeric].astype(float), compact[numeric].astype(float), equal_nan=True, rtol=1e-6)
+        print(f"{scale:>5}x {len(df):>9} {default_mb:>12.2f} {policy_mb:>11.2f} {default_mb / policy_mb:>6.1f}x  {equal}")
+
+
+# CV・モデル学習のベンチマークで使う特徴量
+CV_FEATURES = ['home_team', 'away_team', 'home_season_wins_ave_overall', 'away_season_wins_ave_overall',
+               'home_recent_10_goal_diff', 'away_recent_10_goal_diff', 'points_difference']
+
+
+def make_cv_data(scale, n_folds):
+    """CVのベンチマーク用の学習データ (FT試合)・特徴量・folds を作成する"""
+    from prediction_pipeline1 import generate_dynamic_folds
+
+    df = make_feature_matches(scale)
+    train_df = df[df['status'] == 'FT'].reset_index(drop=True)
+    features = CV_FEATURES
+    with contextlib.redirect_stdout(io.StringIO()):
+        folds = generate_dynamic_folds(train_df['date'].max().strftime('%Y-%m-%d'),
+                                       n_folds=n_folds, val_period_days=30, gap_days=10)
+    return train_df, features, folds
+
+
+def bench_cv(workers_list, n_folds, scale, repeat):
+    from prediction_pipeline1 import train_lgb
+
+    train_df, features, folds = make_cv_data(scale, n_folds)
+    print(f"CPUコア数: {os.cpu_count()}, 学習データ: {len(train_df)} 行, folds: {n_folds}")
+    print(f"{'workers':>8} {'time[s]':>9} {'speedup':>8}  identical")
+    baseline_time, baseline_kpi = None, None
+    for workers in workers_list:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                kpi = train_lgb(train_df, train_df[features], train_df['target'], folds, n_workers=workers)[:2]
+            best = min(best, time.perf_counter() - start)
+        if baseline_time is None:
+            baseline_time, baseline_kpi = best, kpi
+        print(f"{workers:>8} {best:>9.2f} {baseline_time / best:>7.1f}x  {kpi == baseline_kpi}")
+
+
+def bench_dataset(n_folds, scale, repeat):
+    """foldごとに Dataset を作り直す場合と、全体の Dataset の subset を使う場合のビン分割の時間を比較する"""
+    from prediction_pipeline1 import build_lgb_dataset
+
+    train_df, features, folds = make_cv_data(scale, n_folds)
+    x, (y, _) = train_df[features], pd.factorize(train_df['target'])
+    fold_rows = [
+        (np.flatnonzero(train_df['date'] <= fold['train_end']),
+         np.flatnonzero((train_df['date'] >= fold['val_start']) & (train_df['date'] <= fold['val_end'])))
+        for fold in folds
+    ]
+    dataset_params = {'verbose': -1}
+
+    def rebuild_per_fold(_):
+        for train_rows, val_rows in fold_rows:
+            train_set = lgb.Dataset(x.iloc[train_rows], label=y[train_rows], params=dataset_params).construct()
+            lgb.Dataset(x.iloc[val_rows], label=y[val_rows], reference=train_set, params=dataset_params).construct()
+
+    def subset_of_reference(_):
+        with contextlib.redirect_stderr(io.StringIO()):
+            dataset = build_lgb_dataset(x, y)
+        for train_rows, val_rows in fold_rows:
+            dataset.subset(train_rows).construct()
+            dataset.subset(val_rows).construct()
+
+    old_time, _ = timed(rebuild_per_fold, train_df, repeat)
+    new_time, _ = timed(subset_of_reference, train_df, repeat)
+    print(f"学習データ: {len(train_df)} 行, folds: {n_folds}")
+    print(f"foldごとに作成: {old_time:.3f} s / 全体の Dataset の subset: {new_time:.3f} s ({old_time / new_time:.1f}x)")
+
+
+def bench_rounds(n_folds, scale, holdout_days):
+    """
+    最終モデルを n_estimators 回 (従来) で学習する場合と、CVの best_iteration から決めた回数で学習する場合の
+    学習時間・モデルサイズ・予測時間・ホールドアウト (最後の holdout_days 日) での精度を比較する
+    """
+    from sklearn.metrics import accuracy_score, log_loss
+    from prediction_pipeline1 import build_lgb_dataset, generate_dynamic_folds, params, to_train_params, train_lgb
+
+    df = make_feature_matches(scale)
+    df = df[df['status'] == 'FT'].reset_index(drop=True)
+    features = CV_FEATURES
+    holdout_start = df['date'].max() - pd.Timedelta(days=holdout_days)
+    train_df, holdout_df = df[df['date'] < holdout_start].reset_index(drop=True), df[df['date'] >= holdout_start]
+    with contextlib.redirect_stdout(io.StringIO()):
+        folds = generate_dynamic_folds(train_df['date'].max().strftime('%Y-%m-%d'),
+                                       n_folds=n_folds, val_period_days=30, gap_days=10)
+    y, labels = pd.factorize(train_df['target'])
+    y_holdout = pd.Categorical(holdout_df['target'].astype(str), categories=labels.astype(str)).codes
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        dataset = build_lgb_dataset(train_df[features], y)
+        num_boost_round = train_lgb(train_df, train_df[features], train_df['target'], folds, dataset=dataset)[3]
+    train_params, max_rounds = to_train_params(params, len(labels))
+
+    print(f"学習データ: {len(train_df)} 行, ホールドアウト: {len(holdout_df)} 行, folds: {n_folds}")
+    print(f"{'rounds':>7} {'train[s]':>9} {'size[KB]':>9} {'predict[ms]':>12} {'accuracy':>9} {'logloss':>8}")
+    for rounds in [max_rounds, num_boost_round]:
+        start = time.perf_counter()
+        model = lgb.train({**train_params, "verbose": -1}, dataset, num_boost_round=rounds)
+        train_time = time.perf_counter() - start
+        size_kb = len(pickle.dumps(model)) / 1024
+        predict_time, proba = timed(model.predict, holdout_df[features], 5)
+        print(f"{rounds:>7} {train_time:>9.2f} {size_kb:>9.0f} {predict_time * 1000:>12.1f} "
+              f"{accuracy_score(y_holdout, proba.argmax(axis=1)):>9.4f} {log_loss(y_holdout, proba, labels=range(len(labels))):>8.4f}")
+
+
+def bench_snapshot(scales, repeat):
+    """
+    特徴量データ (scale リーグ分) の読み込み時間を比較する:
+    SQLite の SELECT * / 全カラムの pickle (gzip) / Arrow スナップショットから学習に使うカラムだけをメモリマップ
+    """
+    from feature_snapshot import load_snapshot, write_snapshot
+
+    print(f"{'scale':>6} {'matches':>9} {'sqlite[s]':>10} {'pickle[s]':>10} {'snapshot[s]':>12} {'speedup':>8}  equal")
+    for scale in scales:
+        df = apply_dtype_policy(make_feature_matches(scale))
+        df['league_id'] = df['home_team'].astype(str).str[len("team_"):].astype(int) // BASE_TEAMS
+        columns = [*CV_FEATURES, 'target', 'date']
+        with tempfile.TemporaryDirectory() as directory:
+            conn = sqlite3.connect(os.path.join(directory, "bench.db"))
+            df.assign(home_team=df['home_team'].astype(str), away_team=df['away_team'].astype(str),
+                      target=df['target'].astype(str), status=df['status'].astype(str)).to_sql("features", conn)
+            pickle_path = os.path.join(directory, "features.pkl.gz")
+            df.to_pickle(pickle_path, compression={"method": "gzip", "compresslevel": 1})
+            write_snapshot(df, "train", league_id=None, snapshot_dir=directory)
+
+            sqlite_time, _ = timed(lambda _: pd.read_sql_query("SELECT * FROM features", conn), df, repeat)
+            pickle_time, _ = timed(lambda _: pd.read_pickle(pickle_path, compression="gzip")[columns], df, repeat)
+            snapshot_time, loaded = timed(lambda _: load_snapshot("train", columns=columns, snapshot_dir=directory),
+                                          df, repeat)
+            conn.close()
+        # スナップショットはリーグ・シーズンの順に並ぶため、同じ順序にして比較する
+        expected = df.sort_values(['league_id', 'season'], kind='stable')[columns].reset_index(drop=True)
+        equal = loaded.equals(expected)
+        print(f"{scale:>5}x {len(df):>9} {sqlite_time:>10.3f} {pickle_time:>10.3f} {snapshot_time:>12.4f} "
+              f"{sqlite_time / snapshot_time:>7.1f}x  {equal}")
+
+
+def make_match_db(path, n_leagues, seed=0):
+    """ベンチマーク用に n_leagues リーグ分の matches / match_statistics テーブルを持つ DB を作成する"""
+    from data_fetcher2 import connect_db, init_schema
+
+    conn = connect_db(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_schema(conn)
+    rng = np.random.default_rng(seed)
+    for league in range(n_leagues):
+        df = make_season_matches(1, seed + league)
+        df['fixture_id'] = league * 100000 + np.arange(len(df))
+        df['league_id'] = league
+        df['date'] = df['date'].dt.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        df[['home_team', 'away_team']] = df[['home_team', 'away_team']].astype(str) + f"_{league}"
+        df[['fixture_id', 'league_id', 'date', 'season', 'home_team', 'away_team', 'home_score', 'away_score',
+            'status']].to_sql("matches", conn, if_exists="append", index=False)
+        for side in ('home', 'away'):
+            stats = pd.DataFrame({'fixture_id': df['fixture_id'], 'team_id': rng.integers(0, 10 ** 6, len(df)),
+                                  'team_name': df[f'{side}_team'], 'shots_on_goal': rng.integers(0, 10, len(df)),
+                                  'possession': rng.uniform(30, 70, len(df)), 'passes': rng.integers(200, 700, len(df))})
+            stats.drop_duplicates(['fixture_id', 'team_id']).to_sql("match_statistics", conn, if_exists="append",
+                                                                    index=False)
+    conn.commit()
+    conn.close()
+
+
+def bench_sqlload(leagues_list, repeat):
+    """
+    1リーグ分の試合データ・統計データの読み込みを比較する:
+    SELECT * で全リーグを読み込んで pandas で絞り込む (従来) / SQL でリーグ・カラムを絞り込む (data_access)
+    """
+    import data_access
+
+    def load_all_then_filter(conn):
+        matches = pd.read_sql_query("SELECT * FROM matches", conn)
+        stats = pd.read_sql_query("SELECT * FROM match_statistics", conn)
+        matches = matches[matches["league_id"] == 0].drop(columns="league_id")
+        return matches, stats[stats["fixture_id"].isin(matches["fixture_id"])].reset_index(drop=True)
+
+    def load_pushed_down(conn):
+        columns = [col for col in data_access.table_columns(conn, "matches") if col != "league_id"]
+        return (data_access.load_matches(conn, columns=columns, league_id=0),
+                data_access.load_match_statistics(conn, league_id=0))
+
+    print(f"{'leagues':>8} {'matches':>9} {'select*[s]':>11} {'pushdown[s]':>12} {'speedup':>8} "
+          f"{'select*[MB]':>12} {'pushdown[MB]':>13}  equal")
+    for n_leagues in leagues_list:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "matches.db")
+            make_match_db(path, n_leagues)
+            plain = sqlite3.connect(path)
+            conn = data_access.connect(path)
+            # timed / peak_memory は引数の DataFrame をコピーして渡すため、空の DataFrame を渡す
+            old_time, (old_matches, old_stats) = timed(lambda _: load_all_then_filter(plain), pd.DataFrame(), repeat)
+            new_time, (new_matches, new_stats) = timed(lambda _: load_pushed_down(conn), pd.DataFrame(), repeat)
+            old_peak = peak_memory(lambda _: load_all_then_filter(plain), pd.DataFrame())
+            new_peak = peak_memory(lambda _: load_pushed_down(conn), pd.DataFrame())
+            total = plain.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+            plain.close()
+            conn.close()
+        equal = old_matches.equals(new_matches) and old_stats.equals(new_stats)
+        print(f"{n_leagues:>8} {total:>9} {old_time:>11.3f} {new_time:>12.4f} {old_time / new_time:>7.1f}x "
+              f"{old_peak:>12.1f} {new_peak:>13.1f}  {equal}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パイプライン処理のベンチマーク")
+    subparsers = parser.add_subparsers(dest="target", required=True)
+
+    rolling = subparsers.add_parser("rolling", help="ローリング特徴量計算 (transform vs 累積和)")
+    rolling.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="現在の試合数に対する倍率")
+    rolling.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    backfill = subparsers.add_parser("backfill", help="NS試合の補完 (チームごとのループ vs as-of 結合)")
+    backfill.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="現在の試合数に対する倍率")
+    backfill.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    team = subparsers.add_parser("team", help="チーム単位の特徴量 (スタック+マージ vs ロング形式テーブル)")
+    team.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="現在の試合数に対する倍率")
+    team.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    dtypes = subparsers.add_parser("dtypes", help="特徴量データのメモリ使用量 (従来の型 vs データ型ポリシー)")
+    dtypes.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="現在の試合数に対する倍率")
+
+    cv = subparsers.add_parser("cv", help="CVのfold学習 (逐次 vs プロセスプールで並列)")
+    cv.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16], help="並列プロセス数 (先頭を基準に速度比を計算)")
+    cv.add_argument("--folds", type=int, default=8, help="fold数")
+    cv.add_argument("--scale", type=int, default=10, help="現在の試合数に対する倍率")
+    cv.add_argument("--repeat", type=int, default=1, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    dataset = subparsers.add_parser("dataset", help="LightGBM Dataset の作成 (foldごと vs 全体の subset)")
+    dataset.add_argument("--folds", type=int, default=50, help="fold数 (Optuna の試行回数 x fold数 を想定)")
+    dataset.add_argument("--scale", type=int, default=10, help="現在の試合数に対する倍率")
+    dataset.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    rounds = subparsers.add_parser("rounds", help="最終モデルの木の数 (n_estimators vs CVの best_iteration)")
+    rounds.add_argument("--folds", type=int, default=3, help="fold数")
+    rounds.add_argument("--scale", type=int, default=1, help="現在の試合数に対する倍率")
+    rounds.add_argument("--holdout-days", type=int, default=60, help="精度の評価に使う最後の期間 (日)")
+
+    snapshot = subparsers.add_parser("snapshot", help="特徴量データの読み込み (SQLite / pickle vs Arrow のメモリマップ)")
+    snapshot.add_argument("--scales", type=int, nargs="+", default=[1, 10], help="現在の試合数に対する倍率 (リーグ数)")
+    snapshot.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    sqlload = subparsers.add_parser("sqlload", help="1リーグ分の読み込み (SELECT * + pandas vs SQL で絞り込み)")
+    sqlload.add_argument("--leagues", type=int, nargs="+", default=[1, 10, 50], help="DBに含めるリーグ数")
+    sqlload.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数 (最短時間を採用)")
+
+    args = parser.parse_args()
+    if args.target == "rolling":
+        bench_rolling(args.scales, args.repeat)
+    elif args.target == "backfill":
+        bench_backfill(args.scales, args.repeat)
+    elif args.target == "team":
+        bench_team(args.scales, args.repeat)
+    elif args.target == "dtypes":
+        bench_dtypes(args.scales)
+    elif args.target == "cv":
+        bench_cv(args.workers, args.folds, args.scale, args.repeat)
+    elif args.target == "dataset":
+        bench_dataset(args.folds, args.scale, args.repeat)
+    elif args.target == "rounds":
+        bench_rounds(args.folds, args.scale, args.holdout_days)
+    elif args.target == "snapshot":
+        bench_snapshot(args.scales, args.repeat)
+    elif args.target == "sqlload":
+        bench_sqlload(args.leagues, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, "..", "db", "matches.db")
+
+# --------------------------------------------------------------------------------
+# 試合データの読み込み (データアクセス層)
+# - 絞り込み (リーグ・シーズン・ステータス・日付の範囲) と必要なカラムの指定を SQL で行い、
+#   条件に合う行・カラムだけを SQLite から読み込む (SELECT * を pandas で絞り込まない)
+# - 結果は READ_CHUNK_ROWS 行ずつ読み込み、全行分の Python のタプルを一度に作らない。
+#   load_matches などは結果全体を1つの DataFrame にする (メモリ使用量は結果の行数に比例する)。
+#   全体を保持しない処理は iter_matches で1チャンクずつ処理する
+# - 読み込み専用で接続し、読み込みが多い用途向けの PRAGMA (メモリマップ・ページキャッシュ) を設定する
+#   (DB への書き込み・ロックは行わない。WAL モードは data_fetcher2.py の接続時に設定し、リーグの絞り込みには
+#   data_fetcher2.py のスキーマ修正 v2 のインデックス (league_id, season) を使う)
+# --------------------------------------------------------------------------------
+
+# 読み込み用の PRAGMA (接続ごとの設定。DB ファイルは変更しない)
+READ_PRAGMAS = {
+    "mmap_size": 256 * 1024 ** 2,   # DBファイルをメモリマップで読む (256MB まで)
+    "cache_size": -64 * 1024,       # ページキャッシュ (負の値は KiB 単位: 64MB)
+    "temp_store": "MEMORY",         # ソート・一時テーブルをメモリ上に作る
+}
+
+# 一度に読み込む行数
+READ_CHUNK_ROWS = 50000
+
+def table_columns(conn, table):
+    """テーブルのカラム名のリスト (テーブルがない場合は空)"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def connect(db_path=DB_PATH, pragmas=READ_PRAGMAS):
+    """読み込み専用で DB に接続し、読み込み用の PRAGMA を設定する"""
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True, timeout=60)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def match_conditions(league_id=None, seasons=None, statuses=None, date_from=None, date_to=None):
+    """
+    matches の絞り込み条件の (WHERE 句, パラメータ)。None の条件は絞り込まない。
+    date_from / date_to (両端を含む) は date の ISO 8601 文字列と比較する。'2025-01-31' は 2025-01-31 00:00 と
+    同じ扱いになり、pandas で Timestamp と比較する場合 (fold の期間の絞り込み) と同じ結果になる。
+    """
+    clauses, params = [], []
+    if league_id is not None:
+        clauses.append("league_id = ?")
+        params.append(int(league_id))
+    for column, values in (("season", seasons), ("status", statuses)):
+        if values is not None:
+            values = list(values)
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(int(v) if column == "season" else str(v) for v in values)
+    if date_from is not None:
+        clauses.append("date >= ?")
+        params.append(str(date_from))
+    if date_to is not None:
+        clauses.append("date <= ?")
+        params.append(str(date_to))
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def select_columns(conn, table, columns):
+    """SELECT するカラムの SQL (columns が None なら全カラム。テーブルにないカラムはエラー)"""
+    existing = table_columns(conn, table)
+    columns = existing if columns is None else list(columns)
+    missing = [col for col in columns if col not in existing]
+    if missing:
+        raise ValueError(f"{table} にカラムがありません: {missing}")
+    return ", ".join(columns)
+
+
+def iter_query(conn, sql, params=(), chunksize=READ_CHUNK_ROWS):
+    """クエリの結果を chunksize 行ずつの DataFrame で返す"""
+    yield from pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+
+
+def read_query(conn, sql, params=(), chunksize=READ_CHUNK_ROWS):
+    """
+    クエリの結果を chunksize 行ずつ読み込み、1つの DataFrame にする。
+    結合するまで全てのチャンクを保持するため、メモリ使用量は結果全体 (結合時は一時的にその2倍) になる。
+    """
+    chunks = list(iter_query(conn, sql, params, chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=[col[0] for col in conn.execute(sql, params).description])
+    if len(chunks) == 1:
+        return chunks[0]
+    # 全て NULL のチャンクのカラムは object 型になるため、結合後に一度に読み込んだ場合と同じ型に戻す
+    return pd.concat(chunks, ignore_index=True).infer_objects()
+
+
+def matches_query(conn, columns=None, **conditions):
+    where, params = match_conditions(**conditions)
+    return f"SELECT {select_columns(conn, 'matches', columns)} FROM matches{where} ORDER BY rowid", params
+
+
+def statistics_query(conn, columns=None, **conditions):
+    """match_statistics のうち、conditions に合う試合の統計データのクエリ"""
+    where, params = match_conditions(**conditions)
+    sql = f"SELECT {select_columns(conn, 'match_statistics', columns)} FROM match_statistics"
+    if where:
+        sql += f" WHERE fixture_id IN (SELECT fixture_id FROM matches{where})"
+    return sql + " ORDER BY rowid", params
+
+
+def load_matches(conn, columns=None, chunksize=READ_CHUNK_ROWS, **conditions):
+    """
+    matches の columns カラム (None なら全カラム) のうち、conditions に合う試合を読み込む。
+    conditions: league_id, seasons, statuses, date_from, date_to (match_conditions を参照)
+    """
+    sql, params = matches_query(conn, columns, **conditions)
+    return read_query(conn, sql, params, chunksize)
+
+
+def load_match_statistics(conn, columns=None, chunksize=READ_CHUNK_ROWS, **conditions):
+    """match_statistics の columns カラムのうち、conditions (matches の条件) に合う試合の統計データを読み込む"""
+    sql, params = statistics_query(conn, columns, **conditions)
+    return read_query(conn, sql, params, chunksize)
+
+
+def iter_matches(conn, columns=None, chunksize=READ_CHUNK_ROWS, **conditions):
+    """load_matches と同じ試合を chunksize 行ずつの DataFrame で返す (全体を保持しない処理向け)"""
+    sql, params = matches_query(conn, columns, **conditions)
+    return iter_query(conn, sql, params, chunksize)
@@ -1,13 +1,17 @@
 import os
+import argparse
 import requests
 import sqlite3
-from time import sleep
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from api_client import ApiClient
+from response_cache import ResponseCache
+from team_registry import create_registry_tables, register_teams
 
 # --- 設定 ---
 # 環境変数から APIキー取得。環境変数に設定していない場合は直接キーを記述
-API_KEY = os.getenv("APISPORTS_KEY") 
-HEADERS = {"x-apisports-key": API_KEY}
+API_KEY = os.getenv("APISPORTS_KEY")
 
 # SQLite DB 設定
 # スクリプト自体のディレクトリパスを取得
@@ -18,108 +22,304 @@ PROJECT_ROOT = os.path.join(SCRIPT_DIR, "..")
 
 # データベースファイルへのパス
 DB_PATH = os.path.join(PROJECT_ROOT, "db", "matches.db")
-LEAGUE_ID = 39  # プレミアリーグ
-# 取得したいシーズンを明示的に指定
-SEASONS = [2021, 2022, 2023, 2024, 2025] 
+
+# API応答キャッシュ (圧縮JSON) のパス
+CACHE_PATH = os.path.join(PROJECT_ROOT, "db", "api_cache.db")
+
+# 取得対象にできるリーグ (API-FOOTBALL の league id)
+LEAGUES = {
+    39: "Premier League",
+    140: "La Liga",
+    78: "Bundesliga",
+    135: "Serie A",
+    40: "Championship",
+}
+# --leagues を省略した場合に取得するリーグ
+DEFAULT_LEAGUE_IDS = [39]  # プレミアリーグ
+# --seasons を省略した場合に取得するシーズン
+DEFAULT_SEASONS = [2021, 2022, 2023, 2024, 2025]
+
+# league_id カラム追加前に保存されていた試合のリーグ (プレミアリーグのみを取得していた)
+LEGACY_LEAGUE_ID = 39
+
+# API制限 (1分あたりのリクエスト数) と同時接続数。契約プランに合わせて環境変数で変更可能
+REQUESTS_PER_MINUTE = int(os.getenv("APISPORTS_RPM", "30"))
+MAX_CONCURRENCY = int(os.getenv("APISPORTS_CONCURRENCY", "4"))
+
+# 並列に処理する (リーグ, シーズン) ジョブの数。レート制限は全ジョブで共有する
+DEFAULT_JOB_WORKERS = 2
+
+# 統計情報をDBにコミットする間隔 (試合数)。クラッシュ時に失われる範囲を抑えつつ fsync 回数を減らす
+STATS_COMMIT_EVERY = 200
+
+# 差分取得モードで、今日から何日先までの試合を確認するか (日程変更の検知用)
+INCREMENTAL_LOOKAHEAD_DAYS = 14
+
+# これ以上ステータスが変わらない試合 (終了・中止など)
+FINAL_STATUSES = ('FT', 'AET', 'PEN', 'CANC', 'ABD', 'AWD', 'WO')
+
+# match_statistics に保存する統計項目の定義
+# (APIの統計名, カラム名, SQLite型, 変換関数, パーセント表記か)
+# 変換関数が None の場合は API の値をそのまま保存する。
+# 統計項目を追加する場合はここに1行追加するだけでよい (カラムは起動時に自動で追加される)
+# 例: ("Offsides", "offsides", "INTEGER", int, False), ("expected_goals", "expected_goals", "REAL", float, False)
+STAT_SCHEMA = [
+    ("Shots on Goal",   "shots_on_goal",   "INTEGER", int,  False),
+    ("Shots off Goal",  "shots_off_goal",  "INTEGER", int,  False),
+    ("Ball Possession", "possession",      "REAL",    None, True),
+    ("Total passes",    "passes",          "INTEGER", int,  False),
+    ("Passes accurate", "passes_accuracy", "REAL",    None, True),
+    ("Fouls",           "fouls",           "INTEGER", int,  False),
+    ("Corner Kicks",    "corners",         "INTEGER", int,  False),
+    ("Yellow Cards",    "yellow_cards",    "INTEGER", int,  False),
+    ("Red Cards",       "red_cards",       "INTEGER", int,  False),
+]
 # ----------------
 
-if not API_KEY:
-    print("❌ エラー: APIキー (APISPORTS_KEY) が設定されていません。")
-    exit()
-
-# DB接続とディレクトリ作成
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-conn = sqlite3.connect(DB_PATH)
-c = conn.cursor()
-
-# --- データベーススキーマ作成 ---
-# matches テーブル
-c.execute('''
-CREATE TABLE IF NOT EXISTS matches (
-    fixture_id INTEGER PRIMARY KEY,
-    date TEXT,
-    season INTEGER,
-    home_team TEXT,
-    away_team TEXT,
-    home_score INTEGER,
-    away_score INTEGER,
-    status TEXT
-)
-''')
-# match_statistics テーブル
-c.execute('''
-CREATE TABLE IF NOT EXISTS match_statistics (
-    fixture_id INTEGER,
-    team_id INTEGER,
-    team_name TEXT,
-    shots_on_goal INTEGER,
-    shots_off_goal INTEGER,
-    possession REAL,
-    passes INTEGER,
-    passes_accuracy REAL,
-    fouls INTEGER,
-    corners INTEGER,
-    yellow_cards INTEGER,
-    red_cards INTEGER,
-    PRIMARY KEY (fixture_id, team_id)
-)
-''')
-conn.commit()
-print("DBスキーマの準備が完了しました。")
+
+# --- DB接続とスキーマ ---
+def connect_db(db_path=DB_PATH):
+    """
+    DBに接続する。並列ジョブから同時に書き込めるよう WAL モードにし、
+    他のジョブが書き込み中の場合はロック解除を待つ。
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def add_column_if_missing(cursor, table, column, col_type):
+    """テーブルにカラムが存在しない場合のみ追加する"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+def migrate_add_league_id(cursor):
+    """matches に league_id を追加し、既存の行はプレミアリーグとして埋める"""
+    add_column_if_missing(cursor, "matches", "league_id", "INTEGER")
+    cursor.execute("UPDATE matches SET league_id = ? WHERE league_id IS NULL", (LEGACY_LEAGUE_ID,))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_matches_league_season ON matches (league_id, season)")
+
+def migrate_ingestion_log_per_league(cursor):
+    """ingestion_log のキーを season から (league_id, season) に変更する"""
+    cursor.execute('''
+    CREATE TABLE ingestion_log_new (
+        league_id INTEGER,
+        season INTEGER,
+        last_run_at TEXT,
+        fixtures_fetched INTEGER,
+        fixtures_changed INTEGER,
+        PRIMARY KEY (league_id, season)
+    )
+    ''')
+    cursor.execute('''
+    INSERT INTO ingestion_log_new (league_id, season, last_run_at, fixtures_fetched, fixtures_changed)
+    SELECT ?, season, last_run_at, fixtures_fetched, fixtures_changed FROM ingestion_log
+    ''', (LEGACY_LEAGUE_ID,))
+    cursor.execute("DROP TABLE ingestion_log")
+    cursor.execute("ALTER TABLE ingestion_log_new RENAME TO ingestion_log")
+
+def migrate_add_ingestion_jobs(cursor):
+    """(リーグ, シーズン) 単位のジョブキューを追加する (中断後の再開用)"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ingestion_jobs (
+        league_id INTEGER,
+        season INTEGER,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        updated_at TEXT,
+        error TEXT,
+        PRIMARY KEY (league_id, season)
+    )
+    ''')
+
+# (バージョン, 内容, 適用関数) を順番に並べる。適用済みのバージョンは PRAGMA user_version で管理し、起動時に一度だけ実行する
+MIGRATIONS = [
+    (1, "match_statistics に shots_off_goal カラムを追加",
+     lambda cursor: add_column_if_missing(cursor, "match_statistics", "shots_off_goal", "INTEGER")),
+    (2, "matches に league_id カラムとインデックスを追加", migrate_add_league_id),
+    (3, "ingestion_log をリーグ×シーズン単位に変更", migrate_ingestion_log_per_league),
+    (4, "ingestion_jobs テーブルを追加", migrate_add_ingestion_jobs),
+    (5, "チーム名の別名レジストリ (teams / team_aliases) を追加", create_registry_tables),
+]
+
+def run_migrations(conn):
+    """未適用のマイグレーションを順番に実行する"""
+    cursor = conn.cursor()
+    current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        migrate(cursor)
+        cursor.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        print(f"✅ スキーマ修正 (v{version}): {description}")
+
+def sync_stat_columns(conn):
+    """STAT_SCHEMA に定義されていて match_statistics に存在しないカラムを追加する"""
+    cursor = conn.cursor()
+    for _, column, col_type, _, _ in STAT_SCHEMA:
+        add_column_if_missing(cursor, "match_statistics", column, col_type)
+    conn.commit()
+
+def init_schema(conn):
+    """テーブルを作成し、マイグレーションを適用する"""
+    c = conn.cursor()
+    # matches テーブル
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS matches (
+        fixture_id INTEGER PRIMARY KEY,
+        date TEXT,
+        season INTEGER,
+        home_team TEXT,
+        away_team TEXT,
+        home_score INTEGER,
+        away_score INTEGER,
+        status TEXT
+    )
+    ''')
+    # match_statistics テーブル
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS match_statistics (
+        fixture_id INTEGER,
+        team_id INTEGER,
+        team_name TEXT,
+        shots_on_goal INTEGER,
+        shots_off_goal INTEGER,
+        possession REAL,
+        passes INTEGER,
+        passes_accuracy REAL,
+        fouls INTEGER,
+        corners INTEGER,
+        yellow_cards INTEGER,
+        red_cards INTEGER,
+        PRIMARY KEY (fixture_id, team_id)
+    )
+    ''')
+    # ingestion_log テーブル (取得ウォーターマーク)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS ingestion_log (
+        season INTEGER PRIMARY KEY,
+        last_run_at TEXT,
+        fixtures_fetched INTEGER,
+        fixtures_changed INTEGER
+    )
+    ''')
+    conn.commit()
+
+    run_migrations(conn)
+    sync_stat_columns(conn)
+    print("DBスキーマの準備が完了しました。")
+
+def load_fixtures_with_stats(conn):
+    """統計情報取得済みの fixture_id を一括で読み込む (試合ごとの存在確認クエリを避ける)"""
+    return {row[0] for row in conn.execute("SELECT DISTINCT fixture_id FROM match_statistics")}
 
 # --- 統計値取得ユーティリティ関数 ---
-def get_stat(statistics_list, stat_name, is_percent=False):
-    """API応答の統計リストから指定された値を抽出する"""
+def convert_stat(value, converter, is_percent):
+    """統計値を STAT_SCHEMA の定義に従って変換する"""
+    if value is None:
+        return None
+    if is_percent and isinstance(value, str) and '%' in value:
+        # パーセンテージ記号を削除して float に変換
+        return float(value.strip('%'))
+    if converter is None:
+        return value
+    # 値が数値として取得できることを確認
+    try:
+        return converter(value)
+    except (ValueError, TypeError):
+        return None
+
+def parse_statistics(statistics_list):
+    """
+    API応答の統計リストを1回だけ走査し、STAT_SCHEMA の順に変換済みの値を並べたタプルを返す。
+    同じ統計名が複数ある場合は最初の値を使用する。
+    """
+    values = {}
     for s in statistics_list:
-        if s['type'] == stat_name:
-            value = s['value']
-            if value is None:
-                return None
-            if is_percent and isinstance(value, str) and '%' in value:
-                # パーセンテージ記号を削除して float に変換
-                return float(value.strip('%'))
-            # 値が数値として取得できることを確認
-            try:
-                return int(value) if stat_name not in ["Ball Possession", "Passes accurate"] else value
-            except (ValueError, TypeError):
-                return None
-    return None
+        values.setdefault(s['type'], s['value'])
+    return tuple(
+        convert_stat(values.get(stat_name), converter, is_percent)
+        for stat_name, _, _, converter, is_percent in STAT_SCHEMA
+    )
 
-# --- データ取得とDB保存 ---
-for season in SEASONS:
-    print(f"\n=== Fetching season {season} ===")
-    
-    # 試合一覧取得 URL
-    url = f"https://v3.football.api-sports.io/fixtures?league={LEAGUE_ID}&season={season}"
-    
-    try:
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️ APIリクエスト中にエラーが発生しました ({season}): {e}")
-        continue
+# match_statistics への INSERT 文 (カラムは STAT_SCHEMA から生成)
+STAT_COLUMNS = ["fixture_id", "team_id", "team_name"] + [column for _, column, _, _, _ in STAT_SCHEMA]
+INSERT_STATS_SQL = f'''
+INTO match_statistics ({", ".join(STAT_COLUMNS)}) VALUES ({", ".join("?" * len(STAT_COLUMNS))})
+'''
 
-    if data.get('errors'):
-        print(f"⚠️ API returned errors for season {season}: {data['errors']}")
-        continue
+# --- 差分取得用のユーティリティ関数 ---
+def incremental_window(conn, league_id, season, today):
+    """
+    差分取得モードで問い合わせる日付範囲 (from, to) を返す。
+    - 前回実行日、またはまだ終了していない過去の試合のうち最も古い日付から、今日 + INCREMENTAL_LOOKAHEAD_DAYS まで
+    - 初回 (ウォーターマークなし) の場合は None を返し、シーズン全体を取得する
+    - シーズンの全試合が終了済みの場合は False を返し、API呼び出しを行わない
+    """
+    row = conn.execute(
+        "SELECT last_run_at FROM ingestion_log WHERE league_id = ? AND season = ?", (league_id, season)
+    ).fetchone()
+    if row is None:
+        return None
 
-    matches = data.get('response', [])
-    if not matches:
-        print(f"No matches found for season {season}.")
-        continue
+    placeholders = ",".join("?" * len(FINAL_STATUSES))
+    total_count, pending_count, oldest_pending = conn.execute(f'''
+    SELECT
+        COUNT(*),
+        SUM(status NOT IN ({placeholders})),
+        MIN(CASE WHEN status NOT IN ({placeholders}) THEN substr(date, 1, 10) END)
+    FROM matches WHERE league_id = ? AND season = ?
+    ''', (*FINAL_STATUSES, *FINAL_STATUSES, league_id, season)).fetchone()
+    if total_count == 0:
+        # 日程がまだ公開されていなかったシーズンは全体を取得し直す
+        return None
+    if pending_count == 0:
+        return False
+
+    window_from = min(row[0][:10], oldest_pending, today.strftime('%Y-%m-%d'))
+    window_to = (today + timedelta(days=INCREMENTAL_LOOKAHEAD_DAYS)).strftime('%Y-%m-%d')
+    return window_from, window_to
+
+def update_watermark(conn, league_id, season, run_at, fetched, changed):
+    """ウォーターマークを更新する (次回の差分取得はこの実行日時以降が対象)"""
+    conn.execute('''
+    INSERT OR REPLACE INTO ingestion_log (league_id, season, last_run_at, fixtures_fetched, fixtures_changed)
+    VALUES (?, ?, ?, ?, ?)
+    ''', (league_id, season, run_at.isoformat(), fetched, changed))
+    conn.commit()
+
+# --- DB保存用のユーティリティ関数 ---
+def save_matches(conn, league_id, season, matches):
+    """
+    試合一覧を matches テーブルに保存する。
+    日付・スコア・ステータスが DB と同じ試合は書き込まず、更新した fixture_id の集合を返す。
+    """
+    # 既存の試合情報 (日付・スコア・ステータス) を取得し、変化した試合のみを更新対象にする
+    existing = {row[0]: row[1:] for row in conn.execute('''
+    SELECT fixture_id, date, home_score, away_score, status FROM matches WHERE league_id = ? AND season = ?
+    ''', (league_id, season))}
 
     matches_to_insert = []
-    
-    # --- 1. 試合情報 (matches) DBに保存 ---
+    changed_fixture_ids = set()
+    api_teams = {}
+
     for match in matches:
         fixture = match['fixture']
         teams = match['teams']
         scores = match['score']['fulltime']
-        
-        
+        for side in ('home', 'away'):
+            api_teams[teams[side]['name']] = teams[side].get('id')
+
+        current = (fixture['date'], scores['home'], scores['away'], fixture['status']['short'])
+        if existing.get(fixture['id']) == current:
+            continue
+        changed_fixture_ids.add(fixture['id'])
+
         matches_to_insert.append((
             fixture['id'],
+            league_id,
             fixture['date'],
             season,
             teams['home']['name'],
@@ -129,91 +329,277 @@ for season in SEASONS:
             fixture['status']['short']
         ))
 
-    c.executemany('''
+    conn.executemany('''
     INSERT OR REPLACE INTO matches (
-        fixture_id, date, season, home_team, away_team, home_score, away_score, status
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        fixture_id, league_id, date, season, home_team, away_team, home_score, away_score, status
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', matches_to_insert)
+
+    # 初めて登場したチーム名をレジストリに登録する (順位表の表記と違う場合は別名の登録が必要)
+    new_teams = register_teams(conn, sorted(api_teams.items()))
+    if new_teams:
+        print(f"⚠️ リーグ {league_id} / シーズン {season}: 新しいチーム名を登録しました: {', '.join(new_teams)}"
+              f" (順位表の表記と異なる場合は python src/team_registry.py alias で別名を登録してください)")
     conn.commit()
+    return changed_fixture_ids
+
+def parse_statistics_rows(fixture_id, stats_data):
+    """統計情報の応答を match_statistics の行 (チームごと) のリストに変換する"""
+    rows = []
+    for team_stats in stats_data.get('response', []):
+        team = team_stats['team']
+        statistics = team_stats.get('statistics', [])
+        rows.append((fixture_id, team['id'], team['name']) + parse_statistics(statistics))
+    return rows
+
+def save_statistics(conn, rows, replace=False):
+    """
+    match_statistics の行をまとめて保存し、コミットする。
+    replace=True の場合は既存の行を上書きする (キャッシュからの再解析用)。
+    """
+    if rows:
+        conn.executemany(("INSERT OR REPLACE " if replace else "INSERT OR IGNORE ") + INSERT_STATS_SQL, rows)
+    conn.commit()
+
+# --- キャッシュからの再構築 (リプレイ) ---
+def replay_from_cache(conn, cache, league_ids, seasons):
+    """
+    レスポンスキャッシュに保存済みの応答だけを使って matches / match_statistics を再構築する。
+    ネットワークには一切アクセスしない。
+    """
+    # 試合一覧: 同じリーグ・シーズンの応答 (シーズン全体 / 差分取得の日付範囲) を取得日時の古い順に適用する
+    fixture_responses = 0
+    for params, data in cache.iter_responses("fixtures"):
+        league_id, season = int(params.get("league", 0)), int(params.get("season", 0))
+        if league_id not in league_ids or season not in seasons:
+            continue
+        save_matches(conn, league_id, season, data.get('response', []))
+        fixture_responses += 1
+    print(f"✔️ {fixture_responses} 件の試合一覧応答をキャッシュから適用しました。")
+
+    # 統計情報: 既存の行も上書きして再解析する (STAT_SCHEMA に統計項目を追加した場合など)
+    known_fixtures = {row[0] for row in conn.execute("SELECT fixture_id FROM matches")}
+    rows = []
+    replayed = 0
+    for params, stats_data in cache.iter_responses("fixtures/statistics"):
+        fixture_id = int(params["fixture"])
+        if fixture_id not in known_fixtures:
+            continue
+        fixture_rows = parse_statistics_rows(fixture_id, stats_data)
+        if fixture_rows:
+            rows.extend(fixture_rows)
+            replayed += 1
+    save_statistics(conn, rows, replace=True)
+    print(f"✔️ {replayed} 試合分の統計情報をキャッシュから再解析しました。")
+
+# --- データ取得とDB保存 ---
+def fetch_season(conn, client, league_id, season, fixtures_with_stats, incremental=False):
+    """
+    1リーグ・1シーズン分の試合一覧と、終了済み試合の統計情報を取得してDBに保存する。
+    APIエラーで取得できなかった場合は False を返す。
+    """
+    label = f"league {league_id} season {season}"
+    print(f"\n=== Fetching {label} ===")
+
+    # 試合一覧取得 (差分取得モードでは日付範囲で絞り込む)
+    run_at = datetime.now(timezone.utc)
+    params = {"league": league_id, "season": season}
+    if incremental:
+        window = incremental_window(conn, league_id, season, run_at)
+        if window is False:
+            print(f"全試合が終了済みのためスキップします ({label})")
+            return True
+        if window is not None:
+            params["from"], params["to"] = window
+            print(f"   - 差分取得 ({label}): {window[0]} 〜 {window[1]}")
 
-    # match_statistics テーブルに shots_off_goal カラムを追加する（既に存在する場合はスキップ）
     try:
-        c.execute('ALTER TABLE match_statistics ADD COLUMN shots_off_goal INTEGER')
-        conn.commit()
-        print("✅ スキーマ修正: shots_off_goal カラムを追加しました。")
-    except sqlite3.OperationalError as e:
-        # カラムが既にある場合（duplicate column name）や他のエラーを捕捉
-        if "duplicate column name" in str(e):
-            pass # 既にカラムが存在するのでOK
-        else:
-            # その他の重要なエラーであれば再スロー
-            raise e
-    
-    
-    
-    # ----------------------------------------------------------------------
-    print(f"✔️ {len(matches_to_insert)} matches processed for season {season}")
+        data = client.get("fixtures", params)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ APIリクエスト中にエラーが発生しました ({label}): {e}")
+        return False
+
+    if data.get('errors'):
+        print(f"⚠️ API returned errors for {label}: {data['errors']}")
+        return False
+
+    matches = data.get('response', [])
+    if not matches:
+        print(f"No matches found for {label}.")
+        update_watermark(conn, league_id, season, run_at, 0, 0)
+        return True
+
+    # --- 1. 試合情報 (matches) DBに保存 ---
+    changed_fixture_ids = save_matches(conn, league_id, season, matches)
+    print(f"✔️ {len(changed_fixture_ids)} matches processed for {label} ({len(matches)} fetched)")
 
     # --- 2. 各試合の statistics 取得 ---
     # FT (Full Time) または PEN (Penalty) で終了した試合のみ統計情報を取得
     completed_matches = [m for m in matches if m['fixture']['status']['short'] in ('FT', 'PEN')]
-    print(f"   - Fetching statistics for {len(completed_matches)} completed matches...")
 
-    for match in completed_matches:
-        fixture_id = match['fixture']['id']
+    # 既に統計情報がDBに存在する試合は取得対象から除外
+    targets = [m['fixture']['id'] for m in completed_matches if m['fixture']['id'] not in fixtures_with_stats]
+    print(f"   - Fetching statistics for {len(targets)} of {len(completed_matches)} completed matches ({label})...")
 
-        # 既に統計情報がDBに存在するかチェック
-        c.execute("SELECT 1 FROM match_statistics WHERE fixture_id = ?", (fixture_id,))
-        if c.fetchone():
-            # print(f"   - Statistics already exist for fixture {fixture_id}. Skipping.")
-            continue
+    # レート制限内で並列取得し、STATS_COMMIT_EVERY 試合ごとにまとめてDBへ保存
+    # (書き込みトランザクションを短く保ち、並列ジョブ同士のロック待ちを避ける)
+    params_list = [{"fixture": fixture_id} for fixture_id in targets]
+    pending_rows, pending_fixtures = [], []
+    for params, stats_data, error in client.fetch_many("fixtures/statistics", params_list):
+        fixture_id = params["fixture"]
 
-        stats_url = f"https://v3.football.api-sports.io/fixtures/statistics?fixture={fixture_id}"
-        stats_response = requests.get(stats_url, headers=HEADERS)
-        stats_data = stats_response.json()
+        if error is not None:
+            print(f"⚠️ Error fetching statistics for fixture {fixture_id}: {error}")
+            continue
 
         if stats_data.get('errors'):
             print(f"⚠️ Error fetching statistics for fixture {fixture_id}: {stats_data['errors']}")
-            sleep(1)
             continue
 
-        stats_list = stats_data.get('response', [])
-        stats_to_insert = []
-
-        for team_stats in stats_list:
-            team = team_stats['team']
-            statistics = team_stats.get('statistics', [])
-
-            stats_to_insert.append((
-                fixture_id,
-                team['id'],
-                team['name'],
-                # shots_on_goal, shots_off_goalはAPIの統計名に合わせる
-                get_stat(statistics, "Shots on Goal"),
-                get_stat(statistics, "Shots off Goal"),
-                get_stat(statistics, "Ball Possession", is_percent=True),
-                get_stat(statistics, "Total passes"),
-                get_stat(statistics, "Passes accurate", is_percent=True),
-                get_stat(statistics, "Fouls"),
-                get_stat(statistics, "Corner Kicks"),
-                get_stat(statistics, "Yellow Cards"),
-                get_stat(statistics, "Red Cards")
-            ))
-
-        if stats_to_insert:
-            c.executemany('''
-            INSERT OR IGNORE INTO match_statistics (
-                fixture_id, team_id, team_name, shots_on_goal, shots_off_goal, possession,
-                passes, passes_accuracy, fouls, corners, yellow_cards, red_cards
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', stats_to_insert)
-            conn.commit()
-            # print(f"   - Statistics inserted for fixture {fixture_id}")
-        
-        sleep(1) # API制限回避 (1分あたり30リクエストの制限を考慮)
-
-conn.close()
-print("\n=======================================================")
-print("✅ 全てのシーズン (2021年〜2025年) のデータ取得と保存が完了しました。")
-print("データは 'db/matches.db' に格納されています。")
-print("=======================================================")
\ No newline at end of file
+        rows = parse_statistics_rows(fixture_id, stats_data)
+        if rows:
+            pending_rows.extend(rows)
+            pending_fixtures.append(fixture_id)
+        if len(pending_fixtures) >= STATS_COMMIT_EVERY:
+            save_statistics(conn, pending_rows)
+            fixtures_with_stats.update(pending_fixtures)
+            pending_rows, pending_fixtures = [], []
+
+    save_statistics(conn, pending_rows)
+    fixtures_with_stats.update(pending_fixtures)
+
+    update_watermark(conn, league_id, season, run_at, len(matches), len(changed_fixture_ids))
+    return True
+
+# --- ジョブキュー ---
+def enqueue_jobs(conn, units, resume=False):
+    """
+    (リーグ, シーズン) のジョブを登録し、実行対象のジョブを返す。
+    resume=True の場合は完了済みのジョブを残し、未完了 (中断・失敗を含む) のジョブのみを返す。
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    if resume:
+        conn.executemany('''
+        INSERT OR IGNORE INTO ingestion_jobs (league_id, season, status, attempts, updated_at)
+        VALUES (?, ?, 'pending', 0, ?)
+        ''', [(league_id, season, now) for league_id, season in units])
+    else:
+        conn.executemany('''
+        INSERT OR REPLACE INTO ingestion_jobs (league_id, season, status, attempts, updated_at)
+        VALUES (?, ?, 'pending', 0, ?)
+        ''', [(league_id, season, now) for league_id, season in units])
+    conn.commit()
+
+    status = {(row[0], row[1]): row[2] for row in conn.execute("SELECT league_id, season, status FROM ingestion_jobs")}
+    return [unit for unit in units if status.get(unit) != 'done']
+
+def set_job_status(conn, league_id, season, status, error=None):
+    """ジョブの状態を更新する"""
+    conn.execute('''
+    UPDATE ingestion_jobs
+    SET status = ?, error = ?, updated_at = ?, attempts = attempts + (? = 'running')
+    WHERE league_id = ? AND season = ?
+    ''', (status, error, datetime.now(timezone.utc).isoformat(), status, league_id, season))
+    conn.commit()
+
+def run_job(db_path, client, league_id, season, fixtures_with_stats, incremental):
+    """1つのジョブをワーカースレッド専用のDB接続で実行する"""
+    conn = connect_db(db_path)
+    try:
+        set_job_status(conn, league_id, season, 'running')
+        try:
+            ok = fetch_season(conn, client, league_id, season, fixtures_with_stats, incremental)
+        except Exception as e:
+            set_job_status(conn, league_id, season, 'failed', repr(e))
+            raise
+        set_job_status(conn, league_id, season, 'done' if ok else 'failed',
+                       None if ok else "API request failed")
+        return ok
+    finally:
+        conn.close()
+
+def run_jobs(db_path, client, units, fixtures_with_stats, incremental=False, workers=DEFAULT_JOB_WORKERS):
+    """ジョブを並列に実行し、(成功数, 失敗数) を返す"""
+    succeeded, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_job, db_path, client, league_id, season, fixtures_with_stats, incremental): (league_id, season)
+            for league_id, season in units
+        }
+        for future in as_completed(futures):
+            league_id, season = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"⚠️ ジョブ (league {league_id} season {season}) でエラーが発生しました: {e}")
+                ok = False
+            if ok:
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
+
+# --- コマンドライン ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="API-FOOTBALL から試合データを取得し SQLite に保存する")
+    parser.add_argument("--leagues", type=int, nargs="+", default=DEFAULT_LEAGUE_IDS,
+                        help=f"取得するリーグID (例: {' '.join(str(k) for k in LEAGUES)})")
+    parser.add_argument("--seasons", type=int, nargs="+", default=DEFAULT_SEASONS, help="取得するシーズン (開始年)")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOB_WORKERS,
+                        help="並列に処理する (リーグ, シーズン) ジョブ数。レート制限は全ジョブで共有する")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回中断したジョブキューを再開する (完了済みの (リーグ, シーズン) はスキップ)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回実行以降にステータスが変わった可能性のある期間の試合のみ取得する (日次実行向け)")
+    parser.add_argument("--replay", action="store_true",
+                        help="APIにアクセスせず、キャッシュ済みの応答だけで matches / match_statistics を再構築する")
+    parser.add_argument("--no-cache", action="store_true", help="API応答キャッシュを使用しない")
+    args = parser.parse_args(argv)
+    if args.replay and args.no_cache:
+        parser.error("--replay と --no-cache は同時に指定できません")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not API_KEY and not args.replay:
+        print("❌ エラー: APIキー (APISPORTS_KEY) が設定されていません。")
+        return 1
+
+    conn = connect_db(DB_PATH)
+    init_schema(conn)
+
+    # API応答キャッシュ (終了済み試合の応答は期限なし、未開始の試合を含む応答は短い期限で再取得する)
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    cache = None if args.no_cache else ResponseCache(CACHE_PATH)
+
+    try:
+        if args.replay:
+            replay_from_cache(conn, cache, set(args.leagues), set(args.seasons))
+            failed = 0
+        else:
+            # APIクライアント (全ジョブ・全リクエストで共通のレート制限を共有する)
+            client = ApiClient(API_KEY, requests_per_minute=REQUESTS_PER_MINUTE,
+                               max_concurrency=MAX_CONCURRENCY, cache=cache)
+            units = [(league_id, season) for league_id in args.leagues for season in args.seasons]
+            units = enqueue_jobs(conn, units, resume=args.resume)
+            print(f"{len(units)} 件のジョブ (リーグ×シーズン) を実行します。")
+            succeeded, failed = run_jobs(DB_PATH, client, units, load_fixtures_with_stats(conn),
+                                         incremental=args.incremental, workers=args.jobs)
+            print(f"\nジョブ完了: 成功 {succeeded} 件 / 失敗 {failed} 件")
+            if failed:
+                print("失敗したジョブは --resume を付けて再実行すると続きから取得できます。")
+    finally:
+        conn.close()
+        if cache is not None:
+            cache.close()
+
+    print("\n=======================================================")
+    print("✅ データの取得と保存が完了しました。")
+    print("データは 'db/matches.db' に格納されています。")
+    print("=======================================================")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
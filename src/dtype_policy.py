@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows では resource モジュールが使えない
+    resource = None
+
+# --------------------------------------------------------------------------------
+# パイプラインのデータ型ポリシー
+# - 勝敗ラベル: np.select でベクトル化して作成し、category 型にする
+# - 欠損値のない整数値 (件数・順位・ローリング特徴量など): 値の範囲に収まる最小の整数型 (int8/int16/...)
+# - 欠損値を含む数値、小数の特徴量: float32
+# - チーム名: ホーム/アウェイで共通のカテゴリ辞書を持つ category 型
+# --------------------------------------------------------------------------------
+
+# 型を変更しないカラム (DBへの保存や結合のキーとして元の型のまま使う)
+KEEP_COLUMNS = ['fixture_id', 'date']
+
+# ホーム/アウェイで同じカテゴリ辞書を共有するカラム
+TEAM_COLUMNS = ['home_team', 'away_team']
+
+# category 型にするカラム (チーム名以外)
+CATEGORY_COLUMNS = ['status', 'target']
+
+# 勝敗ラベル (H:home win, A:away win, D:draw)
+TARGET_LABELS = ['H', 'A', 'D']
+
+
+def make_target(home_score, away_score):
+    """試合結果から勝敗ラベル (H/A/D) を作成する。スコアが欠損している試合 (未開始など) は D"""
+    home = np.asarray(home_score, dtype=np.float64)
+    away = np.asarray(away_score, dtype=np.float64)
+    labels = np.select([home > away, home < away], TARGET_LABELS[:2], default=TARGET_LABELS[2])
+    return pd.Categorical(labels)
+
+
+def shared_team_categories(df, columns=TEAM_COLUMNS):
+    """ホーム/アウェイのチーム名を、全チームを含む1つのカテゴリ辞書 (チーム名順) の category 型に変換する"""
+    teams = pd.Index(sorted(set().union(*(df[col].dropna().astype(str) for col in columns))))
+    team_dtype = pd.CategoricalDtype(teams)
+    for col in columns:
+        df[col] = df[col].astype(str).where(df[col].notna()).astype(team_dtype)
+    return df
+
+
+def compact_numeric(series):
+    """数値カラムをポリシーに沿った最小の型に変換する"""
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    has_nan = np.isnan(values).any()
+    is_integral = np.array_equal(values[~np.isnan(values)], np.round(values[~np.isnan(values)]))
+    if is_integral and not has_nan and len(values) > 0:
+        return pd.to_numeric(values.astype(np.int64), downcast='integer')
+    return values.astype(np.float32)
+
+
+def apply_dtype_policy(df):
+    """
+    DataFrame 全体にデータ型ポリシーを適用する (何度適用しても同じ結果になる)。
+    KEEP_COLUMNS 以外の数値カラムを最小の整数型/float32 に、チーム名を共通カテゴリに、
+    CATEGORY_COLUMNS を category 型に変換する。
+    """
+    df = shared_team_categories(df)
+    for col in df.columns:
+        if col in KEEP_COLUMNS or col in TEAM_COLUMNS:
+            continue
+        if col in CATEGORY_COLUMNS:
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        elif pd.api.types.is_bool_dtype(df[col]):
+            df[col] = df[col].astype(np.int8)
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = compact_numeric(df[col])
+    return df
+
+
+# --------------------------------------------------------------------------------
+# メモリ使用量のレポート
+# --------------------------------------------------------------------------------
+def memory_mb(df):
+    """DataFrame のメモリ使用量 (MB)"""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def peak_rss_mb():
+    """プロセスの最大常駐メモリ (MB)。取得できない環境では None"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemoryReport:
+    """
+    処理ステージごとに DataFrame のメモリ使用量 (前 -> 後) を記録・表示する。
+        report = MemoryReport()
+        report.start(df)
+        df = some_stage(df)
+        report.stage("ステージ名", df)
+    """
+
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.stages = []
+        self.current_mb = None
+
+    def start(self, df):
+        self.current_mb = memory_mb(df)
+
+    def stage(self, name, df):
+        after_mb = memory_mb(df)
+        self.stages.append({'stage': name, 'before_mb': self.current_mb, 'after_mb': after_mb,
+                            'rows': len(df), 'columns': df.shape[1]})
+        if self.verbose:
+            before = "-" if self.current_mb is None else f"{self.current_mb:.2f}"
+            print(f"メモリ使用量 [{name}]: {before} MB -> {after_mb:.2f} MB ({len(df)} 行 x {df.shape[1]} 列)")
+        self.current_mb = after_mb
+
+    def summary(self):
+        """ステージごとの記録を DataFrame で返し、最大常駐メモリを表示する"""
+        rss = peak_rss_mb()
+        if self.verbose and rss is not None:
+            print(f"最大常駐メモリ (peak RSS): {rss:.1f} MB")
+        return pd.DataFrame(self.stages)
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.path.join(SCRIPT_DIR, "..", "data", "snapshot")
+
+# --------------------------------------------------------------------------------
+# 特徴量のスナップショット (Arrow IPC / Feather v2)
+# 特徴量を作成したデータ (train: FT試合 / predict: NS試合) をリーグ・シーズンごとのファイルに保存する。
+#   data/snapshot/<名前>/league=<リーグID>/season=<シーズン>.arrow
+#   data/snapshot/<名前>/snapshot.json : カラム・行数・元の DataFrame のハッシュ値
+# 圧縮せずに保存し、読み込みはメモリマップで必要なカラムだけを参照する
+# (使わないカラム・リーグ・シーズンのファイルはディスクから読み込まれない)。
+# --------------------------------------------------------------------------------
+
+META_FILE = "snapshot.json"
+
+
+def partition_path(directory, league_id, season):
+    return os.path.join(directory, f"league={league_id}", f"season={season}.arrow")
+
+
+def write_snapshot(df, name, league_id, source_hash=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    df をシーズンごとのファイルに分けて保存する (league_id は df に league_id カラムがなければ全行に使う)。
+    書き込みが終わってから前回のスナップショットと置き換えるので、読み込み中に壊れない。
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=snapshot_dir, prefix=f".{name}-")
+    df = df.reset_index(drop=True)
+    leagues = df['league_id'] if 'league_id' in df.columns else pd.Series(league_id, index=df.index)
+    partitions = []
+    for (league, season), part in df.groupby([leagues, df['season']], observed=True, sort=True):
+        path = partition_path(staging, int(league), int(season))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        feather.write_feather(pa.Table.from_pandas(part, preserve_index=False), path, compression="uncompressed")
+        partitions.append({"league_id": int(league), "season": int(season), "rows": len(part)})
+
+    meta = {"columns": list(df.columns), "rows": len(df), "partitions": partitions, "source_hash": source_hash}
+    with open(os.path.join(staging, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=4)
+
+    target = os.path.join(snapshot_dir, name)
+    if os.path.exists(target):
+        previous = tempfile.mkdtemp(dir=snapshot_dir, prefix=f".{name}-old-")
+        os.replace(target, os.path.join(previous, name))
+        os.replace(staging, target)
+        shutil.rmtree(previous)
+    else:
+        os.replace(staging, target)
+    return meta
+
+
+def load_snapshot_meta(name, snapshot_dir=SNAPSHOT_DIR):
+    """スナップショットの snapshot.json (保存されていない場合は空の辞書)"""
+    path = os.path.join(snapshot_dir, name, META_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_snapshot(name, columns=None, seasons=None, leagues=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    スナップショットの columns カラム (省略した場合は全カラム) を、seasons / leagues のファイルだけから読み込む。
+    行の順序は保存時と同じ (リーグ・シーズンの順)。
+    """
+    meta = load_snapshot_meta(name, snapshot_dir)
+    if not meta:
+        raise FileNotFoundError(f"スナップショットが保存されていません: {os.path.join(snapshot_dir, name)}")
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+    tables = []
+    for partition in meta["partitions"]:
+        if seasons is not None and partition["season"] not in seasons:
+            continue
+        if leagues is not None and partition["league_id"] not in leagues:
+            continue
+        path = partition_path(os.path.join(snapshot_dir, name), partition["league_id"], partition["season"])
+        # メモリマップしたファイルの必要なカラムだけを参照する (読み込み時にはコピーしない。
+        # 配列がマップした領域を参照している間はファイルを閉じない)
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        tables.append(table.select(columns) if columns is not None else table)
+    if not tables:
+        return pd.DataFrame(columns=columns if columns is not None else meta["columns"])
+    # split_blocks: カラムごとの配列のまま DataFrame にする (1つの2次元配列にまとめるコピーをしない)
+    return pa.concat_tables(tables, promote_options="default").to_pandas(split_blocks=True)
@@ -0,0 +1,499 @@
+import argparse
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from rolling_features import (
+    ROLLING_SPECS, OVERALL_WINDOW, HOME_ROLLING_COLUMNS, AWAY_ROLLING_COLUMNS,
+    HOME_OVERALL_COLUMNS, AWAY_OVERALL_COLUMNS, add_team_features, team_column_name,
+)
+
+# --------------------------------------------------------
+# 特徴量ストア
+# チーム単位の特徴量 (ローリング特徴量・勝ち点など) を試合ごとに SQLite に保存し、
+# 次回以降は変化した試合に関係するチームの行だけを再計算する。
+# 各チームの最後の FT 試合までの直近の試合 (ローリング窓・シーズン成績の計算に必要な分) を
+# team_state に保存しておき、それより後の試合だけが変化した場合 (日次の更新) は
+# 保存済みの試合から計算を始めるため、過去の試合の特徴量は計算し直さない。
+# ただし変化の検知のため、毎回全ての試合の指紋を計算して保存済みの指紋・特徴量を全て読み込む
+# (更新の時間は試合数に比例する部分が残る)。
+# --------------------------------------------------------
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(SCRIPT_DIR, "..")
+
+# 特徴量ストアのパス
+FEATURE_STORE_PATH = os.path.join(PROJECT_ROOT, "db", "feature_store.db")
+
+# 特徴量の計算方法・保存形式を変更した場合はバージョンを上げる (保存済みの特徴量を破棄して全再計算する)
+FEATURE_STORE_VERSION = 2
+
+# 試合の変化を検知するためのカラム (これらが変わらなければチーム単位の特徴量も変わらない)
+FINGERPRINT_COLUMNS = ['date', 'season', 'status', 'home_team', 'away_team', 'home_score', 'away_score']
+
+# チーム単位の特徴量 (add_team_features が追加するカラム。match_id は保存しない)
+TEAM_FEATURE_COLUMNS = (
+    [spec[3] for spec in ROLLING_SPECS]
+    + ['match_id', 'home_total_points', 'away_total_points', 'points_difference',
+       'home_team_recent_5_wins_overall', 'home_season_wins_ave_overall',
+       'away_team_recent_5_wins_overall', 'away_season_wins_ave_overall']
+)
+STORED_COLUMNS = [col for col in TEAM_FEATURE_COLUMNS if col != 'match_id']
+FLOAT_COLUMNS = ['home_season_wins_ave_overall', 'away_season_wins_ave_overall']
+
+# 再計算の開始位置より前に必要な行数 (ローリング窓の長さ)
+SIDE_CONTEXT_ROWS = max(spec[2] for spec in ROLLING_SPECS)
+OVERALL_CONTEXT_ROWS = OVERALL_WINDOW
+
+# チーム単位の特徴量の計算に使う試合のカラム (team_state に保存する直近の試合の値)
+RAW_COLUMNS = ['season', 'target', 'home_score', 'away_score', 'is_home_win', 'is_away_win',
+               'home_goal_difference', 'away_goal_difference']
+
+# チーム視点の特徴量名 (team_state の最新の特徴量。home_/away_ の接頭辞を除いたもの)
+TEAM_ROLLING_COLUMNS = [team_column_name(col) for col in HOME_ROLLING_COLUMNS]
+TEAM_OVERALL_COLUMNS = [team_column_name(col) for col in HOME_OVERALL_COLUMNS]
+
+
+def fingerprints(df):
+    """試合ごとの変化検知用のハッシュ値 (int64)。データ型の違いで値が変わらないよう、型を揃えてからハッシュ化する"""
+    normalized = pd.DataFrame({
+        'date': pd.to_datetime(df['date']),
+        'season': df['season'].astype(np.int64),
+        'status': df['status'].astype(str),
+        'home_team': df['home_team'].astype(str),
+        'away_team': df['away_team'].astype(str),
+        'home_score': df['home_score'].astype(np.float64),
+        'away_score': df['away_score'].astype(np.float64),
+    }, index=df.index)[FINGERPRINT_COLUMNS]
+    hashed = pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+    return pd.Series(hashed.view(np.int64), index=df.index)
+
+
+def trim_history(history):
+    """
+    チームの試合 (古い順) のうち、次の試合のチーム単位の特徴量の計算に必要な直近の試合だけを残す。
+    - ホーム/アウェイ別のローリング特徴量: それぞれ直近 SIDE_CONTEXT_ROWS 試合
+    - ホーム/アウェイ区別なしの成績 (シーズン内): 最新シーズンの直近 OVERALL_CONTEXT_ROWS 試合
+    """
+    if not history:
+        return history
+    last_season = history[-1]['season']
+    side_counts = {'home': 0, 'away': 0}
+    season_count = 0
+    start = len(history)
+    for position in range(len(history) - 1, -1, -1):
+        entry = history[position]
+        in_season = entry['season'] == last_season
+        if side_counts[entry['side']] < SIDE_CONTEXT_ROWS or (in_season and season_count < OVERALL_CONTEXT_ROWS):
+            start = position
+        side_counts[entry['side']] += 1
+        season_count += in_season
+    return history[start:]
+
+
+def team_appearances(rows, teams):
+    """
+    rows (時系列順) の試合のうち teams の試合を、チーム視点のテーブル (1試合 = 各チーム1行、時系列順) にする。
+    チーム単位の特徴量のカラムは home_/away_ の接頭辞を除いた名前にする。
+    """
+    teams = {str(team) for team in teams}
+    parts = []
+    for side, feature_columns in (('home', HOME_ROLLING_COLUMNS + HOME_OVERALL_COLUMNS),
+                                  ('away', AWAY_ROLLING_COLUMNS + AWAY_OVERALL_COLUMNS)):
+        team = rows[f'{side}_team'].astype(str)
+        mask = team.isin(teams).to_numpy()
+        part = rows.loc[mask, ['fixture_id', 'date', 'status'] + RAW_COLUMNS].copy()
+        part['status'] = part['status'].astype(str)
+        part['target'] = part['target'].astype(object)
+        for col in feature_columns:
+            part[team_column_name(col)] = rows.loc[mask, col]
+        part['team'] = team[mask]
+        part['side'] = side
+        part['order'] = np.flatnonzero(mask)
+        parts.append(part)
+    return pd.concat(parts).sort_values('order', kind='stable')
+
+
+class FeatureStore:
+    """
+    チーム単位の特徴量を保存・差分更新する特徴量ストア。
+    - team_features: 試合ごとの特徴量 (fixture_id 単位)
+    - team_state: チームごとの最後の FT 試合の時点の状態
+        history: 直近の試合の値 (ローリング窓・シーズン内の勝ち点・勝利数の計算に必要な分)。差分更新の計算の起点にする
+        latest_features: 最後の FT 試合の特徴量 (ホーム側・アウェイ側・区別なし)。NS試合と同じ方法で補完する予測に使う
+    verify_on_update=True の場合、更新後に全再計算の結果と一致するかを確認する。
+    """
+
+    def __init__(self, path=FEATURE_STORE_PATH, verify_on_update=False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.verify_on_update = verify_on_update
+        self.conn = sqlite3.connect(path)
+        self._init_schema()
+
+    def _init_schema(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.conn.execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()
+        if row is None or int(row[0]) != FEATURE_STORE_VERSION:
+            # 保存形式が変わっている可能性があるため、テーブルごと作り直す
+            self.conn.execute("DROP TABLE IF EXISTS team_features")
+            self.conn.execute("DROP TABLE IF EXISTS team_state")
+
+        feature_defs = ",\n".join(
+            f"{col} {'REAL' if col in FLOAT_COLUMNS else 'INTEGER'}" for col in STORED_COLUMNS
+        )
+        self.conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS team_features (
+            fixture_id INTEGER PRIMARY KEY,
+            fingerprint INTEGER,
+            sort_date TEXT,
+            home_team TEXT,
+            away_team TEXT,
+            {feature_defs}
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS team_state (
+            team TEXT PRIMARY KEY,
+            last_fixture_id INTEGER,
+            last_date TEXT,
+            history TEXT,
+            latest_features TEXT
+        )
+        ''')
+        self.conn.commit()
+
+        if row is None or int(row[0]) != FEATURE_STORE_VERSION:
+            self.clear()
+
+    def clear(self):
+        """保存済みの特徴量を全て削除する (次回の update で全再計算される)"""
+        self.conn.execute("DELETE FROM team_features")
+        self.conn.execute("DELETE FROM team_state")
+        self.conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('version', ?)",
+                          (str(FEATURE_STORE_VERSION),))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # ----------------------------------------------------
+    # 更新
+    # ----------------------------------------------------
+    def update(self, df):
+        """
+        df (時系列順にソート済み、index は 0 からの連番) にチーム単位の特徴量を追加して返す。
+        add_team_features(df) と同じ結果を、前回から変化した試合に関係するチームの行だけ再計算して求める。
+        """
+        stored = pd.read_sql_query(
+            "SELECT fixture_id, fingerprint, sort_date, home_team, away_team FROM team_features", self.conn
+        )
+        if stored.empty:
+            return self.rebuild(df)
+
+        current_fp = fingerprints(df)
+        positions = pd.Index(stored['fixture_id']).get_indexer(df['fixture_id'])
+        previous_fp = stored['fingerprint'].to_numpy()[positions]
+        dirty = pd.Series((positions < 0) | (previous_fp != current_fp.to_numpy()), index=df.index)
+        removed = stored[~stored['fixture_id'].isin(df['fixture_id'])]
+        changed_before = stored.iloc[positions[(dirty & (positions >= 0)).to_numpy()]]
+
+        if not dirty.any() and removed.empty:
+            print("特徴量ストア: 変化した試合はありません。保存済みの特徴量を使用します。")
+            features = self._load_features(df['fixture_id'])
+            result = self._attach(df, features)
+        else:
+            result = self._update_affected(df, dirty, pd.concat([removed, changed_before]), current_fp)
+
+        if self.verify_on_update:
+            self.verify(df, result)
+        return result
+
+    def rebuild(self, df):
+        """全ての試合の特徴量を再計算して保存する"""
+        print("特徴量ストア: 全ての試合の特徴量を計算します。")
+        result = add_team_features(df.copy())
+        self.conn.execute("DELETE FROM team_features")
+        self.conn.execute("DELETE FROM team_state")
+        self._save_features(result, fingerprints(df))
+        teams = set(result['home_team'].astype(str)) | set(result['away_team'].astype(str))
+        self._save_team_state(self._team_states(result, teams))
+        self.conn.commit()
+        return result
+
+    def _update_affected(self, df, dirty, previous_rows, current_fp):
+        """
+        変化した試合に関係するチームの行を再計算する。
+        全てのチームで、変化した試合が保存済みの状態 (最後の FT 試合) より後であれば、状態の直近の試合を起点に
+        それより後の行だけを計算する。そうでなければ (過去の試合の修正など)、最初に変化した試合以降の行を
+        df の直前の行 (ローリング窓の長さ分) から計算し直す。
+        """
+        dates = df['date']
+        fixture_ids = df['fixture_id']
+
+        # チームごとの最初の変化 (変化した試合の新旧の (日付, fixture_id) のうち最も早いもの)
+        events = [
+            pd.DataFrame({'team': df.loc[dirty, side].astype(str), 'date': dates[dirty], 'fixture_id': fixture_ids[dirty]})
+            for side in ('home_team', 'away_team')
+        ] + [
+            pd.DataFrame({'team': previous_rows[side], 'date': pd.to_datetime(previous_rows['sort_date']),
+                          'fixture_id': previous_rows['fixture_id']})
+            for side in ('home_team', 'away_team')
+        ]
+        events = pd.concat(events, ignore_index=True).sort_values(['date', 'fixture_id'])
+        start = events.drop_duplicates('team').set_index('team')
+        affected = set(start.index)
+
+        # 保存済みの状態 (状態のないチームは FT 試合がまだないため、全ての行を最初から計算する)
+        states = self.load_team_state(affected)
+        state_points = pd.DataFrame(
+            [(team, pd.Timestamp(states[team]['last_date']), states[team]['last_fixture_id']) if team in states
+             else (team, pd.Timestamp.min, -1) for team in affected],
+            columns=['team', 'date', 'fixture_id'],
+        ).set_index('team').reindex(start.index)
+        seeded = ((start['date'] > state_points['date'])
+                  | ((start['date'] == state_points['date']) & (start['fixture_id'] > state_points['fixture_id']))).all()
+
+        def tail_mask(side, bounds, inclusive):
+            team = df[side].astype(str)
+            bound_date = team.map(bounds['date'])
+            bound_fixture = team.map(bounds['fixture_id'])
+            same_date = (dates == bound_date) & ((fixture_ids >= bound_fixture) if inclusive else (fixture_ids > bound_fixture))
+            return (dates > bound_date) | same_date
+
+        if seeded:
+            # 状態の最後の FT 試合より後の行を、状態の直近の試合に続けて計算する
+            home_tail = tail_mask('home_team', state_points, inclusive=False)
+            away_tail = tail_mask('away_team', state_points, inclusive=False)
+            tail_rows = df.loc[home_tail | away_tail, ['home_team', 'away_team'] + RAW_COLUMNS]
+            subset = pd.concat([self._history_rows(states), tail_rows])
+            source = "保存済みのチームの状態から計算"
+        else:
+            home_tail = tail_mask('home_team', start, inclusive=True)
+            away_tail = tail_mask('away_team', start, inclusive=True)
+            subset = df[(home_tail | away_tail) | self._context_mask(df, affected, home_tail, away_tail)]
+            source = f"全 {len(df)} 行のうち直前の試合を含む"
+
+        print(f"特徴量ストア: {int(dirty.sum())} 試合が変化、{len(affected)} チームの {int((home_tail | away_tail).sum())} 行を再計算します"
+              f" (計算対象 {len(subset)} 行: {source})。")
+
+        recomputed = add_team_features(subset.copy()).set_index('match_id')
+
+        # 保存済みの特徴量に再計算した行を上書きする
+        features = self._load_features(fixture_ids)
+        home_rows = df.index[home_tail]
+        away_rows = df.index[away_tail]
+        home_cols = HOME_ROLLING_COLUMNS + HOME_OVERALL_COLUMNS
+        away_cols = AWAY_ROLLING_COLUMNS + AWAY_OVERALL_COLUMNS
+        features.loc[home_rows, home_cols] = recomputed.loc[home_rows, home_cols].to_numpy()
+        features.loc[away_rows, away_cols] = recomputed.loc[away_rows, away_cols].to_numpy()
+        features['points_difference'] = features['home_total_points'] - features['away_total_points']
+
+        result = self._attach(df, features)
+
+        # 変化した行を保存し、削除された試合を取り除く
+        updated = home_tail | away_tail
+        self._save_features(result[updated], current_fp[updated])
+        removed_ids = set(previous_rows['fixture_id']) - set(fixture_ids)
+        self.conn.executemany("DELETE FROM team_features WHERE fixture_id = ?", [(int(i),) for i in removed_ids])
+        # 状態を進める (過去の試合から計算し直した場合は、状態も最初から作り直す)
+        if seeded:
+            self._save_team_state(self._team_states(result[updated], affected, states))
+        else:
+            self.conn.executemany("DELETE FROM team_state WHERE team = ?", [(team,) for team in affected])
+            self._save_team_state(self._team_states(result, affected))
+        self.conn.commit()
+        return result
+
+    @staticmethod
+    def _context_mask(df, affected, home_tail, away_tail):
+        """再計算を始める行より前に必要な直前の行 (ローリング窓の長さ分)"""
+        def side_context(side, tail):
+            team = df[side].astype(str)
+            before = team.isin(affected) & ~tail
+            rank_from_end = before[before].groupby(team[before]).cumcount(ascending=False)
+            mask = pd.Series(False, index=df.index)
+            mask[rank_from_end.index[rank_from_end < SIDE_CONTEXT_ROWS]] = True
+            return mask
+
+        context = side_context('home_team', home_tail) | side_context('away_team', away_tail)
+        # ホーム/アウェイ区別なしの成績は、両方の立場を合わせた直近の行が必要
+        long = pd.concat([
+            pd.DataFrame({'row': df.index, 'team': df['home_team'].astype(str), 'tail': home_tail}),
+            pd.DataFrame({'row': df.index, 'team': df['away_team'].astype(str), 'tail': away_tail}),
+        ]).sort_values('row', kind='stable')
+        long = long[long['team'].isin(affected) & ~long['tail']]
+        rank_from_end = long.groupby('team').cumcount(ascending=False)
+        context[long.loc[rank_from_end.values < OVERALL_CONTEXT_ROWS, 'row'].values] = True
+        return context
+
+    @staticmethod
+    def _history_rows(states):
+        """
+        状態の直近の試合を、add_team_features に渡せる試合の行にする (index は負の連番)。
+        相手チームは行ごとに別の仮の名前にして、他のチームの計算に影響しないようにする。
+        """
+        rows = []
+        for team, state in states.items():
+            for entry in state['history']:
+                opponent = f"__history_{len(rows)}"
+                row = {'home_team': team, 'away_team': opponent} if entry['side'] == 'home' else {'home_team': opponent, 'away_team': team}
+                row.update({col: entry[col] for col in RAW_COLUMNS})
+                rows.append(row)
+        return pd.DataFrame(rows, columns=['home_team', 'away_team'] + RAW_COLUMNS, index=-1 - np.arange(len(rows)))
+
+    def _team_states(self, rows, teams, base_states=None):
+        """
+        rows (時系列順、チーム単位の特徴量を追加済み) の teams の試合で状態 (base_states: 前回の状態) を進める。
+        状態は各チームの最後の FT 試合の時点のもの (FT 試合が rows にないチームは前回の状態のまま変わらない)。
+        """
+        base_states = base_states or {}
+        long = team_appearances(rows, teams).reset_index(drop=True)
+
+        # 各チームの最後の FT 試合より後の試合 (NS試合など) は状態に含めない
+        position = pd.Series(np.arange(len(long)))
+        is_ft = long['status'] == 'FT'
+        last_ft = position[is_ft].groupby(long.loc[is_ft, 'team']).max()
+        long = long[position <= long['team'].map(last_ft)].reset_index(drop=True)
+        if long.empty:
+            return {}
+
+        # 次の計算に必要な直近の試合だけを残す (trim_history と同じ条件を、追加した試合の側でまとめて判定する)
+        side_rank = long.groupby(['team', 'side']).cumcount(ascending=False)
+        in_season = long['season'] == long.groupby('team')['season'].transform('last')
+        season_rank = long[in_season].groupby('team').cumcount(ascending=False).reindex(long.index)
+        needed = (side_rank < SIDE_CONTEXT_ROWS) | (in_season & (season_rank < OVERALL_CONTEXT_ROWS))
+        first_needed = pd.Series(np.arange(len(long)))[needed].groupby(long.loc[needed, 'team']).min()
+        long = long[np.arange(len(long)) >= long['team'].map(first_needed)]
+
+        # 最後の FT 試合の特徴量 (ホーム側/アウェイ側はそれぞれ最後のホーム/アウェイ試合、区別なしは最後の試合)
+        ft = long[long['status'] == 'FT']
+        latest_parts = {
+            'home': ft[ft['side'] == 'home'].drop_duplicates('team', keep='last').set_index('team')[TEAM_ROLLING_COLUMNS],
+            'away': ft[ft['side'] == 'away'].drop_duplicates('team', keep='last').set_index('team')[TEAM_ROLLING_COLUMNS],
+            'overall': ft.drop_duplicates('team', keep='last').set_index('team')[TEAM_OVERALL_COLUMNS],
+        }
+        latest_parts = {part: values.to_dict('index') for part, values in latest_parts.items()}
+        last = ft.drop_duplicates('team', keep='last').set_index('team')
+
+        records = long[['side'] + RAW_COLUMNS].to_dict('records')
+        states = {}
+        for team, indices in long.groupby('team', sort=False).indices.items():
+            base = base_states.get(team, {'history': [], 'latest_features': {}})
+            latest = dict(base['latest_features'])
+            latest.update({part: values[team] for part, values in latest_parts.items() if team in values})
+            states[team] = {
+                'last_fixture_id': int(last.at[team, 'fixture_id']), 'last_date': str(last.at[team, 'date']),
+                'history': trim_history(base['history'] + [records[i] for i in indices]),
+                'latest_features': latest,
+            }
+        return states
+
+    # ----------------------------------------------------
+    # 読み書き
+    # ----------------------------------------------------
+    def _load_features(self, fixture_ids):
+        """保存済みの特徴量を fixture_ids の順に読み込む (未保存の試合は NaN)"""
+        stored = pd.read_sql_query(f"SELECT fixture_id, {', '.join(STORED_COLUMNS)} FROM team_features", self.conn)
+        features = pd.DataFrame({'fixture_id': fixture_ids.to_numpy()}).merge(stored, on='fixture_id', how='left')
+        features.index = fixture_ids.index
+        return features[STORED_COLUMNS]
+
+    def _attach(self, df, features):
+        """特徴量を add_team_features と同じカラム順・型で df に追加する"""
+        result = df.copy()
+        for col in TEAM_FEATURE_COLUMNS:
+            if col == 'match_id':
+                result[col] = result.index
+            elif col in FLOAT_COLUMNS:
+                result[col] = features[col].astype(float)
+            else:
+                result[col] = features[col].astype(int)
+        return result
+
+    def _save_features(self, result, fps):
+        if result.empty:
+            return
+        rows = pd.DataFrame({
+            'fixture_id': result['fixture_id'].astype(int),
+            'fingerprint': fps,
+            'sort_date': result['date'].astype(str),
+            'home_team': result['home_team'].astype(str),
+            'away_team': result['away_team'].astype(str),
+        })
+        for col in STORED_COLUMNS:
+            rows[col] = result[col]
+        columns = list(rows.columns)
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO team_features ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None)
+        )
+
+    def load_team_state(self, teams=None):
+        """
+        チームの状態を {チーム: 状態} で返す (teams を省略した場合は全チーム)。
+        状態: last_fixture_id / last_date (最後の FT 試合)、history (直近の試合の値)、
+        latest_features ({'home' / 'away': ローリング特徴量, 'overall': 区別なしの成績}。キーはチーム視点の特徴量名)
+        """
+        query = "SELECT team, last_fixture_id, last_date, history, latest_features FROM team_state"
+        params = []
+        if teams is not None:
+            params = [str(team) for team in teams]
+            query += f" WHERE team IN ({', '.join('?' * len(params))})"
+        return {
+            team: {'last_fixture_id': last_fixture_id, 'last_date': last_date,
+                   'history': json.loads(history), 'latest_features': json.loads(latest_features)}
+            for team, last_fixture_id, last_date, history, latest_features in self.conn.execute(query, params)
+        }
+
+    def _save_team_state(self, states):
+        self.conn.executemany('''
+        INSERT OR REPLACE INTO team_state (team, last_fixture_id, last_date, history, latest_features)
+        VALUES (?, ?, ?, ?, ?)
+        ''', [(team, state['last_fixture_id'], state['last_date'], json.dumps(state['history']), json.dumps(state['latest_features']))
+               for team, state in states.items()])
+
+    # ----------------------------------------------------
+    # 整合性チェック
+    # ----------------------------------------------------
+    def verify(self, df, result=None):
+        """
+        保存済み (または差分更新した) 特徴量が全再計算の結果と一致するかを確認し、不一致の行数を返す。
+        """
+        expected = add_team_features(df.copy())
+        if result is None:
+            result = self._attach(df, self._load_features(df['fixture_id']))
+        cols = TEAM_FEATURE_COLUMNS
+        mismatch = ~(expected[cols].eq(result[cols]) | (expected[cols].isna() & result[cols].isna())).all(axis=1)
+        if mismatch.any():
+            print(f"⚠️ 特徴量ストア: 全再計算と一致しない行が {int(mismatch.sum())} 行あります。"
+                  f" (fixture_id 例: {expected.loc[mismatch, 'fixture_id'].head(5).tolist()})")
+        else:
+            print(f"✅ 特徴量ストア: 全 {len(df)} 行が全再計算の結果と一致しました。")
+        return int(mismatch.sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="特徴量ストアの管理")
+    parser.add_argument("command", choices=["update", "verify", "rebuild"],
+                        help="update: 差分更新 / verify: 差分更新後に全再計算と比較 / rebuild: 破棄して全再計算")
+    args = parser.parse_args()
+
+    # パイプラインの前処理を使って特徴量を計算する
+    from prediction_pipeline1 import feature_engineering, load_match_data
+
+    store = FeatureStore(verify_on_update=(args.command == "verify"))
+    if args.command == "rebuild":
+        store.clear()
+    try:
+        matches_df, stats_df = load_match_data()
+        feature_engineering(matches_df, stats_df, feature_store=store)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
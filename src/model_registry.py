@@ -0,0 +1,180 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import lightgbm as lgb
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.path.join(SCRIPT_DIR, "..", "models", "registry")
+
+# --------------------------------------------------------------------------------
+# モデルレジストリ
+# models/registry/<バージョン>/
+#   model.txt : LightGBM のネイティブ形式 (テキスト) のモデル
+#   meta.json : 特徴量・カテゴリ・ラベルの順序・学習条件と、model.txt のハッシュ値
+# models/registry/CURRENT : 予測に使用するバージョン (ロールバックで切り替える)
+# pickle と違い、sklearn / lightgbm のバージョンに依存せずに読み込める。
+# --------------------------------------------------------------------------------
+
+# 保存しておくバージョン数 (古いものから削除する。CURRENT のバージョンは削除しない)
+KEEP_VERSIONS = 5
+
+MODEL_FILE = "model.txt"
+META_FILE = "meta.json"
+CURRENT_FILE = "CURRENT"
+
+
+def file_sha256(path):
+    """ファイルの内容のハッシュ値 (sha256)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    """保存されているバージョンを古い順に返す"""
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(name for name in os.listdir(registry_dir)
+                  if os.path.exists(os.path.join(registry_dir, name, META_FILE)))
+
+
+def current_version(registry_dir=REGISTRY_DIR):
+    """予測に使用するバージョン (保存されていない場合は None)"""
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def set_current(version, registry_dir=REGISTRY_DIR):
+    """CURRENT を version に切り替える (一時ファイルを置き換えるので、読み込み中に壊れない)"""
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"バージョン {version} は保存されていません")
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(path + ".tmp", path)
+
+
+def save_model(model, input_x, meta, registry_dir=REGISTRY_DIR, keep=KEEP_VERSIONS):
+    """
+    モデル (lgb.Booster) を新しいバージョンとして保存し、CURRENT にする。
+    input_x は学習に使った特徴量 (カラムの順序とカテゴリを記録する)。保存したバージョンを返す。
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=registry_dir, prefix=".staging-")
+    model_path = os.path.join(staging, MODEL_FILE)
+    model.save_model(model_path)
+    content_hash = file_sha256(model_path)
+
+    version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{content_hash[:8]}"
+    sidecar = {
+        **meta,
+        "version": version,
+        "sha256": content_hash,
+        "features": list(input_x.columns),
+        "categories": {col: input_x[col].cat.categories.astype(str).tolist()
+                       for col in input_x.columns if isinstance(input_x[col].dtype, pd.CategoricalDtype)},
+        "lightgbm_version": lgb.__version__,
+    }
+    with open(os.path.join(staging, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, ensure_ascii=False, indent=4)
+
+    # 書き込みが終わってから正式なディレクトリ名にする
+    os.replace(staging, os.path.join(registry_dir, version))
+    set_current(version, registry_dir)
+    prune_versions(keep, registry_dir)
+    return version
+
+
+def prune_versions(keep=KEEP_VERSIONS, registry_dir=REGISTRY_DIR):
+    """最新の keep 個のバージョンと CURRENT のバージョンを残して、古いバージョンを削除する"""
+    versions = list_versions(registry_dir)
+    current = current_version(registry_dir)
+    removed = [version for version in versions[:-keep] if version != current]
+    for version in removed:
+        shutil.rmtree(os.path.join(registry_dir, version))
+    return removed
+
+
+def load_meta(version=None, registry_dir=REGISTRY_DIR):
+    """バージョンの meta.json を返す (version を省略した場合は CURRENT。保存されていない場合は空の辞書)"""
+    version = version or current_version(registry_dir)
+    if version is None:
+        return {}
+    path = os.path.join(registry_dir, version, META_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_booster(model_path, content_hash):
+    """モデルファイルを読み込む (同じプロセスでは、同じ内容のファイルを読み込み直さない)"""
+    if file_sha256(model_path) != content_hash:
+        raise ValueError(f"モデルファイルのハッシュ値が meta.json と一致しません: {model_path}")
+    return lgb.Booster(model_file=model_path)
+
+
+def load_model(version=None, registry_dir=REGISTRY_DIR):
+    """
+    (モデル, meta) を返す (version を省略した場合は CURRENT)。
+    モデルは最初に使うときに読み込み、同じプロセスの2回目以降はキャッシュを返す。
+    """
+    meta = load_meta(version, registry_dir)
+    if not meta:
+        raise FileNotFoundError(f"モデルが保存されていません: {registry_dir} (バージョン: {version or 'CURRENT'})")
+    model_path = os.path.join(registry_dir, meta["version"], MODEL_FILE)
+    return _load_booster(os.path.abspath(model_path), meta["sha256"]), meta
+
+
+def rollback(version=None, registry_dir=REGISTRY_DIR):
+    """CURRENT を1つ前のバージョン (または指定したバージョン) に戻し、切り替えたバージョンを返す"""
+    if version is None:
+        versions = list_versions(registry_dir)
+        current = current_version(registry_dir)
+        older = versions[:versions.index(current)] if current in versions else []
+        if not older:
+            raise ValueError("戻せる前のバージョンがありません")
+        version = older[-1]
+    set_current(version, registry_dir)
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルレジストリの管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="保存されているバージョンを表示する (* が予測に使用するバージョン)")
+    rollback_parser = subparsers.add_parser("rollback", help="予測に使用するバージョンを戻す")
+    rollback_parser.add_argument("version", nargs="?", default=None, help="戻すバージョン (既定: 1つ前)")
+    parser.add_argument("--registry", default=REGISTRY_DIR, help="レジストリのディレクトリ")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        current = current_version(args.registry)
+        for version in list_versions(args.registry):
+            meta = load_meta(version, args.registry)
+            print(f"{'*' if version == current else ' '} {version}  mode: {meta.get('mode', '-')}, "
+                  f"木の数: {meta.get('num_trees', '-')}, 学習: {meta.get('trained_at', '-')}")
+    else:
+        try:
+            version = rollback(args.version, args.registry)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+        print(f"✅ 予測に使用するバージョンを {version} に戻しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+import data_access
+import dtype_policy
+import feature_snapshot
+import feature_store
+import model_registry
+import rolling_features
+import season_table
+import team_registry
+from feature_snapshot import load_snapshot, load_snapshot_meta, write_snapshot
+from feature_store import FeatureStore
+from prediction_pipeline1 import (
+    CV_WORKERS, DB_PATH, FEATURES, LEAGUE_ID, PIPELINE_STAGES, PREDICTIONS_JSON_PATH, PROJECT_ROOT,
+    PROMOTED_BASELINE_RULE, SEASON_DATA_PATH, TARGET, build_lgb_dataset, feature_engineering, final_num_boost_round,
+    fit_fold, full_training_meta, generate_dynamic_folds, load_match_data, load_params, make_fold_tasks, make_folds,
+    predict_and_save, save_predictions_json, to_train_params, train_final_model, train_lgb,
+)
+from season_table import file_sha256
+from team_registry import load_alias_ids
+
+# --------------------------------------------------------------------------------
+# パイプラインのステージ (ingest -> features -> snapshot -> folds -> cv -> train -> predict -> json)
+# 各ステージは入力の指紋 (ハッシュ値) をキーにして artifacts/<ステージ>/<キー>/ に出力を保存し、
+# 同じキーの出力が既にあれば何もしない。入力の指紋は次のものから作成する:
+# - DB のテーブル: 行数・最大の rowid・全行のチェックサム (DataFrame に読み込まずに計算する)
+# - ファイル (順位表CSV・予測結果JSON): 内容のハッシュ値
+# - 前のステージの出力: DataFrame の内容のハッシュ値
+# - 処理のソースコードとパラメータ (コードを変更したステージは自動的に実行し直す)
+# キーは前のステージの出力のハッシュ値を含むため、変化した出力に依存するステージだけが実行される。
+# (例: NS試合の日時だけが変わった場合、学習データは変わらないので folds / cv / train は実行されない)
+#   python src/prediction_pipeline1.py               # 全ステージ (入力が変わったステージのみ実行)
+#   python src/prediction_pipeline1.py cv            # ステージを1つ実行
+#   python src/prediction_pipeline1.py --force features cv
+# 保存済みの出力は合計サイズが ARTIFACT_BUDGET_MB を超えたら、最後に使われた日時が古いものから削除する。
+# --------------------------------------------------------------------------------
+
+ARTIFACT_DIR = os.path.join(PROJECT_ROOT, "artifacts")
+
+# 保存済みの出力の合計サイズの上限 (MB)。各ステージの最新の出力は削除しない
+ARTIFACT_BUDGET_MB = float(os.getenv("ARTIFACT_BUDGET_MB", "512"))
+
+# DataFrame は pickle を gzip (圧縮レベル1: 圧縮率より速度を優先) で圧縮して保存する
+FRAME_SUFFIX = ".pkl.gz"
+FRAME_COMPRESSION = {"method": "gzip", "compresslevel": 1}
+
+# テーブルのチェックサムを計算するときに一度に読み込む行数
+CHECKSUM_CHUNK_ROWS = 10000
+
+STAGES = PIPELINE_STAGES
+
+# ステージごとの処理のソースコード (変更されたらキーが変わり、実行し直す)。出力を変える呼び出し先のモジュールも含める
+STAGE_CODE = {
+    "ingest": [load_match_data, data_access],
+    "features": [feature_engineering, rolling_features, dtype_policy, season_table, team_registry, feature_store],
+    "snapshot": [feature_snapshot],
+    "folds": [make_folds, generate_dynamic_folds],
+    "cv": [train_lgb, fit_fold, make_fold_tasks, final_num_boost_round, build_lgb_dataset, to_train_params],
+    "train": [train_final_model, full_training_meta, build_lgb_dataset, to_train_params],
+    "predict": [predict_and_save],
+    "json": [save_predictions_json],
+}
+
+# CV・最終モデルの学習でスナップショットから読み込むカラム
+TRAIN_COLUMNS = [*FEATURES, TARGET, 'date']
+
+MANIFEST_FILE = "manifest.json"
+LATEST_FILE = "LATEST"
+
+
+def frame_hash(df):
+    """DataFrame の内容 (カラム・型・値) のハッシュ値"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def value_hash(value):
+    """JSON に変換できる値のハッシュ値"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def code_hash(stage):
+    """ステージの処理 (関数・モジュール) のソースコードのハッシュ値"""
+    return value_hash([inspect.getsource(obj) for obj in STAGE_CODE[stage]])
+
+
+def table_fingerprint(conn, table):
+    """テーブルの行数・最大の rowid・全行のチェックサム (DataFrame に読み込まずに計算する)"""
+    rows, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone()
+    digest = hashlib.sha256()
+    cursor = conn.execute(f"SELECT * FROM {table} ORDER BY rowid")
+    for chunk in iter(lambda: cursor.fetchmany(CHECKSUM_CHUNK_ROWS), []):
+        digest.update(repr(chunk).encode("utf-8"))
+    return {"rows": rows, "max_rowid": max_rowid, "checksum": digest.hexdigest()}
+
+
+# --------------------------------------------------------------------------------
+# 出力の保存・読み込み
+# --------------------------------------------------------------------------------
+def artifact_path(stage, key, name=""):
+    return os.path.join(ARTIFACT_DIR, stage, key, name)
+
+
+def latest_key(stage):
+    """ステージの最新 (最後に実行・確認した) の出力のキー (ない場合は None)"""
+    path = os.path.join(ARTIFACT_DIR, stage, LATEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def load_manifest(stage, key=None):
+    """ステージの出力の記録 (key を省略した場合は最新の出力。ない場合は None)"""
+    key = key or latest_key(stage)
+    if key is None:
+        return None
+    path = artifact_path(stage, key, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def set_latest(stage, key):
+    """ステージの最新の出力を key にし、最後に使われた日時 (manifest.json の更新日時) を更新する"""
+    path = os.path.join(ARTIFACT_DIR, stage, LATEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(key)
+    os.replace(path + ".tmp", path)
+    os.utime(artifact_path(stage, key, MANIFEST_FILE))
+
+
+def save_artifact(stage, key, inputs, frames=None, values=None):
+    """ステージの出力 (DataFrame と値) を保存し、記録を返す"""
+    directory = artifact_path(stage, key)
+    os.makedirs(directory, exist_ok=True)
+    outputs = {}
+    for name, df in (frames or {}).items():
+        df.to_pickle(os.path.join(directory, name + FRAME_SUFFIX), compression=FRAME_COMPRESSION)
+        outputs[name] = frame_hash(df)
+    manifest = {
+        "stage": stage, "key": key, "inputs": inputs, "outputs": outputs, "values": values or {},
+        "created_at": datetime.now().strftime("%Y/%m/%d %H:%M:%S"),
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4, default=str)
+    set_latest(stage, key)
+    evict_artifacts()
+    return manifest
+
+
+def load_frame(manifest, name):
+    return pd.read_pickle(artifact_path(manifest["stage"], manifest["key"], name + FRAME_SUFFIX),
+                          compression=FRAME_COMPRESSION["method"])
+
+
+def require_manifest(stage, upstream):
+    """前のステージの出力の記録を返す (ない場合はエラー)"""
+    manifest = load_manifest(upstream)
+    if manifest is None:
+        raise RuntimeError(f"{stage} の前に {upstream} を実行してください")
+    return manifest
+
+
+def cached(stage, inputs, force, is_valid=None):
+    """
+    入力の指紋 (ソースコードのハッシュ値を加える) からキーを作成し、(キー, 入力, 保存済みの出力の記録) を返す。
+    同じキーの出力が保存されていない場合、is_valid(記録) が False の場合 (ステージの外の出力が失われた場合など)、
+    force=True の場合、記録は None。
+    """
+    inputs = {**inputs, "code": code_hash(stage)}
+    key = value_hash(inputs)[:16]
+    manifest = None if force else load_manifest(stage, key)
+    if manifest is not None and is_valid is not None and not is_valid(manifest):
+        manifest = None
+    if manifest is not None:
+        set_latest(stage, key)
+        print(f"✅ {stage}: 入力に変更がないため、保存済みの出力を使用します ({key})")
+    return key, inputs, manifest
+
+
+# --------------------------------------------------------------------------------
+# 保存済みの出力の削除 (LRU)
+# --------------------------------------------------------------------------------
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def list_artifacts():
+    """保存済みの出力の (最後に使われた日時, ステージ, キー, サイズ) を、最後に使われた日時の古い順に返す"""
+    artifacts = []
+    for stage in STAGES:
+        stage_dir = os.path.join(ARTIFACT_DIR, stage)
+        if not os.path.isdir(stage_dir):
+            continue
+        for key in os.listdir(stage_dir):
+            manifest_path = artifact_path(stage, key, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                artifacts.append((os.path.getmtime(manifest_path), stage, key,
+                                  directory_size(artifact_path(stage, key))))
+    return sorted(artifacts)
+
+
+def evict_artifacts(budget_mb=None):
+    """合計サイズが budget_mb 以下になるまで、最後に使われた日時が古い出力から削除する (各ステージの最新は残す)"""
+    budget = (ARTIFACT_BUDGET_MB if budget_mb is None else budget_mb) * 1024 * 1024
+    artifacts = list_artifacts()
+    total = sum(size for *_, size in artifacts)
+    latest = {(stage, latest_key(stage)) for stage in STAGES}
+    removed = []
+    for _, stage, key, size in artifacts:
+        if total <= budget:
+            break
+        if (stage, key) in latest:
+            continue
+        shutil.rmtree(artifact_path(stage, key))
+        total -= size
+        removed.append(f"{stage}/{key}")
+    if removed:
+        print(f"保存済みの出力を {len(removed)} 件削除しました (合計 {total / 1024 / 1024:.1f} MB): {', '.join(removed)}")
+    return removed
+
+
+# --------------------------------------------------------------------------------
+# 各ステージ
+# --------------------------------------------------------------------------------
+def run_ingest(force=False):
+    """DB の試合データ・統計データを読み込み、内容が変わっていれば保存する"""
+    conn = data_access.connect(DB_PATH)
+    try:
+        inputs = {"matches": table_fingerprint(conn, "matches"),
+                  "match_statistics": table_fingerprint(conn, "match_statistics"), "league_id": LEAGUE_ID}
+    finally:
+        conn.close()
+    key, inputs, manifest = cached("ingest", inputs, force)
+    if manifest is None:
+        matches_df, stats_df = load_match_data()
+        manifest = save_artifact("ingest", key, inputs, frames={"matches": matches_df, "stats": stats_df})
+        print(f"✅ ingest: 試合データ {len(matches_df)} 件、統計データ {len(stats_df)} 件を保存しました ({key})")
+    return manifest
+
+
+def run_features(force=False):
+    """特徴量を作成し、学習データ (FT) と予測対象 (NS) を保存する"""
+    ingest = require_manifest("features", "ingest")
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        aliases = load_alias_ids(conn)
+    finally:
+        conn.close()
+    inputs = {
+        "ingest": ingest["outputs"],
+        "season_csv": file_sha256(SEASON_DATA_PATH) if os.path.exists(SEASON_DATA_PATH) else None,
+        "team_aliases": value_hash(aliases),
+        "promoted_baseline_rule": PROMOTED_BASELINE_RULE,
+    }
+    key, inputs, manifest = cached("features", inputs, force)
+    if manifest is None:
+        store = FeatureStore()
+        try:
+            train_df, predict_df = feature_engineering(load_frame(ingest, "matches"), load_frame(ingest, "stats"),
+                                                       feature_store=store)
+        finally:
+            store.close()
+        manifest = save_artifact("features", key, inputs, frames={"train": train_df, "predict": predict_df},
+                                 values={"latest_match_date": train_df['date'].max().isoformat(),
+                                         "n_matches": len(train_df)})
+        print(f"✅ features: 学習データ {len(train_df)} 件、予測対象 {len(predict_df)} 件を保存しました ({key})")
+    return manifest
+
+
+def run_snapshot(force=False):
+    """学習データ・予測対象を、リーグ・シーズンごとの Arrow ファイル (data/snapshot/) に保存する"""
+    features = require_manifest("snapshot", "features")
+    inputs = {"features": features["outputs"], "league_id": LEAGUE_ID}
+    # スナップショットが削除・上書きされていれば保存し直す
+    key, inputs, manifest = cached("snapshot", inputs, force, is_valid=lambda manifest: all(
+        load_snapshot_meta(name).get("source_hash") == frame for name, frame in features["outputs"].items()))
+    if manifest is None:
+        partitions = {}
+        for name, frame in features["outputs"].items():
+            meta = write_snapshot(load_frame(features, name), name, LEAGUE_ID, source_hash=frame)
+            partitions[name] = len(meta["partitions"])
+        manifest = save_artifact("snapshot", key, inputs, values={"partitions": partitions})
+        print(f"✅ snapshot: 学習データ・予測対象を {feature_snapshot.SNAPSHOT_DIR} に保存しました ({key})")
+    return manifest
+
+
+def load_train_columns(stage, features):
+    """スナップショットから学習データの TRAIN_COLUMNS だけを読み込む (features の出力と一致しない場合はエラー)"""
+    if load_snapshot_meta("train").get("source_hash") != features["outputs"]["train"]:
+        raise RuntimeError(f"{stage} の前に snapshot を実行してください")
+    return load_snapshot("train", columns=TRAIN_COLUMNS)
+
+
+def run_folds(force=False):
+    """CVの folds (学習データの最新の試合日から決まる) を保存する"""
+    features = require_manifest("folds", "features")
+    inputs = {"latest_match_date": features["values"]["latest_match_date"]}
+    key, inputs, manifest = cached("folds", inputs, force)
+    if manifest is None:
+        folds = make_folds(pd.DataFrame({"date": [pd.Timestamp(inputs["latest_match_date"])]}))
+        manifest = save_artifact("folds", key, inputs, values={"folds": folds})
+    return manifest
+
+
+def run_cv(force=False):
+    """時系列のfoldでCVを行い、KPIと最終モデルの木の数を保存する"""
+    features = require_manifest("cv", "features")
+    folds = require_manifest("cv", "folds")["values"]["folds"]
+    model_params = load_params()
+    inputs = {"train": features["outputs"]["train"], "folds": folds, "features": FEATURES, "params": model_params}
+    key, inputs, manifest = cached("cv", inputs, force)
+    if manifest is None:
+        train_df = load_train_columns("cv", features)
+        x_all, y_all = train_df[FEATURES], train_df[TARGET]
+        y_all_factorized, _ = pd.factorize(y_all)
+        mean_accuracy, mean_f1, target_labels, num_boost_round = train_lgb(
+            original_df=train_df, input_x=x_all, input_y=y_all, folds=folds, params=model_params,
+            n_workers=CV_WORKERS, dataset=build_lgb_dataset(x_all, y_all_factorized),
+        )
+        manifest = save_artifact("cv", key, inputs, values={
+            "mean_accuracy": mean_accuracy, "mean_f1": mean_f1, "num_boost_round": num_boost_round,
+            "target_labels": [str(label) for label in target_labels],
+        })
+    return manifest
+
+
+def run_train(force=False):
+    """全データで最終モデルを学習し、モデルレジストリに保存する"""
+    features = require_manifest("train", "features")
+    cv = require_manifest("train", "cv")
+    model_params = load_params()
+    inputs = {"train": features["outputs"]["train"], "features": FEATURES, "params": model_params,
+              "cv": cv["values"]}
+    # モデルレジストリから削除されたバージョンは学習し直す
+    key, inputs, manifest = cached("train", inputs, force, is_valid=lambda manifest: (
+        manifest["values"]["model_version"] in model_registry.list_versions()))
+    if manifest is None:
+        train_df = load_train_columns("train", features)
+        x_all = train_df[FEATURES]
+        y_all_factorized, target_labels = pd.factorize(train_df[TARGET])
+        meta = full_training_meta(x_all, train_df['date'], target_labels,
+                                  cv["values"]["mean_accuracy"], cv["values"]["mean_f1"])
+        model_version = train_final_model(x_all, y_all_factorized, model_params=model_params,
+                                          num_boost_round=cv["values"]["num_boost_round"], meta=meta)
+        manifest = save_artifact("train", key, inputs, values={"model_version": model_version})
+    return manifest
+
+
+def current_model_meta(stage):
+    """予測に使用するモデル (レジストリの CURRENT) の meta.json (ない場合はエラー)"""
+    model_meta = model_registry.load_meta()
+    if not model_meta:
+        raise RuntimeError(f"{stage} の前に train を実行してください")
+    return model_meta
+
+
+def run_predict(force=False):
+    """予測に使用するモデル (レジストリの CURRENT) で予測し、DB に保存する"""
+    features = require_manifest("predict", "features")
+    model_meta = current_model_meta("predict")
+    inputs = {"predict": features["outputs"]["predict"], "model": model_meta["sha256"]}
+    key, inputs, manifest = cached("predict", inputs, force)
+    if manifest is None:
+        df_results = predict_and_save(load_frame(features, "predict"), model_meta["version"])
+        manifest = save_artifact("predict", key, inputs, frames={"predictions": df_results},
+                                 values={"model_version": model_meta["version"]})
+    return manifest
+
+
+def run_json(force=False):
+    """Streamlit 向けに、予測結果とKPI (モデルの学習時のCV平均) を JSON として保存する"""
+    features = require_manifest("json", "features")
+    predict = require_manifest("json", "predict")
+    model_meta = current_model_meta("json")
+    inputs = {"predictions": predict["outputs"]["predictions"], "cv_accuracy": model_meta["cv_accuracy"],
+              "cv_f1": model_meta["cv_f1"], "n_matches": features["values"]["n_matches"]}
+    # JSON ファイルが削除・変更されていれば保存し直す
+    key, inputs, manifest = cached("json", inputs, force, is_valid=lambda manifest: (
+        os.path.exists(PREDICTIONS_JSON_PATH) and file_sha256(PREDICTIONS_JSON_PATH) == manifest["values"]["sha256"]))
+    if manifest is None:
+        df_results = load_frame(predict, "predictions")
+        if df_results.empty:
+            print("⚠️ 予測対象の試合がないため、JSON は保存しません。")
+            return None
+        save_predictions_json(df_results, inputs["cv_accuracy"], inputs["cv_f1"], inputs["n_matches"])
+        manifest = save_artifact("json", key, inputs, values={"sha256": file_sha256(PREDICTIONS_JSON_PATH)})
+    return manifest
+
+
+STAGE_FUNCTIONS = {
+    "ingest": run_ingest, "features": run_features, "snapshot": run_snapshot, "folds": run_folds, "cv": run_cv,
+    "train": run_train, "predict": run_predict, "json": run_json,
+}
+
+
+def run_stage(stage, force=False):
+    """ステージを1つ実行する (入力が変わっていなければ何もしない)"""
+    return STAGE_FUNCTIONS[stage](force=force)
+
+
+def run_pipeline(force_stages=()):
+    """全ステージを順番に実行する (入力が変わったステージと force_stages のステージのみ実行)"""
+    for stage in STAGES:
+        run_stage(stage, force=stage in force_stages)
+
+
+# --------------------------------------------------------------------------------
+# 保存済みの出力の確認・削除
+# --------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="パイプラインのステージの保存済みの出力の管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="保存済みの出力を表示する (* が各ステージの最新)")
+    evict_parser = subparsers.add_parser("evict", help="合計サイズが上限以下になるまで古い出力を削除する")
+    evict_parser.add_argument("--budget-mb", type=float, default=ARTIFACT_BUDGET_MB, help="合計サイズの上限 (MB)")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        artifacts = list_artifacts()
+        for used_at, stage, key, size in artifacts:
+            print(f"{'*' if key == latest_key(stage) else ' '} {stage:<8} {key}  {size / 1024:>8.1f} KB  "
+                  f"最終使用: {datetime.fromtimestamp(used_at).strftime('%Y/%m/%d %H:%M:%S')}")
+        print(f"合計: {sum(size for *_, size in artifacts) / 1024 / 1024:.1f} MB (上限 {ARTIFACT_BUDGET_MB:.0f} MB)")
+    elif not evict_artifacts(args.budget_mb):
+        print("✅ 削除する出力はありません。")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,32 @@
+import argparse
 import sqlite3
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import lightgbm as lgb
+import optuna
 from lightgbm import early_stopping, log_evaluation
 from sklearn.metrics import accuracy_score, log_loss, f1_score, classification_report
 from IPython.display import display
 
-import pickle
 import gc
 import os
 import datetime as dt
 from datetime import datetime
 import json 
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from rolling_features import add_team_features, fill_not_started_features
+from feature_store import FeatureStore
+from dtype_policy import MemoryReport, apply_dtype_policy, make_target
+from season_table import SEASON_COL_MAP, ensure_season_table, load_season_table, promoted_baseline, fill_promoted_teams
+from team_registry import load_alias_ids
+import data_access
+import model_registry
+from warm_start import (
+    TIME_FORMAT, continue_training, evaluate_warm_start, retrain_decision, training_meta, warm_start_rows,
+)
 
 # --------------------------------------------------------
 # ★★★ 修正点: 絶対パスの定義 ★★★
@@ -34,6 +48,16 @@ SEASON_DATA_PATH = os.path.join(PROJECT_ROOT, "data", "premier_league.csv")
 # モデル保存ディレクトリへのパス
 MODEL_DIR = os.path.join(PROJECT_ROOT, "models")
 
+# Streamlit アプリケーション向けの予測結果
+PREDICTIONS_JSON_PATH = os.path.join(PROJECT_ROOT, "data", 'latest_predictions.json')
+
+# 予測対象のリーグ (DBには複数リーグの試合が保存されている場合がある)
+LEAGUE_ID = 39  # プレミアリーグ
+
+# 昇格組 (前シーズンの成績がないチーム) の代理値ルール
+# "position_17": 17位の成績 / "relegated_average": 降格3チームの平均 / "championship": チャンピオンシップの成績から推定
+PROMOTED_BASELINE_RULE = "position_17"
+
 # --------------------------------------------------------
 
 #モデル学習に使用する特徴量の選択
@@ -47,6 +71,9 @@ FEATURES = ["home_team","away_team",'home_season_wins_ave_overall',
 
 TARGET = "target"
 
+# カテゴリ特徴量 (lgb.Dataset の作成時に一度だけ指定する)
+CATEGORICAL_FEATURES = ["home_team", "away_team"]
+
 #ハイパーパラメータの設定
 params = {
     "n_estimators":1000,
@@ -54,11 +81,34 @@ params = {
     "num_leaves":32
 }
 
+# CVの各foldを並列に学習するプロセス数 (1の場合は従来どおり順番に学習する)
+CV_WORKERS = int(os.getenv("CV_WORKERS", "1"))
 
-def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.DataFrame:
+# 最終モデルの木の数: CVの各foldで早期停止した best_iteration の中央値を、
+# 学習データの増加分 (全データ件数 / foldの平均学習件数) だけ増やして使用する (n_estimators が上限)
+FINAL_ROUNDS_SCALE_BY_DATA = True
+
+# --- ハイパーパラメータ探索 (tune モード) の設定 ---
+# 探索で見つかった最良のパラメータ (存在する場合は params より優先して学習に使用する)
+BEST_PARAMS_PATH = os.path.join(MODEL_DIR, "best_params.json")
+# Optuna の study の保存先 (中断後の再開や、複数プロセスでの並列探索に使用)
+OPTUNA_STORAGE = "sqlite:///" + os.path.join(PROJECT_ROOT, "db", "optuna.db")
+STUDY_NAME = "lgb_match_result"
+# 探索の制限時間 (秒)。夜間バッチの時間内に収まるように設定する
+TUNE_TIMEOUT_SECONDS = int(os.getenv("TUNE_TIMEOUT", "3600"))
+# 何イテレーションごとに途中経過を報告して枝刈りを判定するか
+PRUNING_INTERVAL = 10
+
+
+def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame, feature_store=None) -> pd.DataFrame:
     """
     matchesデータとstatisticsデータを結合し、前処理と特徴量計算を実行する。
+    feature_store (FeatureStore) を渡すと、チーム単位の特徴量を差分更新する。
+    各ステージの前後で DataFrame のメモリ使用量を表示する (データ型は dtype_policy に従う)。
     """
+    memory_report = MemoryReport()
+    memory_report.start(matches_df)
+
     # ホームチーム用統計データのカラム名を変更
     home_stats = stats_df.copy()
     home_stats = home_stats.rename(columns={
@@ -94,6 +144,7 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
     # 統計データを試合データに結合
     df = pd.merge(matches_df, home_stats, on=['fixture_id', 'home_team'], how='left')
     df = pd.merge(df, away_stats, on=['fixture_id', 'away_team'], how='left')
+    memory_report.stage("統計データの結合", df)
 
     # ----------------------------------------------------
     # 3. 欠損値処理 (FT データのみを対象)
@@ -108,6 +159,7 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
 
     # statusがFTのデータとNSのデータを再結合
     df = pd.concat([merged_df_FT, merged_df_NS], ignore_index=True)
+    memory_report.stage("欠損値処理", df)
 
 
 
@@ -115,38 +167,33 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
     # 4. 過去シーズンのデータを結合（昇格チームの欠損値処理も含む）
     # ----------------------------------------------------
     
+    # 過去シーズンの順位表は DB に取り込み済みのもの (チーム名は team_id に正規化済み) を使用する。
+    # CSV が未取り込み、または変更されている場合のみ取り込み直す (season_table.py)
+    conn = sqlite3.connect(DB_PATH)
     try:
-        # 過去シーズンのデータを読み込み (★修正: 絶対パスを使用)
-        season_df = pd.read_csv(SEASON_DATA_PATH)
-        season_df = season_df.drop(columns = ["played","notes"],axis = 1)
-    except FileNotFoundError:
-        # スクリプトパスが間違っているか、ファイルが存在しない場合のエラー表示
-        print(f"エラー: 過去シーズンデータ '{SEASON_DATA_PATH}' が見つかりません。過去シーズン成績の結合をスキップします。")
-        return df # ファイルがない場合は結合せずにそのまま返す
-
-    # 2つのデータフレームのチーム名の表記の仕方をそろえる
-    mapping = {'Manchester City':'Manchester City','Manchester Utd':'Manchester United','Liverpool':'Liverpool','Chelsea':'Chelsea',
-              'Leicester City':'Leicester','West Ham':'West Ham','Tottenham':'Tottenham','Arsenal':'Arsenal','Leeds United':'Leeds',
-              'Everton':'Everton','Aston Villa':'Aston Villa','Newcastle Utd':'Newcastle','Wolves':'Wolves','Crystal Palace':'Crystal Palace',
-              'Southampton':'Southampton','Brighton':'Brighton','Burnley':'Burnley','Fulham':'Fulham','Sheffield Utd':'Sheffield Utd',
-              'Brentford':'Brentford','Watford':'Watford','Norwich City':'Norwich','Bournemouth':'Bournemouth','Nottingham Forest':'Nottingham Forest','Luton Town':'Luton','Ipswich':'Ipswich'}    
+        if not ensure_season_table(conn, SEASON_DATA_PATH):
+            # スクリプトパスが間違っているか、ファイルが存在しない場合のエラー表示
+            print(f"エラー: 過去シーズンデータ '{SEASON_DATA_PATH}' が見つかりません。過去シーズン成績の結合をスキップします。")
+            return df # ファイルがない場合は結合せずにそのまま返す
+        season_df = load_season_table(conn)
+        team_ids = load_alias_ids(conn)
+    finally:
+        conn.close()
 
-     # チーム名の表記を統一
-    season_df["team"] = season_df["team"].replace(mapping) 
+    # 試合データのチーム名を team_id に変換し、整数のキーで結合する (レジストリにないチームは -1)
+    for side in ("home", "away"):
+        df[f"{side}_team_id"] = df[f"{side}_team"].map(team_ids).fillna(-1).astype(np.int64)
+    season_join_df = season_df.drop(columns=["team"])
 
 
     # --- 結合後の新しいカラム名の定義 ---
     # premier_league.csv の 'points' のリネーム
-    season_col_map = {
-        "points":"last_points", 
-        "position":"last_position", "won":"last_won", "drawn":"last_drawn", 
-        "lost":"last_lost", "gf":"last_gf", "ga":"last_ga", "gd":"last_gd"
-    }
+    season_col_map = SEASON_COL_MAP
 
     # 1. ホームチームとして結合するためのデータ準備
-    season_home_df = season_df.rename(columns = season_col_map)
+    season_home_df = season_join_df.rename(columns = season_col_map)
     season_home_df = season_home_df.rename(columns = {
-        "season_end_year":"season", "team":"home_team",
+        "season_end_year":"season", "team_id":"home_team_id",
     })
     
     # 結合後の列名に 'home_' 接頭辞を付加
@@ -154,9 +201,9 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
     season_home_df = season_home_df.rename(columns = new_home_cols)
 
     # 2. アウェイチームとして結合するためのデータ準備
-    season_away_df = season_df.rename(columns = season_col_map)
+    season_away_df = season_join_df.rename(columns = season_col_map)
     season_away_df = season_away_df.rename(columns = {
-        "season_end_year":"season", "team":"away_team",
+        "season_end_year":"season", "team_id":"away_team_id",
     })
 
     # 結合後の列名に 'away_' 接頭辞を付加
@@ -164,55 +211,21 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
     season_away_df = season_away_df.rename(columns = new_away_cols)
 
     # --- 結合ロジック ---
-    df = pd.merge(df, season_home_df, on = ["season","home_team"], how = "left")
-    df = pd.merge(df, season_away_df, on = ["season","away_team"], how = "left")
+    df = pd.merge(df, season_home_df, on = ["season","home_team_id"], how = "left")
+    df = pd.merge(df, season_away_df, on = ["season","away_team_id"], how = "left")
+    df = df.drop(columns = ["home_team_id", "away_team_id"])
     # この時点で、dfには 'home_last_points' などが追加され、昇格組は NaN
+    memory_report.stage("過去シーズンデータの結合", df)
 
     # ----------------------------------------------------
-    # 5. 昇格組の欠損値処理（各試合の【結合済みの前シーズン】の17位の値で埋める）
+    # 5. 昇格組の欠損値処理（各試合の【結合済みの前シーズン】の代理値で埋める）
     # ----------------------------------------------------
-    
-   # 欠損値を埋める対象となる、season_df内の【元の列名】
-    original_cols = list(season_col_map.keys()) # ['points', 'position', 'won', 'drawn', ...]
-    
-    # 試合のシーズンごとに欠損値の埋め立てを実行
-    for target_season in df['season'].unique():
-        # target_season は試合が行われるシーズンの終了年 (例: 2025年)
-        # season_dfの target_season の行は、その試合の前シーズンの成績 (2025年終了のシーズン)
-        
-        # 17位チームの成績を取得
-        relegation_avoidance_team = season_df[
-            (season_df["season_end_year"] == target_season) & 
-            (season_df["position"] == 17)
-        ]
-        
-        # 代理値ルックアップテーブルを作成
-        fill_values = {}
-        if not relegation_avoidance_team.empty:
-            for original_col in original_cols:
-                # 17位の成績をそのまま取得
-                val = relegation_avoidance_team[original_col].iloc[0] 
-                
-                # 結合後のカラム名（ home_last_points など）を生成
-                new_suffix = season_col_map[original_col] 
-                
-                fill_values[f'home_{new_suffix}'] = val
-                fill_values[f'away_{new_suffix}'] = val
-        else:
-             print(f"警告: シーズン {target_season} の17位のデータが見つかりませんでした。このシーズンの昇格組の処理をスキップします。")
-             continue
-        
-        # このシーズン（target_season）の試合に限定して欠損値を埋める
-        target_fill_cols = list(fill_values.keys())
-
-        # 欠損値（昇格組）に対してのみ、17位の値で埋める
-        for full_col_name in target_fill_cols:
-            is_target_season = df['season'] == target_season
-            is_nan = df[full_col_name].isna()
-            
-            # 論理インデックスを使用して、対象のセルのみに値を代入
-            df.loc[is_target_season & is_nan, full_col_name] = fill_values[full_col_name]
 
+    # シーズンごとの代理値テーブル (デフォルトは17位の成績) を一度だけ作成し、
+    # ホーム側/アウェイ側それぞれ1回の参照で欠損値を埋める
+    baseline = promoted_baseline(season_df, rule=PROMOTED_BASELINE_RULE, alias_ids=team_ids)
+    df = fill_promoted_teams(df, baseline)
+    memory_report.stage("昇格組の欠損値処理", df)
 
     # ----------------------------------------------------
     # 6. データタイプの変換と列の削除
@@ -231,60 +244,28 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
     
     # -------------------------------------------------特徴量エンジニアリング（ここからユーザー提供ロジック）----------------------------------------------------------------
 
-    # カラムの型変換（Int64: 欠損値を許容する整数型）
-    df[['home_passes_accuracy','home_yellow_cards', 'home_red_cards','away_passes_accuracy',
-                'away_yellow_cards', 'away_red_cards','home_last_position', 'home_last_won', 'home_last_drawn',
-                'home_last_lost', 'home_last_gf', 'home_last_ga', 'home_last_gd','home_last_points',
-                'away_last_position', 'away_last_won','away_last_drawn', 'away_last_lost', 
-                'away_last_gf', 'away_last_ga','away_last_gd', 'away_last_points']] = df[['home_passes_accuracy',
-                                                                    'home_yellow_cards', 'home_red_cards','away_passes_accuracy',
-                                                                    'away_yellow_cards', 'away_red_cards','home_last_position', 
-                                                                    'home_last_won', 'home_last_drawn','home_last_lost', 
-                                                                    'home_last_gf', 'home_last_ga', 'home_last_gd','home_last_points',
-                                                                    'away_last_position', 'away_last_won','away_last_drawn', 
-                                                                    'away_last_lost', 'away_last_gf', 'away_last_ga',
-                                                                    'away_last_gd', 'away_last_points']].astype("Int64")
-
-
     # データを日付とfixture_idでソート (時系列順に並べるため)
     df = df.sort_values(by=['date', 'fixture_id']).reset_index(drop=True)    
 
-    #targetカラム作成(試合の勝敗カラム)　H:home win, A:away win, D:draw
-    def target_create(row):
-        if row["home_score"] > row["away_score"]:
-            return  "H"    
-        
-        elif row["home_score"] < row["away_score"]:
-            return  "A"  
-        
-        else:
-            return  "D"  
-        
-    
-    df["target"] = df.apply(target_create,axis = 1)
-
-    # objectからcategoryに変換したいカラム
-    columns = ["home_team","away_team","status","target"]
-    
-    # タイプ変換関数
-    def change_type(columns):
-        for col in columns:
-            df[col] = df[col].astype("category")
-        return df
-    
-    df = change_type(columns) 
+    #targetカラム作成(試合の勝敗カラム)　H:home win, A:away win, D:draw (np.select でベクトル化)
+    df["target"] = make_target(df["home_score"], df["away_score"])
 
     df['date'] = pd.to_datetime(df['date'], errors='coerce')
     # タイムゾーン情報を削除
     df['date'] = df['date'].dt.tz_localize(None)
 
+    # データ型ポリシーを適用 (件数などは欠損値がなければ int8/int16、欠損値を含む数値は float32、
+    # チーム名はホーム/アウェイ共通のカテゴリ辞書、status/target は category)
+    df = apply_dtype_policy(df)
+    memory_report.stage("データ型の変換", df)
+
 
     # ホーム勝利を示す一時的な列を作成
     # 'target'が 'H' の場合に1、それ以外は0
-    df['is_home_win'] = (df['target'] == 'H').astype(int)
+    df['is_home_win'] = (df['target'] == 'H').astype(np.int8)
     # アウェイ勝利を示す一時的な列を作成
     # 'target'が 'Ａ' の場合に1、それ以外は0
-    df['is_away_win'] = (df['target'] == 'A').astype(int)
+    df['is_away_win'] = (df['target'] == 'A').astype(np.int8)
     
     # 得失点差カラム作成
     df["home_goal_difference"] = df["home_score"] - df["away_score"]
@@ -292,288 +273,32 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
 
 
     # --------------------------------------------------------------------------------
-    # 過去の試合結果に基づくローリング特徴量計算（.transform()で安全に置き換え）
+    # 過去の試合結果に基づくローリング特徴量計算
     # --------------------------------------------------------------------------------
 
-    # --- 直近N試合の勝利数/スコア/得失点差のローリング計算関数 ---
-    def calculate_rolling_feature(df, group_col, target_col, window_size, new_col_name, agg_func='sum'):
-        """
-        グループごとにローリング集計を行い、1つシフトした結果を新しいカラムとして追加する。
-        group_col: グループ化するカラム ('home_team' or 'away_team')
-        target_col: 集計対象のカラム ('is_home_win', 'home_score', 'home_goal_difference' など)
-        window_size: ローリングウィンドウサイズ (直近N試合なら N+1)
-        new_col_name: 新しい特徴量のカラム名
-        agg_func: 集計関数 ('sum' or 'mean')
-        """
-        # ローリング計算。window_sizeは現在の行を含むため、直近N試合を見る場合は N+1
-        # shift(1)で現在の試合結果を除外し、fillna(0)で試合前のNaNを埋める
-        if agg_func == 'sum':
-            new_feature = df.groupby(group_col, observed=False)[target_col].transform(
-                lambda x: x.rolling(window=window_size, min_periods=1).sum().shift(1).fillna(0)
-            ).astype(int)
-        elif agg_func == 'mean':
-            # 勝率の場合、結果をパーセンテージにし、小数点第2位まで丸める
-            new_feature = df.groupby(group_col, observed=False)[target_col].transform(
-                lambda x: (x.rolling(window=window_size, min_periods=1).mean().shift(1) * 100).round(2).fillna(0)
-            )
-        else:
-            raise ValueError("Unsupported agg_func")
-            
-        df[new_col_name] = new_feature
-        return df
-
-    # 直近5試合 (window=6) の計算
-    df = calculate_rolling_feature(df, 'home_team', 'is_home_win', 6, 'home_team_recent_5_wins')
-    df = calculate_rolling_feature(df, 'away_team', 'is_away_win', 6, 'away_team_recent_5_wins')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'home_score', 6, 'home_recent_5_scores')
-    df = calculate_rolling_feature(df, 'away_team', 'away_score', 6, 'away_recent_5_scores')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'away_score', 6, 'home_recent_5_goal_against')
-    df = calculate_rolling_feature(df, 'away_team', 'home_score', 6, 'away_recent_5_goal_against')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'home_goal_difference', 6, 'home_recent_5_goal_diff')
-    df = calculate_rolling_feature(df, 'away_team', 'away_goal_difference', 6, 'away_recent_5_goal_diff')
-
-
-    # 直近10試合 (window=11) の計算
-    df = calculate_rolling_feature(df, 'home_team', 'home_score', 11, 'home_recent_10_scores')
-    df = calculate_rolling_feature(df, 'away_team', 'away_score', 11, 'away_recent_10_scores')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'away_score', 11, 'home_recent_10_goal_against')
-    df = calculate_rolling_feature(df, 'away_team', 'home_score', 11, 'away_recent_10_goal_against')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'home_goal_difference', 11, 'home_recent_10_goal_diff')
-    df = calculate_rolling_feature(df, 'away_team', 'away_goal_difference', 11, 'away_recent_10_goal_diff')
-
-    
-    # 直近20試合 (window=21) の計算
-    df = calculate_rolling_feature(df, 'home_team', 'home_score', 21, 'home_recent_20_scores')
-    df = calculate_rolling_feature(df, 'away_team', 'away_score', 21, 'away_recent_20_scores')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'away_score', 21, 'home_recent_20_goal_against')
-    df = calculate_rolling_feature(df, 'away_team', 'home_score', 21, 'away_recent_20_goal_against')
-    
-    df = calculate_rolling_feature(df, 'home_team', 'home_goal_difference', 21, 'home_recent_20_goal_diff')
-    df = calculate_rolling_feature(df, 'away_team', 'away_goal_difference', 21, 'away_recent_20_goal_diff')
-
-
-    #------------------勝ち点カラム作成 (ホーム/アウェイ区別なしの全体成績)--------------------
-    # 
-    # 各試合に一意のIDを付与 (後のマージのために利用)
-    df['match_id'] = df.index 
-    
-    # 2. チーム視点でのデータ作成 (スタッキング)
-    # -----------------------------------------------
-    
-    # ① ホームチーム視点のデータフレームを作成
-    df_home = df[['match_id','season','date', 'home_team', 'target']].copy()
-    df_home.rename(columns={'home_team': 'team'}, inplace=True)
-    # 勝ち点計算
-    df_home['points'] = df_home['target'].map({"H":3,"D":1,"A":0})
-    # 勝利フラグ (勝率計算用)
-    df_home['is_win'] = (df_home['target'] == 'H').astype(int)
-    
-    # # ② アウェイチーム視点のデータフレームを作成
-    df_away = df[['match_id','season', 'date', 'away_team', 'target']].copy()
-    df_away.rename(columns={'away_team': 'team'}, inplace=True)
-    
-    # 勝ち点計算
-    df_away['points'] = df_away['target'].map({"H":0,"D":1,"A":3})
-    
-    # 勝利フラグ (勝率計算用)
-    df_away['is_win'] = (df_away['target'] == 'A').astype(int)
-    
-    # # ③ 2つの視点のデータを結合し、時系列順にソート
-    df_stacked = pd.concat([df_home, df_away],ignore_index=True)
-    df_stacked = df_stacked.sort_values(by=['date', 'match_id']).reset_index(drop=True)
-
-
-    # seasonとteamでグループ化し、各シーズン内での合計勝ち点 (試合前まで) を計算
-    # transform を利用して累積勝ち点を計算
-    df_stacked['total_points'] = df_stacked.groupby(["season","team"], observed=False)["points"].transform(
-        # 勝ち点の累積和を計算し、1つシフト (現在の試合結果を除く)、NaNを0で埋める
-        lambda x: x.rolling(window = 38,min_periods = 1).sum().shift(1).fillna(0)
-    ).astype(int) 
-    
-
-    
-    
-    # ホームチームの総合成績フィーチャーを抽出 (match_id と team で紐づけ)
-    df_home_points = df_stacked[['match_id','team','total_points']].copy()
-    df_home_points.rename(columns={'team': 'home_team', 'total_points': 'home_total_points'}, inplace=True)
-    
-    # マージ
-    df = pd.merge(
-        df,
-        df_home_points,
-        on = ['match_id','home_team'],
-        how = 'left'
-    )
-    # アウェイチームの総合成績フィーチャーを抽出
-    df_away_points = df_stacked[['match_id','team','total_points']].copy()
-    df_away_points.rename(columns={'team': 'away_team', 'total_points': 'away_total_points'}, inplace=True)
-    
-    # マージ
-    df = pd.merge(
-        df,
-        df_away_points,
-        on = ['match_id','away_team'],
-        how = 'left'
-    )
-    
-    df['home_total_points'] = df['home_total_points'].astype(int)
-    df['away_total_points'] = df['away_total_points'].astype(int)
-    
-    
-    # home teamとaway teamの勝ち点差カラムを作成
-    df["points_difference"] = df['home_total_points'] - df['away_total_points']
-
-
-    # --------------各チームの直近5試合での勝利数カラム作成(home、アウェイの区別なし)-----------------
-    
-    # 総合成績のローリング計算 (home, away区別なし)
-    
-    # チーム視点での直近5試合の勝率
-    df_stacked['recent_5_wins_overall'] = df_stacked.groupby(['season','team'], observed=False)['is_win'].transform(
-        lambda x: x.rolling(window=6, min_periods=1).mean().shift(1).fillna(0)
-    ).astype(int)
-
-    # チーム視点でのシーズン勝率
-    df_stacked['season_wins_ave_overall_temp'] = df_stacked.groupby(['season','team'], observed=False)['is_win'].transform(
-        lambda x: (x.rolling(window=38, min_periods=1).mean().shift(1) * 100).round(2).fillna(0)
-    )
-
-    
-    # -------------------home teamへのマージ------------------------
-    
-    # ホームチームの総合成績フィーチャーを抽出
-    df_home_feature = df_stacked[['match_id', 'team', 'recent_5_wins_overall', 'season_wins_ave_overall_temp']].copy()
-    df_home_feature.rename(columns={
-        'team': 'home_team',
-        'recent_5_wins_overall': 'home_team_recent_5_wins_overall',
-        'season_wins_ave_overall_temp': 'home_season_wins_ave_overall'
-    }, inplace=True)
-    
-    # 元のデータフレームにマージ
-    df = pd.merge(
-        df, 
-        df_home_feature, 
-        on=['match_id', 'home_team'], 
-        how='left'
-    )
-    
-    
-    # ------------------away teamへのマージ--------------------
-    
-    # アウェイチームの総合成績フィーチャーを抽出
-    df_away_feature = df_stacked[['match_id', 'team', 'recent_5_wins_overall', 'season_wins_ave_overall_temp']].copy()
-    df_away_feature.rename(columns={
-        'team': 'away_team',
-        'recent_5_wins_overall': 'away_team_recent_5_wins_overall',
-        'season_wins_ave_overall_temp': 'away_season_wins_ave_overall'
-    }, inplace=True)
-    
-    # 元のデータフレームにマージ
-    df = pd.merge(
-        df, 
-        df_away_feature, 
-        on=['match_id', 'away_team'], 
-        how='left'
-    )
-
+    # 直近5/10/20試合の勝利数/得点/失点/得失点差 (home/away 別) を、
+    # グループごとに1回の並べ替えと累積和の差分でまとめて計算する (定義は rolling_features.ROLLING_SPECS)。
+    # 続けてホーム/アウェイ区別なしの勝ち点・勝率を計算する。
+    # 特徴量ストアを使う場合は、前回から変化した試合に関係するチームの行のみ再計算する。
+    if feature_store is not None:
+        df = feature_store.update(df)
+    else:
+        df = add_team_features(df)
+    memory_report.stage("チーム単位の特徴量", df)
 
     # ------------------ NS (Not Started) 試合の欠損値補完 ------------------
-    # 2025年シーズンのまだ行われていない試合(status="NS")に対し、直前の "FT" (Full Time) の試合結果でデータを補完する。
-    
-    fill_features_home = ['home_team_recent_5_wins',
-                          'home_recent_5_scores', 
-                          'home_recent_5_goal_diff', 
-                          'home_recent_5_goal_against', 
-                          'home_recent_10_scores', 
-                          'home_recent_10_goal_diff', 
-                          'home_recent_10_goal_against', 
-                          'home_recent_20_scores', 
-                          'home_recent_20_goal_diff', 
-                          'home_recent_20_goal_against']
-    
-    
-    fill_features_away = ['away_team_recent_5_wins',
-                          'away_recent_5_scores',
-                          'away_recent_5_goal_diff',
-                          'away_recent_5_goal_against',
-                          'away_recent_10_scores',
-                          'away_recent_10_goal_diff',
-                          'away_recent_10_goal_against',
-                          'away_recent_20_scores',
-                          'away_recent_20_goal_diff',
-                          'away_recent_20_goal_against']
-    
-    fill_features_home_overall = ['home_total_points','home_team_recent_5_wins_overall','home_season_wins_ave_overall']
-    
-    fill_features_away_overall = ['away_total_points','away_team_recent_5_wins_overall','away_season_wins_ave_overall']
-
-    # 2025年シーズンのチームリストを取得
-    teams = df[df["season"] == 2025]["home_team"].unique()
-
-    # ホーム限定データ (homeでの試合のみでカウントしているデータ) の補充
-    for team in teams:
-        # 置き換え元（FTのそのチームの最終ホーム試合）の fill_features を取得
-        source_df = df[(df["status"] == "FT") & (df["home_team"] == team)].sort_values("date")
-        if not source_df.empty:
-            source_vals = source_df.iloc[-1][fill_features_home]
-        
-            # 置き換え先（NSのそのチームのホーム試合）に代入
-            df.loc[(df["status"] == "NS") & (df["home_team"] == team), fill_features_home] = source_vals.values
-        
-    # アウェイ限定データ (awayでの試合のみでカウントしているデータ) の補充
-    for team in teams:
-        # 置き換え元（FTのそのチームの最終アウェイ試合）の fill_features を取得
-        source_df = df[(df["status"] == "FT") & (df["away_team"] == team)].sort_values("date")
-        if not source_df.empty:
-            source_vals = source_df.iloc[-1][fill_features_away]
-        
-            # 置き換え先（NSのそのチームのアウェイ試合）に代入
-            df.loc[(df["status"] == "NS") & (df["away_team"] == team), fill_features_away] = source_vals.values
-        
-    # home,awayの区別なしでカウントしているデータ (overall) の補充
-    for team in teams:
-        # 1. 最新試合を日付順で取得
-        source_df = df[(df["status"] == "FT") & ((df["home_team"] == team) | (df["away_team"] == team))].sort_values("date")
-        if source_df.empty:
-            continue
-        
-        last_row = source_df.iloc[-1]
-        
-        # 2. 対象チームが最新試合でホームだったかアウェイだったかを判別
-        team_was_home = last_row["home_team"] == team
-        
-        # 3. 最新試合の行から、対象チーム自身の統計値のみを1セット取得
-        if team_was_home:
-            # チームがホームの場合、統計値は home_overall カラムにある
-            latest_team_vals = last_row[fill_features_home_overall].values
-        else:
-            # チームがアウェイの場合、統計値は away_overall カラムにある
-            latest_team_vals = last_row[fill_features_away_overall].values
-            
-        # 4. NS の行ごとに index を取得
-        ns_home_idx = df[(df["status"] == "NS") & (df["home_team"] == team)].index
-        ns_away_idx = df[(df["status"] == "NS") & (df["away_team"] == team)].index
-        
-        # 5. ホームチームとして NS の行に、対象チームの統計値で代入
-        if len(ns_home_idx) > 0:
-            # 未来のホーム試合の「ホーム側」カラムに、対象チームの統計値を埋める
-            df.loc[ns_home_idx, fill_features_home_overall] = [latest_team_vals] * len(ns_home_idx)
-        
-        # 6. アウェイチームとして NS の行に、対象チームの統計値で代入
-        if len(ns_away_idx) > 0:
-            # 未来のアウェイ試合の「アウェイ側」カラムに、対象チームの統計値を埋める
-            df.loc[ns_away_idx, fill_features_away_overall] = [latest_team_vals] * len(ns_away_idx)
-
+    # まだ行われていない試合(status="NS")に対し、各チームの直前の "FT" (Full Time) の試合結果でデータを補完する。
+    # (チームごとのループではなく、merge_asof による日付の as-of 結合でまとめて補完する)
+    df = fill_not_started_features(df)
 
     # 一時的なカラムを削除
     df.drop(columns=['home_goal_difference', 'away_goal_difference', 'is_home_win', 'is_away_win', 'match_id'], inplace=True, errors='ignore')
 
+    # 追加した特徴量にもデータ型ポリシーを適用
+    df = apply_dtype_policy(df)
+    memory_report.stage("NS試合の補完・型の圧縮", df)
+    memory_report.summary()
+
     # statusがFTの試合を除外して学習データを作成
     train_df = df[df["status"] == "FT"].copy().reset_index(drop=True)
     # 予測対象データ（statusがNSの試合）を抽出
@@ -585,8 +310,8 @@ def feature_engineering(matches_df: pd.DataFrame, stats_df: pd.DataFrame) -> pd.
 # 評価関数 (evaluate_model)
 # --------------------------------------------------------------------------------
 def evaluate_model(model, X, y):
-    """モデルを評価し、各種メトリクスを計算する"""
-    y_pred_proba = model.predict_proba(X)
+    """モデル (lgb.Booster) を評価し、各種メトリクスを計算する"""
+    y_pred_proba = model.predict(X)
     pred_idx = np.argmax(y_pred_proba, axis=1)
     
     # 評価は factorize された数値ラベル (0, 1, 2) に対して行う
@@ -638,16 +363,192 @@ def generate_dynamic_folds(end_date_str, n_folds=3, val_period_days=30, gap_days
         
     return folds
 
+
+def make_folds(train_df):
+    """最新の結果が出ている試合の日付を基準に、CVの folds を生成する (main と各ステージで共通の設定)"""
+    latest_match_date = train_df['date'].max()
+    return generate_dynamic_folds(
+        end_date_str=latest_match_date.strftime('%Y-%m-%d'),
+        n_folds=3,
+        val_period_days=30,
+        gap_days=10
+    )
+
+# --------------------------------------------------------------------------------
+# LightGBM の Dataset とパラメータ
+# --------------------------------------------------------------------------------
+def build_lgb_dataset(input_x, input_y_factorized, reference_rows=None):
+    """
+    学習データ全体の lgb.Dataset を作成する (ヒストグラムのビン分割はここで一度だけ計算する)。
+    CVの各foldは subset() で作成し、最終モデルの学習にもそのまま使用する。
+    reference_rows を指定した場合、ビンの境界とカテゴリの対応はその行だけから計算し、全ての行をそれに従って
+    ビン分割する (バックテストで、予測する期間の特徴量の分布を学習に使わないようにする)。
+    """
+    categorical_feature = [col for col in CATEGORICAL_FEATURES if col in input_x.columns]
+    reference = None
+    if reference_rows is not None:
+        reference = lgb.Dataset(
+            input_x.iloc[reference_rows], label=np.asarray(input_y_factorized)[reference_rows],
+            categorical_feature=categorical_feature, free_raw_data=False,
+        ).construct()
+    dataset = lgb.Dataset(
+        input_x, label=input_y_factorized, reference=reference,
+        categorical_feature=categorical_feature,
+        free_raw_data=False,
+    )
+    return dataset.construct()
+
+
+def to_train_params(params, num_class, n_jobs=None):
+    """
+    LGBMClassifier 形式のパラメータを lgb.train 用に変換する。
+    n_estimators は学習回数 (num_boost_round) として別に返す。
+    スレッド数 (n_jobs) が違っても同じモデルになるように、deterministic とヒストグラムの列単位の構築
+    (force_col_wise) を常に指定する (CVの逐次実行と並列実行でスレッド数が違うため)。
+    """
+    train_params = {key: value for key, value in params.items() if key != "n_estimators"}
+    train_params.update({"objective": "multiclass", "num_class": num_class, "metric": "multi_logloss",
+                         "deterministic": True, "force_col_wise": True})
+    if n_jobs is not None:
+        train_params["n_jobs"] = n_jobs
+    return train_params, params.get("n_estimators", 100)
+
+
+# --------------------------------------------------------------------------------
+# 1つのfoldの学習と評価
+# --------------------------------------------------------------------------------
+def fit_fold(dataset, x_val, train_rows, val_rows, params=params, n_jobs=None, callbacks=None):
+    """
+    1つのfoldでモデルを学習し、検証データでの評価値を返す (逐次実行・並列実行・パラメータ探索で共通)。
+    学習・検証データは学習データ全体の Dataset の subset なので、ビン分割は再計算しない。
+    x_val は予測用の検証データ (DataFrame)。callbacks は早期停止に追加する LightGBM のコールバック。
+    """
+    num_class = len(np.unique(dataset.get_label()))
+    train_params, num_boost_round = to_train_params(params, num_class, n_jobs)
+
+    # LightGBM モデルの訓練
+    model = lgb.train(
+        train_params,
+        dataset.subset(train_rows),
+        num_boost_round=num_boost_round,
+        valid_sets=[dataset.subset(val_rows)],
+        callbacks=[
+        early_stopping(stopping_rounds=50,verbose=False)  # 早期停止
+        ] + (callbacks or [])
+        )
+
+    # モデルの評価
+    y_val = dataset.get_label()[val_rows].astype(int)
+    acc_val, ll_val, f1_macro_val, f1_weighted_val, _, _, _ = evaluate_model(model, x_val, y_val)
+    return {"accuracy": acc_val, "log_loss": ll_val, "f1_weighted": f1_weighted_val,
+            "best_iteration": model.best_iteration or model.current_iteration()}
+
+
+# --------------------------------------------------------------------------------
+# foldの並列学習
+# ビン分割済みの Dataset はバイナリファイル、予測用の特徴量は memmap で共有し、
+# プロセスごとにコピーを pickle しない
+# --------------------------------------------------------------------------------
+def share_training_data(dataset, input_x, directory):
+    """
+    Dataset をバイナリファイルに、特徴量を .npy ファイルに書き出し、
+    ワーカープロセスが読み込むための情報を返す。
+    カテゴリ型のカラムはカテゴリ番号 (欠損は -1) として保存し、読み込み時に元の型に戻す。
+    """
+    dataset_path = os.path.join(directory, "train.bin")
+    dataset.save_binary(dataset_path)
+
+    values = np.empty(input_x.shape, dtype=np.float64)
+    for i, col in enumerate(input_x.columns):
+        if isinstance(input_x[col].dtype, pd.CategoricalDtype):
+            values[:, i] = input_x[col].cat.codes.to_numpy()
+        else:
+            values[:, i] = input_x[col].to_numpy(dtype=np.float64, na_value=np.nan)
+    x_path = os.path.join(directory, "x.npy")
+    np.save(x_path, values)
+    return {"dataset_path": dataset_path, "x_path": x_path, "dtypes": input_x.dtypes.to_dict()}
+
+
+def load_shared_rows(shared, rows):
+    """共有した特徴量から指定行を読み込み、元と同じ型の DataFrame に戻す"""
+    x_rows = np.load(shared["x_path"], mmap_mode="r")[rows]
+    columns = {}
+    for i, (col, dtype) in enumerate(shared["dtypes"].items()):
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns[col] = pd.Categorical.from_codes(x_rows[:, i].astype(np.int64), dtype=dtype)
+        else:
+            columns[col] = x_rows[:, i].astype(dtype)
+    return pd.DataFrame(columns)
+
+
+def fit_fold_shared(shared, train_rows, val_rows, params, n_jobs):
+    """ワーカープロセスで実行する: 共有した Dataset の subset で学習し、共有した特徴量で評価する"""
+    dataset = lgb.Dataset(shared["dataset_path"]).construct()
+    x_val = load_shared_rows(shared, val_rows)
+    return fit_fold(dataset, x_val, train_rows, val_rows, params=params, n_jobs=n_jobs)
+
+
+def run_folds_parallel(dataset, input_x, fold_rows, params, n_workers):
+    """
+    fold をプロセスプールで並列に学習する。
+    各モデルのスレッド数は (CPUコア数 / 並列数) にして、合計がコア数を超えないようにする。
+    """
+    n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+    print(f"CV: {len(fold_rows)} fold を {n_workers} プロセスで並列に学習します (各モデルのスレッド数: {n_jobs})")
+    with tempfile.TemporaryDirectory() as directory:
+        shared = share_training_data(dataset, input_x, directory)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(fit_fold_shared, shared, train_rows, val_rows, params, n_jobs)
+                for train_rows, val_rows in fold_rows
+            ]
+            return [future.result() for future in futures]
+
+
+def make_fold_tasks(original_df, folds):
+    """各foldの (fold番号, fold, 学習データの行番号, 検証データの行番号) のリストを作成する"""
+    fold_tasks = []
+    for i, fold in enumerate(folds):
+        nfold = i
+
+        # 学習用インデックス
+        train_idx = original_df["date"] <= fold["train_end"]
+
+        # 検証用インデックス
+        val_idx = (original_df["date"] >= fold["val_start"]) & (original_df["date"] <= fold["val_end"])
+
+        if not val_idx.any():
+            print(f"警告: Fold {nfold} の検証データがありません。スキップします。")
+            continue
+        fold_tasks.append((nfold, fold, np.flatnonzero(train_idx.to_numpy()), np.flatnonzero(val_idx.to_numpy())))
+    return fold_tasks
+
+
+def final_num_boost_round(fold_results, fold_rows, n_rows, max_rounds):
+    """
+    最終モデルの木の数を決める: 各foldの best_iteration の中央値を、
+    FINAL_ROUNDS_SCALE_BY_DATA が True なら学習データの増加分だけ増やす (max_rounds が上限)
+    """
+    best_iterations = [result["best_iteration"] for result in fold_results]
+    scale = 1.0
+    if FINAL_ROUNDS_SCALE_BY_DATA:
+        scale = n_rows / np.mean([len(train_rows) for train_rows, _ in fold_rows])
+    return int(min(max_rounds, max(1, round(np.median(best_iterations) * scale))))
+
+
 #訓練データと検証データのindex作成
 # foldsの中から、今回設定した範囲を取り出し、その範囲に入っているかどうかを判断し、その範囲内のデータのみを訓練データと検証データとしていく。
 #これを3周する
+# n_workers > 1 の場合は fold をプロセスプールで並列に学習する (スレッド数が違っても to_train_params の設定で評価値は順番に学習した場合と同じ)
 
 
 def train_lgb(original_df,
               input_x,
               input_y,
               folds,
-              params=params
+              params=params,
+              n_workers=1,
+              dataset=None
               ):
 
     
@@ -660,50 +561,34 @@ def train_lgb(original_df,
     
     print(f"ターゲットラベルの順序: {target_labels}")
 
-    for i, fold in enumerate(folds):
-        nfold = i
-        print("-" * 10, f"CV Fold {nfold}: Train End={fold['train_end']}, Val Start={fold['val_start']}", "-" * 10)
-        
-        # 学習用インデックス
-        train_idx = original_df["date"] <= fold["train_end"]
-        x_tr = input_x[train_idx]
-        y_tr = input_y_factorized[train_idx] # 数値ラベルを使用
-        
-        # 検証用インデックス
-        val_idx = (original_df["date"] >= fold["val_start"]) & (original_df["date"] <= fold["val_end"])
-        x_val = input_x[val_idx]
-        y_val = input_y_factorized[val_idx] # 数値ラベルを使用
+    # 学習データ全体の Dataset (渡されない場合はここで作成する)。各foldはこの subset を使う
+    if dataset is None:
+        dataset = build_lgb_dataset(input_x, input_y_factorized)
 
-        if len(x_val) == 0:
-            print(f"警告: Fold {nfold} の検証データがありません。スキップします。")
-            continue
+    # 各foldの学習・検証データの行番号
+    fold_tasks = make_fold_tasks(original_df, folds)
 
-        # LightGBM モデル
-        model = lgb.LGBMClassifier(**params)
-        
-        
-        # モデルの訓練
-        model.fit(
-            x_tr, y_tr,
-            eval_set=[(x_val, y_val)],
-            eval_metric="multi_logloss",
-            callbacks=[
-            early_stopping(stopping_rounds=50,verbose=False)  # 早期停止
-            ]
-            )
-                
-        
-        # モデルの評価
-        acc_val, ll_val, f1_macro_val, f1_weighted_val, _, _, _ = evaluate_model(model, x_val, y_val)
-        
-        print(f"Fold {nfold} ACC: {acc_val:.4f}, F1(weighted): {f1_weighted_val:.4f}")
+    fold_rows = [(train_rows, val_rows) for _, _, train_rows, val_rows in fold_tasks]
+    if n_workers > 1 and len(fold_tasks) > 1:
+        fold_results = run_folds_parallel(dataset, input_x, fold_rows, params, min(n_workers, len(fold_tasks)))
+    else:
+        fold_results = [
+            fit_fold(dataset, input_x.iloc[val_rows], train_rows, val_rows, params=params)
+            for train_rows, val_rows in fold_rows
+        ]
+
+    for (nfold, fold, _, _), result in zip(fold_tasks, fold_results):
+        print("-" * 10, f"CV Fold {nfold}: Train End={fold['train_end']}, Val Start={fold['val_start']}", "-" * 10)
+        print(f"Fold {nfold} ACC: {result['accuracy']:.4f}, F1(weighted): {result['f1_weighted']:.4f}, "
+              f"best_iteration: {result['best_iteration']}")
 
         # 検証スコアを格納
         metrics_val.append({
             "nfold": nfold,
-            "accuracy": acc_val,
-            "log_loss": ll_val,
-            "f1_weighted": f1_weighted_val,
+            "accuracy": result["accuracy"],
+            "log_loss": result["log_loss"],
+            "f1_weighted": result["f1_weighted"],
+            "best_iteration": result["best_iteration"],
         })
 
     # CV全体の平均メトリクスを計算
@@ -714,62 +599,193 @@ def train_lgb(original_df,
     print("-" * 10, "CV平均結果 (KPI)", "-" * 10)
     print(f"CV平均精度: {mean_accuracy:.4f}")
     print(f"CV平均F1 (Weighted): {mean_f1:.4f}")
-    
-    # KPI情報のみを返す
-    return mean_accuracy, mean_f1, target_labels
+
+    # 最終モデルの木の数 (各foldの早期停止の結果から決める)
+    num_boost_round = final_num_boost_round(fold_results, fold_rows, len(input_x), params["n_estimators"])
+    print(f"最終モデルの木の数: {num_boost_round} (各foldの best_iteration: {df_metrics_val['best_iteration'].tolist()})")
+
+    # KPI情報と最終モデルの木の数を返す
+    return mean_accuracy, mean_f1, target_labels, num_boost_round
+
+# --------------------------------------------------------------------------------
+# ハイパーパラメータ探索 (Optuna)
+# --------------------------------------------------------------------------------
+def load_params():
+    """学習に使用するパラメータを返す (探索済みの最良パラメータがあれば params に上書きする)"""
+    if not os.path.exists(BEST_PARAMS_PATH):
+        return dict(params)
+    with open(BEST_PARAMS_PATH, encoding='utf-8') as f:
+        best = json.load(f)
+    print(f"探索済みのパラメータを使用します ({BEST_PARAMS_PATH}, CV logloss: {best['value']:.4f})")
+    return {**params, **best["params"]}
+
+
+def suggest_params(trial):
+    """探索するパラメータの範囲 (LGBMClassifier 形式の名前。n_estimators は早期停止の上限)"""
+    return {
+        **params,
+        "learning_rate": trial.suggest_float("learning_rate", 0.01, 0.2, log=True),
+        "num_leaves": trial.suggest_int("num_leaves", 8, 128, log=True),
+        "min_child_samples": trial.suggest_int("min_child_samples", 5, 100, log=True),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        "subsample": trial.suggest_float("subsample", 0.5, 1.0),
+        "subsample_freq": 1,
+        "reg_alpha": trial.suggest_float("reg_alpha", 1e-8, 10.0, log=True),
+        "reg_lambda": trial.suggest_float("reg_lambda", 1e-8, 10.0, log=True),
+    }
+
+
+def pruning_callback(trial, step_offset):
+    """
+    検証データの multi_logloss を PRUNING_INTERVAL イテレーションごとに Optuna に報告し、
+    他の試行より明らかに悪い場合は学習を打ち切る LightGBM のコールバック。
+    fold ごとに step_offset をずらして、同じ fold の同じイテレーション同士で比較されるようにする。
+    """
+    def _callback(env):
+        if env.iteration % PRUNING_INTERVAL != 0:
+            return
+        for _, metric_name, value, _ in env.evaluation_result_list:
+            if metric_name == "multi_logloss":
+                trial.report(value, step_offset + env.iteration)
+                if trial.should_prune():
+                    raise optuna.TrialPruned(f"iteration {env.iteration} で打ち切り (logloss: {value:.4f})")
+    _callback.order = 40
+    return _callback
+
+
+def tune_params(dataset, input_x, fold_tasks, n_trials=None, timeout=TUNE_TIMEOUT_SECONDS,
+                study_name=STUDY_NAME, storage=OPTUNA_STORAGE):
+    """
+    CVと同じ時系列のfoldで、検証データの平均 logloss が最小になるパラメータを探索する。
+    study は storage (SQLite) に保存されるため、同じ study_name で再実行すると続きから探索し、
+    複数プロセスで同時に実行すると並列に探索できる。timeout (秒) を過ぎると新しい試行を開始しない。
+    """
+    max_rounds = params["n_estimators"]
+
+    def objective(trial):
+        trial_params = suggest_params(trial)
+        losses = []
+        for fold_index, (_, _, train_rows, val_rows) in enumerate(fold_tasks):
+            result = fit_fold(dataset, input_x.iloc[val_rows], train_rows, val_rows, params=trial_params,
+                              callbacks=[pruning_callback(trial, fold_index * max_rounds)])
+            losses.append(result["log_loss"])
+        return float(np.mean(losses))
+
+    os.makedirs(os.path.join(PROJECT_ROOT, "db"), exist_ok=True)
+    study = optuna.create_study(
+        study_name=study_name, storage=storage, direction="minimize", load_if_exists=True,
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=PRUNING_INTERVAL * 2),
+    )
+    print(f"パラメータ探索を開始します (study: {study_name}, 既存の試行: {len(study.trials)}, 制限時間: {timeout} 秒)")
+    study.optimize(objective, n_trials=n_trials, timeout=timeout, gc_after_trial=True)
+
+    completed = [t for t in study.trials if t.state == optuna.trial.TrialState.COMPLETE]
+    pruned = [t for t in study.trials if t.state == optuna.trial.TrialState.PRUNED]
+    if not completed:
+        print("⚠️ 完了した試行がないため、最良パラメータを保存しません。")
+        return None
+
+    best = {
+        "params": {**suggest_params(optuna.trial.FixedTrial(study.best_params)), "n_estimators": max_rounds},
+        "value": study.best_value,
+        "study_name": study_name,
+        "trials": len(study.trials),
+        "updated_at": datetime.now().strftime("%Y/%m/%d %H:%M:%S"),
+    }
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    with open(BEST_PARAMS_PATH, 'w', encoding='utf-8') as f:
+        json.dump(best, f, ensure_ascii=False, indent=4)
+    print(f"✅ 探索完了: 完了 {len(completed)} / 枝刈り {len(pruned)} / 全 {len(study.trials)} 試行, "
+          f"最良 CV logloss: {study.best_value:.4f}")
+    print(f"最良パラメータを {BEST_PARAMS_PATH} に保存しました。")
+    return best
+
 
 # --------------------------------------------------------------------------------
 # ★★★ NEW: 最終モデル学習関数 (全データ学習) ★★★
 # --------------------------------------------------------------------------------
-def train_final_model(X_all, y_all_factorized):
+def load_final_model_meta():
+    """予測に使用する最終モデルの学習条件の記録を返す (ない場合は空の辞書)"""
+    return model_registry.load_meta()
+
+
+def save_final_model(model, input_x, meta):
+    """最終モデルをモデルレジストリに新しいバージョンとして保存し、バージョンを返す"""
+    version = model_registry.save_model(model, input_x, meta)
+    print(f"最終モデルを {os.path.join(model_registry.REGISTRY_DIR, version)} に保存しました。(木の数: {model.num_trees()})")
+    return version
+
+
+def full_training_meta(x_all, dates, target_labels, mean_accuracy, mean_f1):
+    """全データで学習した最終モデルに記録する情報 (ウォームスタートの判定用の情報と、CVのKPI)"""
+    meta = training_meta(x_all, dates, target_labels)
+    meta.update({
+        "full_trained_at": datetime.now().strftime(TIME_FORMAT),
+        "full_trained_through": meta["trained_through"],
+        "cv_accuracy": mean_accuracy,
+        "cv_f1": mean_f1,
+    })
+    return meta
+
+
+def train_final_model(X_all, y_all_factorized, dataset=None, model_params=params, num_boost_round=None, meta=None):
     """
-    全ての学習データを使って最終予測モデルを訓練し、保存する
+    全ての学習データを使って最終予測モデル (lgb.Booster) を訓練し、モデルレジストリに保存する。
+    CVで作成した学習データ全体の Dataset を渡すと、ビン分割を再計算せずに使用する。
+    num_boost_round は CV の早期停止から決めた木の数 (None の場合は n_estimators)。
+    使用した木の数などは meta.json に記録する (meta は追加で記録する情報)。保存したバージョンを返す。
     """
+    if dataset is None:
+        dataset = build_lgb_dataset(X_all, y_all_factorized)
+
     # CVと同じパラメータで設定
-    model = lgb.LGBMClassifier(**params)
+    train_params, max_rounds = to_train_params(model_params, len(np.unique(y_all_factorized)))
+    if num_boost_round is None:
+        num_boost_round = max_rounds
     
     print("-" * 10, "最終モデル学習 (全データ)", "-" * 10)
-    # 全データでモデルを訓練 (検証セットなしで早期停止は行わない)
-    # n_estimators は params で指定された1000回を使用
-    model.fit(X_all, y_all_factorized)
-    
-    # モデルの保存
-    final_model_path = os.path.join(MODEL_DIR, "final_model.pkl")
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    with open(final_model_path, 'wb') as f:
-        pickle.dump(model, f)
-        
-    print(f"最終モデルを {final_model_path} に保存しました。")
-    return final_model_path
+    # 全データでモデルを訓練 (検証セットなしで早期停止は行わないため、CVで決めた木の数を使用)
+    model = lgb.train(train_params, dataset, num_boost_round=num_boost_round)
+    
+    # モデルの保存と学習条件の記録
+    return save_final_model(model, X_all, {
+        "mode": "full",
+        "num_boost_round": num_boost_round,
+        "num_trees": model.num_trees(),
+        "params": model_params,
+        "train_rows": dataset.num_data(),
+        "trained_at": datetime.now().strftime(TIME_FORMAT),
+        **(meta or {}),
+    })
 
 
 # --------------------------------------------------------------------------------
 # 予測実行とDB保存関数 
 # --------------------------------------------------------------------------------
-def predict_and_save(model_path, predict_df, target_labels):
+def predict_and_save(predict_df, model_version=None):
     """
-    最終モデルを使用して予測を実行し、結果をDBに保存する
+    最終モデル (model_version を省略した場合はレジストリの CURRENT) を使用して予測を実行し、結果をDBに保存する
     """
     if predict_df.empty:
         print("予測対象の試合データがありません。")
         return pd.DataFrame() 
 
-    # モデルのロード
+    # モデルのロード (特徴量の順序とラベルの順序は、モデルと一緒に保存した meta.json のものを使用する)
     try:
-        with open(model_path, 'rb') as f:
-            model = pickle.load(f)
-    except FileNotFoundError:
-        print(f"エラー: 最終モデルファイル {model_path} が見つかりません。")
+        model, meta = model_registry.load_model(model_version)
+    except FileNotFoundError as e:
+        print(f"エラー: {e}")
         return pd.DataFrame()
+    target_labels = np.asarray(meta["target_labels"])
 
 
     # 予測の実行
-    X_predict = predict_df[FEATURES]
+    X_predict = predict_df[meta["features"]]
     # モデルにカテゴリ特徴量を与えるために、型を合わせる
     # X_predict["home_team"] = X_predict["home_team"].astype('category')
     # X_predict["away_team"] = X_predict["away_team"].astype('category')
 
-    y_pred_proba = model.predict_proba(X_predict)
+    y_pred_proba = model.predict(X_predict)
     
     # 予測結果（確率が最大のクラス）
     predicted_classes_idx = np.argmax(y_pred_proba, axis=1)
@@ -808,84 +824,189 @@ def predict_and_save(model_path, predict_df, target_labels):
     return df_results 
 
 
+# --------------------------------------------------------------------------------
+# データ取得
+# --------------------------------------------------------------------------------
+def load_match_data():
+    """
+    DBから予測対象リーグの試合データと統計データを読み込む。
+    リーグの絞り込みとカラムの指定は SQL で行い、他のリーグの試合・使わないカラムは読み込まない (data_access.py)。
+    """
+    conn = data_access.connect(DB_PATH)
+    try:
+        match_columns = data_access.table_columns(conn, "matches")
+        # league_id 追加前のDB (プレミアリーグのみ) は絞り込まない
+        league_id = LEAGUE_ID if "league_id" in match_columns else None
+        matches_df = data_access.load_matches(
+            conn, columns=[col for col in match_columns if col != "league_id"], league_id=league_id)
+        # 統計データは team_name で試合データと結合するため、team_id は読み込まない
+        stats_df = data_access.load_match_statistics(
+            conn, columns=[col for col in data_access.table_columns(conn, "match_statistics") if col != "team_id"],
+            league_id=league_id)
+    finally:
+        conn.close()
+    return matches_df, stats_df
+
+
+def save_predictions_json(df_results, mean_accuracy, mean_f1, n_matches):
+    """Streamlit アプリケーション向けに、予測結果とKPI (CV平均) を JSON として保存する"""
+    kpi_data = {
+        "accuracy": f"{mean_accuracy * 100:.1f}%",
+        "f1": f"{mean_f1:.2f}",
+        "matches": n_matches,
+        "lastUpdate": datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+    }
+
+    # 予測結果DataFrameを整形し、JSON形式に変換
+    df_for_json = df_results[[
+        'date', 'home_team', 'away_team', 'predicted_result', 'proba_H', 'proba_D', 'proba_A'
+    ]].copy()
+
+    # 'date' カラムを 'YYYY-MM-DD' 形式の文字列に変換します。
+    df_for_json['date'] = df_for_json['date'].dt.strftime('%Y-%m-%d')
+
+    # 信頼度(confidence)は、予測された結果の最大確率を使用
+    df_for_json['confidence'] = df_for_json[['proba_H', 'proba_D', 'proba_A']].max(axis=1)
+
+    # 最終的なデータ構造
+    output_data = {
+        "kpis": kpi_data,
+        "predictions": df_for_json.rename(columns={'predicted_result': 'prediction'}).to_dict(orient='records')
+    }
+
+    # JSONファイルとして保存
+    with open(PREDICTIONS_JSON_PATH, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, ensure_ascii=False, indent=4)
+
+    print(f"Streamlit向け予測結果とKPIを {PREDICTIONS_JSON_PATH} に保存しました。")
+
+
 # --------------------------------------------------------------------------------
 # メイン処理 (CVと全データ学習を分離)
 # --------------------------------------------------------------------------------
-def main():
+# パイプラインのステージ (実行順。各ステージの処理は pipeline_stages.py)
+PIPELINE_STAGES = ["ingest", "features", "snapshot", "folds", "cv", "train", "predict", "json"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="試合結果予測パイプライン")
+    parser.add_argument("mode", nargs="?", default="run",
+                        choices=["run", "retrain", "tune", *PIPELINE_STAGES],
+                        help="run: 全ステージを実行 (入力が変わったステージのみ。既定) / "
+                             "retrain: 可能な場合は前回のモデルに新しい試合分の木を追加 (ウォームスタート) / "
+                             "tune: Optuna でハイパーパラメータを探索 / "
+                             f"{', '.join(PIPELINE_STAGES)}: ステージを1つ実行 (入力が変わっていなければ何もしない)")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="retrain: ウォームスタートと全データ学習の精度を時系列のfoldで比較する")
+    parser.add_argument("--trials", type=int, default=None, help="tune: 試行回数の上限 (既定: 制限時間まで)")
+    parser.add_argument("--timeout", type=int, default=TUNE_TIMEOUT_SECONDS, help="tune: 制限時間 (秒)")
+    parser.add_argument("--study-name", default=STUDY_NAME, help="tune: study 名 (同じ名前なら続きから探索)")
+    parser.add_argument("--force", nargs="*", choices=PIPELINE_STAGES, default=None, metavar="STAGE",
+                        help="保存済みの出力があっても実行し直すステージ (run で省略した場合は全ステージ、"
+                             "ステージを1つ実行する場合はそのステージ)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode == "run" or args.mode in PIPELINE_STAGES:
+        # ステージのモジュールはこのモジュールの関数を使うため、ここで読み込む
+        import pipeline_stages
+        try:
+            if args.mode == "run":
+                force_stages = PIPELINE_STAGES if args.force == [] else (args.force or [])
+                pipeline_stages.run_pipeline(force_stages)
+            else:
+                pipeline_stages.run_stage(args.mode, force=args.force is not None)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+        return
     try:
         # 1. データ取得
-        conn = sqlite3.connect(DB_PATH)
-        matches_df = pd.read_sql_query("SELECT * FROM matches", conn)
-        stats_df = pd.read_sql_query("SELECT * FROM match_statistics", conn)
-        conn.close()
+        matches_df, stats_df = load_match_data()
         
         
-        # 2. 特徴量エンジニアリング
-        train_df, predict_df = feature_engineering(matches_df, stats_df)
+        # 2. 特徴量エンジニアリング (チーム単位の特徴量は特徴量ストアで差分更新)
+        feature_store = FeatureStore()
+        try:
+            train_df, predict_df = feature_engineering(matches_df, stats_df, feature_store=feature_store)
+        finally:
+            feature_store.close()
         
         # 3. 学習用データの準備
         x_all = train_df[FEATURES]
         y_all = train_df[TARGET]
         
         # 4. 動的foldsの生成
-        # 最新の結果が出ている試合の日付を基準にする
-        latest_match_date = train_df['date'].max()
-        folds = generate_dynamic_folds(
-            end_date_str=latest_match_date.strftime('%Y-%m-%d'), 
-            n_folds=3, 
-            val_period_days=30,
-            gap_days=10
-        )
-        
-        # 5. モデル学習と評価 (CV) -> KPI算出のみ
-        mean_accuracy, mean_f1, target_labels = train_lgb(
-            original_df=train_df,
-            input_x=x_all,
-            input_y=y_all,
-            folds=folds,
-            params=params
-        )
+        folds = make_folds(train_df)
+        
+        # 学習データ全体の Dataset を一度だけ作成し、CVの各foldと最終モデルで共有する
+        y_all_factorized, target_labels = pd.factorize(y_all)
+        train_dataset = build_lgb_dataset(x_all, y_all_factorized)
+
+        # tune モード: 同じfoldでパラメータを探索し、最良パラメータを保存して終了する
+        if args.mode == "tune":
+            tune_params(train_dataset, x_all, make_fold_tasks(train_df, folds),
+                        n_trials=args.trials, timeout=args.timeout, study_name=args.study_name)
+            return
+
+        # 探索済みの最良パラメータがあれば使用する
+        model_params = load_params()
+
+        # retrain モード: 前回のモデルの記録から、全データで学習し直すかウォームスタートするかを決める
+        retrain_mode = "full"
+        if args.mode == "retrain":
+            previous_meta = load_final_model_meta()
+            retrain_mode, reason = retrain_decision(previous_meta, x_all, train_df['date'], target_labels, model_params)
+            print(f"再学習の方法: {retrain_mode} ({reason})")
+            if args.evaluate:
+                train_params, max_rounds = to_train_params(model_params, len(target_labels))
+                evaluate_warm_start(train_df['date'], train_dataset, x_all, folds, train_params,
+                                    previous_meta.get("num_boost_round", max_rounds))
+
+        if retrain_mode == "full":
+            # 5. モデル学習と評価 (CV) -> KPI算出のみ
+            mean_accuracy, mean_f1, target_labels, num_boost_round = train_lgb(
+                original_df=train_df,
+                input_x=x_all,
+                input_y=y_all,
+                folds=folds,
+                params=model_params,
+                n_workers=CV_WORKERS,
+                dataset=train_dataset
+            )
 
-        # 6. 最終予測モデルを全データで学習し、保存
-        y_all_factorized, _ = pd.factorize(y_all) # mainでもfactorizeが必要
-        final_model_path = train_final_model(x_all, y_all_factorized)
+            # 6. 最終予測モデルを全データで学習し、保存
+            meta = full_training_meta(x_all, train_df['date'], target_labels, mean_accuracy, mean_f1)
+            model_version = train_final_model(x_all, y_all_factorized, dataset=train_dataset, model_params=model_params,
+                                              num_boost_round=num_boost_round, meta=meta)
+        else:
+            # 5-6. CVは行わず、KPIは前回の全データ学習時のCVの値を使用する
+            mean_accuracy, mean_f1 = previous_meta["cv_accuracy"], previous_meta["cv_f1"]
+            model_version = previous_meta["version"]
+            if retrain_mode == "warm":
+                # 前回のモデルに、前回以降に結果が出た試合で木を追加する
+                model, _ = model_registry.load_model(model_version)
+                train_params, _ = to_train_params(model_params, len(target_labels))
+                warm_rows = warm_start_rows(train_df['date'], previous_meta["trained_through"])
+                model = continue_training(model, train_params, train_dataset, warm_rows)
+                model_version = save_final_model(model, x_all, {
+                    **previous_meta,
+                    "mode": "warm",
+                    "num_trees": model.num_trees(),
+                    "warm_rows": len(warm_rows),
+                    "trained_through": train_df['date'].max().isoformat(),
+                    "trained_at": datetime.now().strftime(TIME_FORMAT),
+                })
+                print(f"✅ ウォームスタート: {len(warm_rows)} 試合で木を追加しました (木の数: {model.num_trees()})")
         
         # 7. 予測の実行とDB保存
         # CVで算出したKPIではなく、全データで学習した final_model を使用
-        df_results = predict_and_save(final_model_path, predict_df, target_labels)
+        df_results = predict_and_save(predict_df, model_version)
         
         
         # 8. Streamlit アプリケーション向けに結果をJSONとして保存 (KPIはCV平均を使用)
-        kpi_data = {
-            "accuracy": f"{mean_accuracy * 100:.1f}%",
-            "f1": f"{mean_f1:.2f}",
-            "matches": len(train_df),
-            "lastUpdate": datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        }
-
-        # 予測結果DataFrameを整形し、JSON形式に変換
-        df_for_json = df_results[[
-            'date', 'home_team', 'away_team', 'predicted_result', 'proba_H', 'proba_D', 'proba_A'
-        ]].copy()
-
-        # 'date' カラムを 'YYYY-MM-DD' 形式の文字列に変換します。
-        df_for_json['date'] = df_for_json['date'].dt.strftime('%Y-%m-%d')
-        
-        # 信頼度(confidence)は、予測された結果の最大確率を使用
-        df_for_json['confidence'] = df_for_json[['proba_H', 'proba_D', 'proba_A']].max(axis=1)
-        
-        # 最終的なデータ構造
-        output_data = {
-            "kpis": kpi_data,
-            "predictions": df_for_json.rename(columns={'predicted_result': 'prediction'}).to_dict(orient='records')
-        }
-
-        # JSONファイルとして保存
-        JSON_FILE_PATH = os.path.join(SCRIPT_DIR,"..","data", 'latest_predictions.json')
-        with open(JSON_FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=4)
-
-        print(f"Streamlit向け予測結果とKPIを {JSON_FILE_PATH} に保存しました。")
+        save_predictions_json(df_results, mean_accuracy, mean_f1, len(train_df))
 
     except Exception as e:
         print(f"メイン処理中にエラーが発生しました: {e}")
@@ -893,4 +1014,4 @@ def main():
         traceback.print_exc()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
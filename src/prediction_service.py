@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import model_registry
+from feature_store import FeatureStore
+from prediction_pipeline1 import feature_engineering, load_match_data
+from rolling_features import (
+    AWAY_OVERALL_COLUMNS, AWAY_ROLLING_COLUMNS, HOME_OVERALL_COLUMNS, HOME_ROLLING_COLUMNS, team_column_name,
+)
+from season_table import SEASON_COL_MAP
+
+# --------------------------------------------------------------------------------
+# 予測サービス (標準ライブラリの HTTP サーバー)
+# モデルと特徴量を起動時に一度だけ読み込み、メモリ上で予測する。
+#   GET  /health                                        : 読み込み済みのモデルのバージョンなど
+#   GET  /predict?fixture_id=123                        : 予定されている試合の予測
+#   GET  /predict?home=Arsenal&away=Chelsea&date=2025-12-01 : 任意の組み合わせ・日付の予測
+#   POST /predict/batch  {"fixture_ids": [...]} / {"matchweek": "2025-12-01"} / {"matches": [{"home", "away", "date"}, ...]}
+#   POST /reload         {"features": true}             : モデルを読み込み直す (features=true なら特徴量も作り直す)
+# 任意の組み合わせの特徴量は、特徴量ストアに保存された各チームの最新状態 (最後の FT 試合の値) を使う
+# (NS試合の補完と同じ値。各チームの最後の FT 試合より前の日付は指定できない)。
+# --------------------------------------------------------------------------------
+
+SERVICE_HOST = os.getenv("PREDICTION_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("PREDICTION_SERVICE_PORT", "8000"))
+
+# 過去シーズンの順位表から結合する特徴量 (home_last_points など)
+HOME_SEASON_COLUMNS = [f"home_{col}" for col in SEASON_COL_MAP.values()]
+AWAY_SEASON_COLUMNS = [f"away_{col}" for col in SEASON_COL_MAP.values()]
+
+
+class RequestError(Exception):
+    """リクエストの内容が不正な場合のエラー (HTTP 400/404 で返す)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_request_date(value):
+    """
+    リクエストの日付を Timestamp にする。DB の日時はタイムゾーンなしの UTC のため、
+    タイムゾーン付きの日付 (例: 2025-12-01T15:00+01:00) は UTC に変換してからタイムゾーンを外す。
+    """
+    try:
+        date = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"日付の形式が正しくありません: {value}")
+    if pd.isna(date):
+        raise RequestError(f"日付の形式が正しくありません: {value}")
+    if date.tzinfo is not None:
+        date = date.tz_convert("UTC").tz_localize(None)
+    return date
+
+
+class TeamState:
+    """
+    チームごとの最新状態 (特徴量ストアの team_state: 各チームの最後の FT 試合の特徴量)。
+    ホーム側/アウェイ側の特徴量は、そのチームの最後のホーム/アウェイ試合の値、
+    ホーム/アウェイ区別なしの成績は、最後の試合 (どちらの立場でも) でのそのチーム自身の値を使う (NS試合の補完と同じ)。
+    """
+
+    def __init__(self, states, all_df):
+        self.states = states
+        self.last_dates = {team: pd.Timestamp(state['last_date']) for team, state in states.items()}
+
+        # (シーズン, チーム) -> 過去シーズンの順位表の特徴量 (昇格組の代理値を含む)
+        self.season_values = {}
+        for side, columns in (('home', HOME_SEASON_COLUMNS), ('away', AWAY_SEASON_COLUMNS)):
+            rows = all_df[['season', f'{side}_team'] + columns].dropna().drop_duplicates(['season', f'{side}_team'])
+            for season, team, *values in rows.itertuples(index=False, name=None):
+                self.season_values.setdefault((int(season), str(team)), np.asarray(values, dtype=np.float64))
+        season_dates = all_df[['date', 'season']].sort_values('date', kind='stable')
+        self.season_starts = season_dates.groupby('season')['date'].min().sort_values()
+
+    def season_of(self, date):
+        """日付が属するシーズン (その日付以前に始まった最新のシーズン)"""
+        started = self.season_starts[self.season_starts <= date]
+        return int(started.index[-1] if len(started) else self.season_starts.index[0])
+
+    def features(self, team, side, date):
+        """team が side (home/away) として date に試合をする場合のチーム単位の特徴量"""
+        state = self.states.get(team)
+        if state is None:
+            raise RequestError(f"チーム {team} の試合データがありません")
+        if date < self.last_dates[team]:
+            raise RequestError(f"チーム {team} の最新の状態は {self.last_dates[team]:%Y-%m-%d} の試合の時点のものです。"
+                               f"それ以降の日付を指定してください")
+        season_values = self.season_values.get((self.season_of(date), team))
+        if season_values is None:
+            raise RequestError(f"チーム {team} の {self.season_of(date)} シーズンの順位表データがありません")
+
+        # 最新の特徴量はチーム視点の名前 (home_/away_ の接頭辞なし) で保存されている
+        latest = state['latest_features']
+        rolling = latest.get(side, {})
+        overall = latest.get('overall', {})
+        rolling_columns = HOME_ROLLING_COLUMNS if side == 'home' else AWAY_ROLLING_COLUMNS
+        overall_columns = HOME_OVERALL_COLUMNS if side == 'home' else AWAY_OVERALL_COLUMNS
+        values = {col: rolling.get(team_column_name(col), np.nan) for col in rolling_columns}
+        values.update({col: overall.get(team_column_name(col), np.nan) for col in overall_columns})
+        values.update(zip(HOME_SEASON_COLUMNS if side == 'home' else AWAY_SEASON_COLUMNS, season_values))
+        return values
+
+
+class PredictionService:
+    """モデル・予定されている試合の特徴量・チームの最新状態をメモリに保持して予測する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model = None
+        self.meta = None
+        self.fixtures = None
+        self.team_state = None
+        self.loaded_at = None
+
+    def reload_model(self):
+        """CURRENT のモデルを読み込む (同じバージョンならキャッシュを使う)"""
+        model, meta = model_registry.load_model()
+        with self.lock:
+            self.model, self.meta = model, meta
+        return meta["version"]
+
+    def reload_features(self):
+        """DB から特徴量を作り直す (チーム単位の特徴量とチームの最新状態は特徴量ストアで差分更新)"""
+        matches_df, stats_df = load_match_data()
+        feature_store = FeatureStore()
+        try:
+            train_df, predict_df = feature_engineering(matches_df, stats_df, feature_store=feature_store)
+            # チームの最新状態は差分更新した特徴量ストアのものを使う
+            states = feature_store.load_team_state()
+        finally:
+            feature_store.close()
+        fixtures = predict_df.set_index('fixture_id', drop=False)
+        team_state = TeamState(states, pd.concat([train_df, predict_df], ignore_index=True))
+        with self.lock:
+            self.fixtures, self.team_state = fixtures, team_state
+            self.loaded_at = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        return len(fixtures)
+
+    def health(self):
+        return {"model_version": self.meta["version"], "fixtures": len(self.fixtures), "features_loaded_at": self.loaded_at}
+
+    def _matchup_rows(self, matches):
+        """[(home, away, date), ...] から特徴量の DataFrame を作成する"""
+        with self.lock:
+            team_state = self.team_state
+        rows = []
+        for home, away, date in matches:
+            date = parse_request_date(date)
+            row = {"fixture_id": None, "date": date, "home_team": home, "away_team": away}
+            row.update(team_state.features(home, 'home', date))
+            row.update(team_state.features(away, 'away', date))
+            row["points_difference"] = row["home_total_points"] - row["away_total_points"]
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def _predict_rows(self, df):
+        """特徴量の DataFrame を予測し、試合ごとの結果のリストを返す"""
+        with self.lock:
+            model, meta = self.model, self.meta
+        x = df[meta["features"]].copy()
+        for col, categories in meta["categories"].items():
+            x[col] = pd.Categorical(x[col].astype(str), categories=categories)
+        proba = model.predict(x)
+        labels = meta["target_labels"]
+        results = []
+        for i, row in enumerate(df[["fixture_id", "date", "home_team", "away_team"]].itertuples(index=False)):
+            result = {
+                "fixture_id": None if pd.isna(row.fixture_id) else int(row.fixture_id),
+                "date": pd.Timestamp(row.date).isoformat(),
+                "home_team": str(row.home_team), "away_team": str(row.away_team),
+                "prediction": labels[int(np.argmax(proba[i]))],
+            }
+            result.update({f"proba_{label}": float(proba[i, j]) for j, label in enumerate(labels)})
+            result["model_version"] = meta["version"]
+            results.append(result)
+        return results
+
+    def predict_fixtures(self, fixture_ids):
+        with self.lock:
+            fixtures = self.fixtures
+        missing = [fixture_id for fixture_id in fixture_ids if fixture_id not in fixtures.index]
+        if missing:
+            raise RequestError(f"予定されている試合にない fixture_id です: {missing}", status=404)
+        return self._predict_rows(fixtures.loc[fixture_ids])
+
+    def predict_matchups(self, matches):
+        return self._predict_rows(self._matchup_rows(matches))
+
+    def predict_matchweek(self, date):
+        """date を含む節 (火曜〜月曜) の予定されている全試合を予測する"""
+        with self.lock:
+            fixtures = self.fixtures
+        week = parse_request_date(date).to_period('W-MON')
+        rows = fixtures[fixtures['date'].dt.to_period('W-MON') == week]
+        return self._predict_rows(rows) if len(rows) else []
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, func):
+            start = time.perf_counter()
+            try:
+                body = func()
+                body["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                self._send(200, body)
+            except RequestError as e:
+                self._send(e.status, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def _json_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                return json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                raise RequestError("JSON の形式が正しくありません")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == "/health":
+                self._handle(service.health)
+            elif url.path == "/predict":
+                self._handle(lambda: predict_query(service, query))
+            else:
+                self._send(404, {"error": f"{url.path} はありません"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == "/predict/batch":
+                self._handle(lambda: predict_batch(service, self._json_body()))
+            elif url.path == "/reload":
+                self._handle(lambda: reload(service, self._json_body()))
+            else:
+                self._send(404, {"error": f"{url.path} はありません"})
+
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} - {format % args}")
+
+    return Handler
+
+
+def predict_query(service, query):
+    if "fixture_id" in query:
+        try:
+            fixture_id = int(query["fixture_id"])
+        except ValueError:
+            raise RequestError("fixture_id は整数で指定してください")
+        return service.predict_fixtures([fixture_id])[0]
+    if {"home", "away"} <= set(query):
+        return service.predict_matchups([(query["home"], query["away"], query.get("date", datetime.now().strftime("%Y-%m-%d")))])[0]
+    raise RequestError("fixture_id、または home と away (と date) を指定してください")
+
+
+def predict_batch(service, body):
+    if "fixture_ids" in body:
+        try:
+            fixture_ids = [int(fixture_id) for fixture_id in body["fixture_ids"]]
+        except (TypeError, ValueError):
+            raise RequestError("fixture_ids は整数のリストで指定してください")
+        predictions = service.predict_fixtures(fixture_ids)
+    elif "matchweek" in body:
+        predictions = service.predict_matchweek(body["matchweek"])
+    elif "matches" in body:
+        try:
+            matches = [(match["home"], match["away"], match["date"]) for match in body["matches"]]
+        except (KeyError, TypeError):
+            raise RequestError("matches の各要素には home, away, date を指定してください")
+        predictions = service.predict_matchups(matches)
+    else:
+        raise RequestError("fixture_ids、matchweek、matches のいずれかを指定してください")
+    return {"predictions": predictions}
+
+
+def reload(service, body):
+    previous = service.meta["version"]
+    version = service.reload_model()
+    result = {"model_version": version, "previous_version": previous}
+    if body.get("features"):
+        result["fixtures"] = service.reload_features()
+    print(f"✅ 読み込み直しました: モデル {previous} -> {version}" + (" (特徴量も作り直しました)" if body.get("features") else ""))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="試合結果の予測サービス (HTTP)")
+    parser.add_argument("--host", default=SERVICE_HOST, help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="待ち受けるポート")
+    args = parser.parse_args()
+
+    service = PredictionService()
+    try:
+        version = service.reload_model()
+    except FileNotFoundError as e:
+        print(f"❌ {e}\n先に python src/prediction_pipeline1.py でモデルを作成してください。")
+        return
+    n_fixtures = service.reload_features()
+    print(f"✅ モデル {version} と予定されている {n_fixtures} 試合の特徴量を読み込みました。")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"予測サービスを http://{args.host}:{args.port} で起動しました (Ctrl+C で終了)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# --- 設定 ---
+# 終了済みでこれ以上内容が変わらない試合のステータス
+IMMUTABLE_STATUSES = ('FT', 'AET', 'PEN')
+# 試合中のステータス
+LIVE_STATUSES = ('1H', 'HT', '2H', 'ET', 'BT', 'P', 'SUSP', 'INT', 'LIVE')
+
+# 有効期限 (秒)。None は期限なし
+TTL_LIVE = 60               # 試合中の試合を含む応答
+TTL_NOT_STARTED = 60 * 60   # 未開始 (NS など) の試合を含む応答
+TTL_EMPTY = 6 * 60 * 60     # 空の応答 (統計情報がまだ登録されていない場合など)
+# ----------------
+
+
+def response_ttl(path, data):
+    """
+    応答内容から有効期限 (秒) を決める。
+    - 全試合が終了済み (FT/AET/PEN) の試合一覧、および統計情報は変化しないため期限なし
+    - 試合中の試合を含む場合は TTL_LIVE、未開始の試合を含む場合は TTL_NOT_STARTED
+    """
+    response = data.get('response', [])
+    if not response:
+        return TTL_EMPTY
+    if path.strip('/') == 'fixtures/statistics':
+        # 統計情報は終了済みの試合に対してのみ取得している
+        return None
+
+    statuses = {item['fixture']['status']['short'] for item in response if 'fixture' in item}
+    if statuses & set(LIVE_STATUSES):
+        return TTL_LIVE
+    if statuses - set(IMMUTABLE_STATUSES):
+        return TTL_NOT_STARTED
+    return None
+
+
+class ResponseCache:
+    """
+    API応答を zlib 圧縮した JSON として SQLite に保存するキャッシュ。
+    キーは (エンドポイント, クエリパラメータ) を正規化した文字列の SHA-256。
+    スレッドプールから同時に呼ばれても安全。
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                path TEXT,
+                params TEXT,
+                body BLOB,
+                fetched_at REAL,
+                expires_at REAL
+            )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_path ON responses (path, fetched_at)')
+            self.conn.commit()
+
+    @staticmethod
+    def _normalize(path, params):
+        path = path.strip('/')
+        params_json = json.dumps({k: str(v) for k, v in (params or {}).items()}, sort_keys=True)
+        return path, params_json
+
+    @classmethod
+    def make_key(cls, path, params):
+        """(エンドポイント, パラメータ) からキャッシュキーを作成する"""
+        path, params_json = cls._normalize(path, params)
+        return hashlib.sha256(f"{path}?{params_json}".encode('utf-8')).hexdigest()
+
+    def get(self, path, params, ignore_expiry=False):
+        """有効なキャッシュがあれば応答を返す。無い場合は None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT body, expires_at FROM responses WHERE key = ?', (self.make_key(path, params),)
+            ).fetchone()
+        if row is None:
+            return None
+        body, expires_at = row
+        if not ignore_expiry and expires_at is not None and expires_at < time.time():
+            return None
+        return json.loads(zlib.decompress(body))
+
+    def put(self, path, params, data):
+        """応答を保存する。有効期限は応答内容から response_ttl() で決める"""
+        ttl = response_ttl(path, data)
+        now = time.time()
+        norm_path, params_json = self._normalize(path, params)
+        body = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        with self.lock:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO responses (key, path, params, body, fetched_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (self.make_key(path, params), norm_path, params_json, body, now,
+                  None if ttl is None else now + ttl))
+            self.conn.commit()
+
+    def iter_responses(self, path):
+        """
+        指定エンドポイントの保存済み応答を取得日時の古い順に (params, data) で返す (有効期限は無視する)。
+        リプレイ (ネットワークを使わない再構築) 用。
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT params, body FROM responses WHERE path = ? ORDER BY fetched_at', (path.strip('/'),)
+            ).fetchall()
+        for params_json, body in rows:
+            yield json.loads(params_json), json.loads(zlib.decompress(body))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,289 @@
+import numpy as np
+import pandas as pd
+
+
+# チーム単位の成績 (シーズン累積勝ち点・勝率) で使用する最大ウィンドウサイズ (1シーズンの試合数)
+OVERALL_WINDOW = 38
+
+# --------------------------------------------------------------------------------
+# ローリング特徴量の定義
+# (グループ化するカラム, 集計対象のカラム, ウィンドウサイズ, 新しい特徴量のカラム名)
+# ウィンドウサイズは従来の calculate_rolling_feature と同じ意味 (直近N試合なら N+1)
+# --------------------------------------------------------------------------------
+ROLLING_SPECS = [
+    # 直近5試合 (window=6)
+    ('home_team', 'is_home_win', 6, 'home_team_recent_5_wins'),
+    ('away_team', 'is_away_win', 6, 'away_team_recent_5_wins'),
+    ('home_team', 'home_score', 6, 'home_recent_5_scores'),
+    ('away_team', 'away_score', 6, 'away_recent_5_scores'),
+    ('home_team', 'away_score', 6, 'home_recent_5_goal_against'),
+    ('away_team', 'home_score', 6, 'away_recent_5_goal_against'),
+    ('home_team', 'home_goal_difference', 6, 'home_recent_5_goal_diff'),
+    ('away_team', 'away_goal_difference', 6, 'away_recent_5_goal_diff'),
+
+    # 直近10試合 (window=11)
+    ('home_team', 'home_score', 11, 'home_recent_10_scores'),
+    ('away_team', 'away_score', 11, 'away_recent_10_scores'),
+    ('home_team', 'away_score', 11, 'home_recent_10_goal_against'),
+    ('away_team', 'home_score', 11, 'away_recent_10_goal_against'),
+    ('home_team', 'home_goal_difference', 11, 'home_recent_10_goal_diff'),
+    ('away_team', 'away_goal_difference', 11, 'away_recent_10_goal_diff'),
+
+    # 直近20試合 (window=21)
+    ('home_team', 'home_score', 21, 'home_recent_20_scores'),
+    ('away_team', 'away_score', 21, 'away_recent_20_scores'),
+    ('home_team', 'away_score', 21, 'home_recent_20_goal_against'),
+    ('away_team', 'home_score', 21, 'away_recent_20_goal_against'),
+    ('home_team', 'home_goal_difference', 21, 'home_recent_20_goal_diff'),
+    ('away_team', 'away_goal_difference', 21, 'away_recent_20_goal_diff'),
+]
+
+# ホーム側/アウェイ側それぞれのチームの特徴量 (NS試合の補完や特徴量ストアの差分更新で使用)
+HOME_ROLLING_COLUMNS = [spec[3] for spec in ROLLING_SPECS if spec[0] == 'home_team']
+AWAY_ROLLING_COLUMNS = [spec[3] for spec in ROLLING_SPECS if spec[0] == 'away_team']
+HOME_OVERALL_COLUMNS = ['home_total_points', 'home_team_recent_5_wins_overall', 'home_season_wins_ave_overall']
+AWAY_OVERALL_COLUMNS = ['away_total_points', 'away_team_recent_5_wins_overall', 'away_season_wins_ave_overall']
+
+
+def grouped_rolling_sums(codes, values, windows):
+    """
+    グループごとに「現在の行より前の直近 window 行の合計」を計算する。
+    codes: 各行のグループ番号 (int 配列)、values: 集計対象の値 (2次元配列: 行 x 列)
+    戻り値: {window: 2次元配列 (行 x 列)}
+
+    df.groupby(codes)[col].transform(lambda x: x.rolling(window, min_periods=1).sum().shift(1).fillna(0))
+    と同じ値を、グループをまたいだ1回の並べ替えと累積和の差分で求める。
+    NaN は 0 として扱う (pandas でも NaN は合計に含まれず、全て NaN の窓は fillna(0) で 0 になる)。
+    累積和の差分を使うため、整数値 (得点・勝利フラグなど) の列で結果が pandas と完全一致する。
+    """
+    n = len(codes)
+    # グループ内の行順を保ったままグループ番号で並べ替える
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+
+    # 各行が属するグループの先頭位置
+    row_pos = np.arange(n)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_start = np.maximum.accumulate(np.where(is_start, row_pos, 0))
+
+    # 累積和 (先頭に0を付けた排他的累積和)。グループ内の区間和 = cumsum[終端] - cumsum[始端]
+    sorted_values = np.nan_to_num(values[order].astype(np.float64), nan=0.0)
+    cumsum = np.zeros((n + 1, sorted_values.shape[1]))
+    np.cumsum(sorted_values, axis=0, out=cumsum[1:])
+
+    results = {}
+    for window in windows:
+        lower = np.maximum(group_start, row_pos - window)
+        sorted_result = cumsum[row_pos] - cumsum[lower]
+        result = np.empty_like(sorted_result)
+        result[order] = sorted_result
+        results[window] = result
+    return results
+
+
+def add_rolling_features(df, specs=ROLLING_SPECS):
+    """
+    specs に定義されたローリング特徴量 (合計) をまとめて計算し、df に追加する。
+    グループ化するカラムごとに1回だけ並べ替え・累積和を行い、全ての集計対象列・ウィンドウを同時に計算する。
+    df は時系列順にソート済みであること。
+    """
+    new_columns = {}
+    for group_col in dict.fromkeys(spec[0] for spec in specs):
+        group_specs = [spec for spec in specs if spec[0] == group_col]
+        target_cols = list(dict.fromkeys(spec[1] for spec in group_specs))
+        windows = sorted({spec[2] for spec in group_specs})
+
+        codes, _ = pd.factorize(df[group_col])
+        values = np.column_stack([df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in target_cols])
+        sums = grouped_rolling_sums(codes, values, windows)
+
+        for _, target_col, window, new_col in group_specs:
+            new_columns[new_col] = sums[window][:, target_cols.index(target_col)].astype(int)
+
+    # 定義順にカラムを追加する
+    for _, _, _, new_col in specs:
+        df[new_col] = new_columns[new_col]
+    return df
+
+
+# --------------------------------------------------------------------------------
+# チーム視点のロング形式テーブル (1試合 = ホーム側/アウェイ側の2行)
+# --------------------------------------------------------------------------------
+# ワイド形式の (グループ化するカラム, 集計対象のカラム) → ロング形式のチーム視点のカラム
+TEAM_VALUE_COLUMNS = {
+    ('home_team', 'is_home_win'): 'win',
+    ('home_team', 'home_score'): 'scored',
+    ('home_team', 'away_score'): 'conceded',
+    ('home_team', 'home_goal_difference'): 'goal_diff',
+    ('away_team', 'is_away_win'): 'win',
+    ('away_team', 'away_score'): 'scored',
+    ('away_team', 'home_score'): 'conceded',
+    ('away_team', 'away_goal_difference'): 'goal_diff',
+}
+TEAM_SIDES = ('home_team', 'away_team')
+
+
+def team_column_name(wide_col):
+    """ワイド形式の特徴量名からホーム/アウェイの接頭辞を除いたチーム視点の名前を返す"""
+    for prefix in ('home_', 'away_'):
+        if wide_col.startswith(prefix):
+            return wide_col[len(prefix):]
+    return wide_col
+
+
+def team_index(df):
+    """ホーム/アウェイ共通のチーム番号 (チーム名の辞書順で固定) を返す"""
+    home = df['home_team'].astype(str).to_numpy()
+    away = df['away_team'].astype(str).to_numpy()
+    names = pd.Index(np.union1d(home, away))
+    return names.get_indexer(home), names.get_indexer(away), names
+
+
+def build_team_long(df):
+    """
+    (試合, チーム, ホーム/アウェイ) のロング形式テーブルを作成する。
+    試合 i のホーム側が 2i 行目、アウェイ側が 2i+1 行目になる (df と同じ時系列順)。
+    """
+    home_idx, away_idx, _ = team_index(df)
+    n = len(df)
+
+    def interleave(home_values, away_values):
+        return np.stack([np.asarray(home_values), np.asarray(away_values)], axis=1).ravel()
+
+    target = df['target'].astype(object).to_numpy()
+    long = pd.DataFrame({
+        'match_id': np.repeat(df.index.to_numpy(), 2),
+        'side': np.tile(np.array([0, 1], dtype=np.int8), n),
+        'team': interleave(home_idx, away_idx).astype(np.int32),
+        'season': np.repeat(df['season'].to_numpy(), 2),
+        # 勝ち点 (H:3 D:1 A:0 をチーム視点で)
+        'points': interleave(
+            np.select([target == 'H', target == 'D', target == 'A'], [3, 1, 0], default=np.nan),
+            np.select([target == 'A', target == 'D', target == 'H'], [3, 1, 0], default=np.nan),
+        ),
+    })
+    # 勝利フラグ・得点・失点・得失点差 (チーム視点)
+    for long_col in dict.fromkeys(TEAM_VALUE_COLUMNS.values()):
+        source = {group_col: target_col for (group_col, target_col), col in TEAM_VALUE_COLUMNS.items() if col == long_col}
+        long[long_col] = interleave(*(
+            df[source[side]].to_numpy(dtype=np.float64, na_value=np.nan) for side in TEAM_SIDES
+        ))
+    return long
+
+
+def add_long_team_features(long, specs=ROLLING_SPECS):
+    """
+    ロング形式テーブル上でチーム単位の特徴量を計算して追加する。
+    - ホーム/アウェイ別のローリング特徴量: (チーム, ホーム/アウェイ) ごと
+    - ホーム/アウェイ区別なしの成績: (シーズン, チーム) ごと
+    いずれも現在の試合を含まない、直前までの試合で集計する。
+    """
+    # ホーム/アウェイ別 (specs のホーム側の定義をチーム視点に読み替える。アウェイ側も同じ定義になる)
+    side_specs = [(TEAM_VALUE_COLUMNS[(group_col, target_col)], window, team_column_name(new_col))
+                  for group_col, target_col, window, new_col in specs if group_col == 'home_team']
+    value_cols = list(dict.fromkeys(spec[0] for spec in side_specs))
+    side_codes = long['team'].to_numpy() * 2 + long['side'].to_numpy()
+    sums = grouped_rolling_sums(side_codes, long[value_cols].to_numpy(), sorted({spec[1] for spec in side_specs}))
+    for value_col, window, team_col in side_specs:
+        long[team_col] = sums[window][:, value_cols.index(value_col)].astype(int)
+
+    # ホーム/アウェイ区別なし (シーズン内)。平均は合計 / 窓内の試合数で求める
+    season_codes, _ = pd.factorize(pd.MultiIndex.from_arrays([long['season'], long['team']]))
+    values = np.column_stack([long['points'].to_numpy(), long['win'].to_numpy(), np.ones(len(long))])
+    sums = grouped_rolling_sums(season_codes, values, [6, OVERALL_WINDOW])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recent_5_mean = sums[6][:, 1] / sums[6][:, 2]
+        season_mean = sums[OVERALL_WINDOW][:, 1] / sums[OVERALL_WINDOW][:, 2]
+
+    # 勝ち点の累積 (試合前まで)
+    long['total_points'] = sums[OVERALL_WINDOW][:, 0].astype(int)
+    # 直近5試合の勝率 (整数化)
+    long['team_recent_5_wins_overall'] = np.nan_to_num(recent_5_mean, nan=0.0).astype(int)
+    # シーズン勝率 (%)
+    long['season_wins_ave_overall'] = np.nan_to_num(np.round(season_mean * 100, 2), nan=0.0)
+    return long
+
+
+def pivot_team_features(df, long, specs=ROLLING_SPECS):
+    """ロング形式で計算したチーム単位の特徴量を、1回の並べ替えでワイド形式 (試合単位) に戻して df に追加する"""
+    n = len(df)
+    wide_columns = {}
+    for _, _, _, new_col in specs:
+        side_index = 0 if new_col.startswith('home_') else 1
+        wide_columns[new_col] = long[team_column_name(new_col)].to_numpy().reshape(n, 2)[:, side_index]
+
+    wide_columns['match_id'] = df.index.to_numpy()
+    for side_index, prefix in enumerate(('home', 'away')):
+        wide_columns[f'{prefix}_total_points'] = long['total_points'].to_numpy().reshape(n, 2)[:, side_index]
+    # home teamとaway teamの勝ち点差カラム
+    wide_columns['points_difference'] = wide_columns['home_total_points'] - wide_columns['away_total_points']
+    for side_index, columns in enumerate((HOME_OVERALL_COLUMNS, AWAY_OVERALL_COLUMNS)):
+        for wide_col in columns[1:]:
+            wide_columns[wide_col] = long[team_column_name(wide_col)].to_numpy().reshape(n, 2)[:, side_index]
+
+    df = df.reset_index(drop=True)
+    return pd.concat([df, pd.DataFrame(wide_columns, index=df.index)], axis=1)
+
+
+def add_team_features(df):
+    """
+    ローリング特徴量とチーム単位の成績をまとめて計算する (特徴量ストアの全再計算でも使用)。
+    チーム視点のロング形式テーブルを1つ作り、全ての特徴量をその上で計算してからワイド形式に戻す。
+    df は時系列順にソート済みであること。各試合の識別には df.index を match_id として使用する。
+    """
+    long = build_team_long(df)
+    long = add_long_team_features(long)
+    return pivot_team_features(df, long)
+
+
+def latest_source_rows(df, source_mask, target_mask, source_team_cols, target_team_col):
+    """
+    target_mask の各行について、同じチームの source_mask の行のうち日付が直前 (同日を含む) のものを
+    merge_asof で求める。
+    source_team_cols: 置き換え元でチームを表すカラム (複数指定するとどちらの立場の試合も対象)
+    戻り値: target の index, 置き換え元の index, 置き換え元でのチームのカラム名 (該当なしの行は除く)
+    """
+    sources = pd.concat([
+        pd.DataFrame({'date': df.loc[source_mask, 'date'], 'team': df.loc[source_mask, col].astype(str),
+                      'source_idx': df.index[source_mask], 'source_col': col})
+        for col in source_team_cols
+    ]).sort_values(['date', 'source_idx'], kind='stable')
+    targets = pd.DataFrame({'date': df.loc[target_mask, 'date'], 'team': df.loc[target_mask, target_team_col].astype(str),
+                            'target_idx': df.index[target_mask]}).sort_values('date', kind='stable')
+
+    joined = pd.merge_asof(targets, sources, on='date', by='team', direction='backward')
+    joined = joined.dropna(subset=['source_idx'])
+    return joined['target_idx'].to_numpy(), joined['source_idx'].astype(int).to_numpy(), joined['source_col'].to_numpy()
+
+
+def fill_not_started_features(df):
+    """
+    まだ行われていない試合 (status="NS") のチーム単位の特徴量を、各チームのその試合日より前の
+    最新の FT (Full Time) 試合の値で補完する。
+    - ホーム側の特徴量: 直前のホーム試合の値 / アウェイ側の特徴量: 直前のアウェイ試合の値
+    - ホーム/アウェイ区別なしの成績: 直前の試合 (どちらの立場でも) でのそのチーム自身の値
+    シーズンを問わず、複数節先の試合にも同じ方法で適用できる。df の index は一意であること。
+    """
+    ft_mask = df['status'] == 'FT'
+    ns_mask = df['status'] == 'NS'
+
+    # ホーム限定 / アウェイ限定データの補完
+    for team_col, columns in (('home_team', HOME_ROLLING_COLUMNS), ('away_team', AWAY_ROLLING_COLUMNS)):
+        target_idx, source_idx, _ = latest_source_rows(df, ft_mask, ns_mask, [team_col], team_col)
+        for col in columns:
+            df.loc[target_idx, col] = df.loc[source_idx, col].to_numpy()
+
+    # home,awayの区別なしでカウントしているデータ (overall) の補完
+    # 置き換え元の試合でチームがホーム側だったかアウェイ側だったかで、参照するカラムを切り替える
+    overall_columns = {'home_team': HOME_OVERALL_COLUMNS, 'away_team': AWAY_OVERALL_COLUMNS}
+    for team_col, target_columns in overall_columns.items():
+        target_idx, source_idx, source_col = latest_source_rows(df, ft_mask, ns_mask, ['home_team', 'away_team'], team_col)
+        for position, target_col in enumerate(target_columns):
+            values = np.where(
+                source_col == 'home_team',
+                df.loc[source_idx, HOME_OVERALL_COLUMNS[position]].to_numpy(),
+                df.loc[source_idx, AWAY_OVERALL_COLUMNS[position]].to_numpy(),
+            )
+            df.loc[target_idx, target_col] = values
+    return df
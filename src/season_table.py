@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from team_registry import init_registry, register_teams, load_alias_ids
+
+# --------------------------------------------------------------------------------
+# 過去シーズンの順位表 (premier_league.csv) と昇格組の代理値
+# --------------------------------------------------------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(SCRIPT_DIR, "..")
+
+# 順位表の取り込み先 (試合データと同じDB) と取り込み元の CSV
+DB_PATH = os.path.join(PROJECT_ROOT, "db", "matches.db")
+SEASON_DATA_PATH = os.path.join(PROJECT_ROOT, "data", "premier_league.csv")
+
+# チャンピオンシップ (2部) の順位表 (premier_league.csv と同じ形式。昇格組の推定に使用、任意)
+CHAMPIONSHIP_DATA_PATH = os.path.join(PROJECT_ROOT, "data", "championship.csv")
+
+# 順位表のカラム → 結合後のカラム名 (home_/away_ の接頭辞を付けて使用)
+SEASON_COL_MAP = {
+    "points": "last_points",
+    "position": "last_position", "won": "last_won", "drawn": "last_drawn",
+    "lost": "last_lost", "gf": "last_gf", "ga": "last_ga", "gd": "last_gd"
+}
+SEASON_STAT_COLUMNS = list(SEASON_COL_MAP.keys())
+
+# season_standings に保存するカラム (premier_league.csv と同じ順序)
+STANDINGS_COLUMNS = ["position", "won", "drawn", "lost", "gf", "ga", "gd", "points"]
+
+# 1シーズンの試合数 (プレミアリーグ / チャンピオンシップ)
+LEAGUE_GAMES = 38
+CHAMPIONSHIP_GAMES = 46
+
+# 降格圏 (18〜20位) と昇格枠 (チャンピオンシップ1〜3位 ※プレーオフ勝者は3〜6位のいずれか)
+RELEGATION_POSITIONS = [18, 19, 20]
+PROMOTION_POSITIONS = [1, 2, 3]
+
+
+# --------------------------------------------------------------------------------
+# 昇格組の代理値ルール
+# 各ルールは順位表 (season_df) から、season_end_year をキーとした代理値テーブル
+# (カラムは SEASON_STAT_COLUMNS) を返す。
+# --------------------------------------------------------------------------------
+def baseline_position_17(season_df):
+    """そのシーズンの17位 (残留ライン) の成績"""
+    rows = season_df[season_df["position"] == 17]
+    return rows.drop_duplicates("season_end_year").set_index("season_end_year")[SEASON_STAT_COLUMNS]
+
+
+def baseline_relegated_average(season_df):
+    """そのシーズンの降格チーム (18〜20位) の平均成績"""
+    rows = season_df[season_df["position"].isin(RELEGATION_POSITIONS)]
+    return rows.groupby("season_end_year")[SEASON_STAT_COLUMNS].mean()
+
+
+def baseline_championship(season_df, championship_df=None, alias_ids=None):
+    """
+    チャンピオンシップの昇格チーム (1〜3位) の成績から推定した成績。
+    - 46試合の成績を38試合に換算し、昇格チームの平均を取る
+    - 2部と1部の差は、降格チームの「降格前のプレミアリーグの成績」と「降格後のチャンピオンシップの成績 (38試合換算)」の
+      平均的な差で補正する (そのシーズンより前の降格チームのみの累積平均)
+    - 順位は、推定した勝ち点をそのシーズンの順位表に当てはめて決める
+    チャンピオンシップの順位表のチーム名は別名レジストリ (alias_ids: 別名 → team_id) で team_id に変換し、
+    降格チームの対応付けは team_id で行う (season_df のチーム名は正式名、CSV は順位表の表記のため)。
+    チャンピオンシップの順位表がない場合は17位の成績を使用する。
+    """
+    if championship_df is None:
+        if not os.path.exists(CHAMPIONSHIP_DATA_PATH):
+            print(f"⚠️ チャンピオンシップの順位表 '{CHAMPIONSHIP_DATA_PATH}' がないため、17位の成績で代用します。")
+            return baseline_position_17(season_df)
+        championship_df = pd.read_csv(CHAMPIONSHIP_DATA_PATH)
+
+    count_cols = [col for col in SEASON_STAT_COLUMNS if col != "position"]
+    scaled = championship_df.copy()
+    scaled[count_cols] = scaled[count_cols] * LEAGUE_GAMES / CHAMPIONSHIP_GAMES
+
+    # チャンピオンシップの表記を team_id に変換 (レジストリにない表記はリーグ間の差の補正に使えない)
+    scaled["team_id"] = scaled["team"].map(alias_ids or {})
+    unmatched = scaled[scaled["team_id"].isna()]
+    if not unmatched.empty:
+        print(f"⚠️ チャンピオンシップの順位表のチーム名 {unmatched['team'].nunique()} 件がレジストリに登録されていません "
+              "(リーグ間の差の補正に使いません):")
+        for team, seasons in unmatched.groupby("team")["season_end_year"]:
+            print(f"   - {team} (シーズン: {', '.join(map(str, sorted(seasons)))})")
+        print("   python src/team_registry.py alias \"<順位表の表記>\" \"<API の表記>\" で登録できます。")
+
+    # 降格チーム: プレミアリーグ (降格したシーズン) とチャンピオンシップ (翌シーズン) の成績の差
+    relegated = season_df[season_df["position"].isin(RELEGATION_POSITIONS)][["season_end_year", "team_id"] + count_cols]
+    next_season = (scaled.dropna(subset=["team_id"])[["season_end_year", "team_id"] + count_cols]
+                   .astype({"team_id": relegated["team_id"].dtype})
+                   .assign(season_end_year=lambda d: d["season_end_year"] - 1))
+    pairs = relegated.merge(next_season, on=["season_end_year", "team_id"], suffixes=("_pl", "_ch"))
+    gaps = pd.DataFrame({col: pairs[f"{col}_ch"] - pairs[f"{col}_pl"] for col in count_cols})
+    gaps["season_end_year"] = pairs["season_end_year"]
+
+    promoted = scaled[scaled["position"].isin(PROMOTION_POSITIONS)]
+    promoted_mean = promoted.groupby("season_end_year")[count_cols].mean()
+
+    # シーズン Y の代理値には、降格シーズンが Y より前のペア (Y 以前のチャンピオンシップで成績が確定済み) の平均だけを使う。
+    # 全ペアの平均を使うと、将来のシーズンの成績が過去の昇格組の特徴量 (CV・バックテスト) に入り込むため
+    by_season = gaps.groupby("season_end_year")[count_cols]
+    league_gap = by_season.sum().cumsum().div(by_season.size().cumsum(), axis=0)
+    league_gap.index = league_gap.index + 1
+    league_gap = league_gap.reindex(league_gap.index.union(promoted_mean.index)).ffill().reindex(promoted_mean.index)
+    no_gap_seasons = league_gap.index[league_gap.isna().all(axis=1)]
+    if len(no_gap_seasons):
+        print(f"⚠️ シーズン {', '.join(map(str, no_gap_seasons))} より前の降格チームのチャンピオンシップでの成績が見つからないため、"
+              "リーグ間の差を補正せずに推定します。")
+    baseline = promoted_mean - league_gap.fillna(0.0)
+
+    # 推定した勝ち点がプレミアリーグの順位表で何位に相当するか
+    points_by_season = season_df.groupby("season_end_year")["points"].apply(np.sort)
+    baseline["position"] = [
+        min(len(points_by_season[season]) - np.searchsorted(points_by_season[season], points, side="right") + 1,
+            len(points_by_season[season]))
+        if season in points_by_season.index else np.nan
+        for season, points in baseline["points"].items()
+    ]
+    return baseline[SEASON_STAT_COLUMNS]
+
+
+# 使用可能な代理値ルール
+BASELINE_RULES = {
+    "position_17": baseline_position_17,
+    "relegated_average": baseline_relegated_average,
+    "championship": baseline_championship,
+}
+
+
+def promoted_baseline(season_df, rule="position_17", alias_ids=None):
+    """
+    指定したルールで、昇格組の代理値テーブル (season_end_year ごとに1行) を作成する。
+    alias_ids (別名 → team_id) は順位表以外の CSV を読むルール (championship) のみが使用する。
+    """
+    if rule not in BASELINE_RULES:
+        raise ValueError(f"不明な代理値ルールです: {rule} (選択肢: {', '.join(BASELINE_RULES)})")
+    if rule == "championship":
+        return baseline_championship(season_df, alias_ids=alias_ids)
+    return BASELINE_RULES[rule](season_df)
+
+
+def fill_promoted_teams(df, baseline):
+    """
+    前シーズンの成績が結合できなかったチーム (昇格組) の欠損値を、試合のシーズンの代理値で埋める。
+    ホーム側/アウェイ側それぞれ1回の参照と fillna で処理する。
+    """
+    missing_seasons = sorted(set(df["season"].unique()) - set(baseline.index))
+    for season in missing_seasons:
+        print(f"警告: シーズン {season} の代理値が見つかりませんでした。このシーズンの昇格組の処理をスキップします。")
+
+    for side in ("home", "away"):
+        side_baseline = baseline.rename(columns={col: f"{side}_{SEASON_COL_MAP[col]}" for col in SEASON_STAT_COLUMNS})
+        fill_values = side_baseline.reindex(df["season"].to_numpy())
+        fill_values.index = df.index
+        cols = list(side_baseline.columns)
+        df[cols] = df[cols].fillna(fill_values)
+    return df
+
+
+# --------------------------------------------------------------------------------
+# 順位表の取り込み (CSV → SQLite、チーム名は別名レジストリで team_id に正規化)
+# --------------------------------------------------------------------------------
+def create_season_tables(conn):
+    columns = ",\n".join(f"{col} INTEGER" for col in STANDINGS_COLUMNS)
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS season_standings (
+        season_end_year INTEGER,
+        team_id INTEGER REFERENCES teams (team_id),
+        {columns},
+        PRIMARY KEY (season_end_year, team_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS season_table_imports (
+        source TEXT PRIMARY KEY,
+        sha256 TEXT,
+        imported_at TEXT,
+        rows INTEGER,
+        unmatched INTEGER
+    )
+    ''')
+    conn.commit()
+
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def match_team_names(conn):
+    """試合データ (matches) に登場するチーム名"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'matches'").fetchone() is None:
+        return set()
+    return {row[0] for row in conn.execute("SELECT home_team FROM matches UNION SELECT away_team FROM matches")}
+
+
+def import_season_table(conn, csv_path=SEASON_DATA_PATH):
+    """
+    順位表 CSV を読み込み、チーム名を別名レジストリで team_id に変換して season_standings に保存する。
+    対応するチームが見つからない表記は保存せずに一覧を表示する (team_registry.py alias で別名を登録して再取り込みする)。
+    """
+    init_registry(conn)
+    create_season_tables(conn)
+
+    # 試合データのチーム名を正式名として登録
+    api_names = match_team_names(conn)
+    register_teams(conn, [(name, None) for name in sorted(api_names)])
+    alias_ids = load_alias_ids(conn)
+
+    season_df = pd.read_csv(csv_path)
+    season_df["team_id"] = season_df["team"].map(alias_ids)
+
+    unmatched = season_df[season_df["team_id"].isna()]
+    if not unmatched.empty:
+        print(f"❌ 順位表のチーム名 {unmatched['team'].nunique()} 件がレジストリに登録されていません (この行は取り込みません):")
+        for team, seasons in unmatched.groupby("team")["season_end_year"]:
+            print(f"   - {team} (シーズン: {', '.join(map(str, sorted(seasons)))})")
+        print("   python src/team_registry.py alias \"<順位表の表記>\" \"<API の表記>\" で登録してから再度取り込んでください。")
+
+    # 別名は登録されているが、試合データには登場しないチーム (API の表記が別名の登録先と違う可能性がある)
+    matched = season_df.dropna(subset=["team_id"])
+    if api_names:
+        id_to_name = dict(conn.execute("SELECT team_id, name FROM teams"))
+        not_in_matches = sorted({team for team, team_id in zip(matched["team"], matched["team_id"])
+                                 if id_to_name[int(team_id)] not in api_names})
+        if not_in_matches:
+            print(f"⚠️ 試合データに登場しないチームの順位表があります: {', '.join(not_in_matches)}")
+
+    conn.execute("DELETE FROM season_standings")
+    rows = matched[["season_end_year", "team_id"] + STANDINGS_COLUMNS].astype(int)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO season_standings (season_end_year, team_id, {', '.join(STANDINGS_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * (len(STANDINGS_COLUMNS) + 2))})",
+        rows.itertuples(index=False, name=None)
+    )
+    conn.execute('''
+    INSERT OR REPLACE INTO season_table_imports (source, sha256, imported_at, rows, unmatched) VALUES (?, ?, ?, ?, ?)
+    ''', (os.path.basename(csv_path), file_sha256(csv_path), datetime.now().isoformat(timespec="seconds"),
+          len(rows), len(unmatched)))
+    conn.commit()
+    print(f"✅ 順位表を取り込みました: {len(rows)} 行 (未対応 {len(unmatched)} 行)")
+    return len(unmatched)
+
+
+def ensure_season_table(conn, csv_path=SEASON_DATA_PATH):
+    """
+    順位表が未取り込み、または CSV が前回の取り込みから変更されている場合のみ取り込む。
+    取り込み済みの順位表が使える場合は True を返す。
+    """
+    create_season_tables(conn)
+    imported = conn.execute(
+        "SELECT sha256 FROM season_table_imports WHERE source = ?", (os.path.basename(csv_path),)
+    ).fetchone()
+    if os.path.exists(csv_path):
+        if imported is None or imported[0] != file_sha256(csv_path):
+            import_season_table(conn, csv_path)
+        return True
+    return imported is not None
+
+
+def load_season_table(conn):
+    """取り込み済みの順位表を読み込む (カラム: season_end_year, team_id, team (正式名), position, ..., points)"""
+    return pd.read_sql_query(f'''
+    SELECT s.season_end_year, s.team_id, t.name AS team, {', '.join('s.' + col for col in STANDINGS_COLUMNS)}
+    FROM season_standings s JOIN teams t USING (team_id)
+    ORDER BY s.season_end_year, s.position
+    ''', conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="過去シーズンの順位表の取り込み")
+    parser.add_argument("command", choices=["import"], help="import: CSV を読み込んで DB に保存する")
+    parser.add_argument("--csv", default=SEASON_DATA_PATH, help="順位表 CSV のパス")
+    parser.add_argument("--db", default=DB_PATH, help="DBファイルのパス")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        unmatched = import_season_table(conn, args.csv)
+    finally:
+        conn.close()
+    return 1 if unmatched else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
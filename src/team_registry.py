@@ -0,0 +1,115 @@
+import argparse
+import os
+import sqlite3
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, "..", "db", "matches.db")
+
+# --------------------------------------------------------------------------------
+# チーム名の別名レジストリ
+# - teams: 正式なチーム (team_id は内部の連番、name は API-FOOTBALL の表記)
+# - team_aliases: 別名 (順位表 CSV などの表記) → team_id。正式名も自分自身の別名として登録する
+# --------------------------------------------------------------------------------
+
+# 順位表 (premier_league.csv) の表記 → API-FOOTBALL の表記
+DEFAULT_TEAM_ALIASES = {
+    'Manchester City': 'Manchester City', 'Manchester Utd': 'Manchester United', 'Liverpool': 'Liverpool',
+    'Chelsea': 'Chelsea', 'Leicester City': 'Leicester', 'West Ham': 'West Ham', 'Tottenham': 'Tottenham',
+    'Arsenal': 'Arsenal', 'Leeds United': 'Leeds', 'Everton': 'Everton', 'Aston Villa': 'Aston Villa',
+    'Newcastle Utd': 'Newcastle', 'Wolves': 'Wolves', 'Crystal Palace': 'Crystal Palace',
+    'Southampton': 'Southampton', 'Brighton': 'Brighton', 'Burnley': 'Burnley', 'Fulham': 'Fulham',
+    'Sheffield Utd': 'Sheffield Utd', 'Brentford': 'Brentford', 'Watford': 'Watford', 'Norwich City': 'Norwich',
+    'Bournemouth': 'Bournemouth', 'Nottingham Forest': 'Nottingham Forest', 'Luton Town': 'Luton',
+    'Ipswich': 'Ipswich',
+}
+
+
+def create_registry_tables(cursor):
+    """チーム・別名テーブルを作成する (data_fetcher2 のマイグレーションからも使用)"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS teams (
+        team_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        api_team_id INTEGER
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS team_aliases (
+        alias TEXT PRIMARY KEY,
+        team_id INTEGER NOT NULL REFERENCES teams (team_id)
+    )
+    ''')
+
+
+def init_registry(conn):
+    """レジストリのテーブルを作成し、既定の別名を登録する"""
+    create_registry_tables(conn.cursor())
+    for alias, name in DEFAULT_TEAM_ALIASES.items():
+        add_alias(conn, alias, name, replace=False)
+    conn.commit()
+
+
+def register_teams(conn, teams):
+    """
+    チームを正式名で登録する (登録済みの場合は何もしない)。teams: [(name, api_team_id or None), ...]
+    新しく登録したチーム名のリストを返す。
+    """
+    new_names = []
+    for name, api_team_id in teams:
+        if name is None:
+            continue
+        cursor = conn.execute("INSERT OR IGNORE INTO teams (name, api_team_id) VALUES (?, ?)", (name, api_team_id))
+        if cursor.rowcount:
+            new_names.append(name)
+        elif api_team_id is not None:
+            conn.execute("UPDATE teams SET api_team_id = ? WHERE name = ? AND api_team_id IS NULL", (api_team_id, name))
+        conn.execute('''
+        INSERT OR IGNORE INTO team_aliases (alias, team_id) SELECT ?, team_id FROM teams WHERE name = ?
+        ''', (name, name))
+    return new_names
+
+
+def add_alias(conn, alias, name, replace=True):
+    """別名を登録する (正式名のチームがなければ作成する)。replace=False の場合は登録済みの別名を変更しない"""
+    register_teams(conn, [(name, None)])
+    conn.execute(f'''
+    INSERT OR {"REPLACE" if replace else "IGNORE"} INTO team_aliases (alias, team_id) SELECT ?, team_id FROM teams WHERE name = ?
+    ''', (alias, name))
+
+
+def load_alias_ids(conn):
+    """別名 (正式名を含む) → team_id の辞書を返す"""
+    return dict(conn.execute("SELECT alias, team_id FROM team_aliases"))
+
+
+def load_team_names(conn):
+    """team_id → 正式名の辞書を返す"""
+    return dict(conn.execute("SELECT team_id, name FROM teams"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チーム名の別名レジストリの管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    alias = subparsers.add_parser("alias", help="別名を登録する (例: alias \"Sheffield United\" \"Sheffield Utd\")")
+    alias.add_argument("alias", help="順位表などでの表記")
+    alias.add_argument("name", help="API-FOOTBALL の表記 (正式名)")
+    subparsers.add_parser("list", help="登録済みの別名を表示する")
+    parser.add_argument("--db", default=DB_PATH, help="DBファイルのパス")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    init_registry(conn)
+    if args.command == "alias":
+        add_alias(conn, args.alias, args.name)
+        conn.commit()
+        print(f"✅ 別名を登録しました: {args.alias} -> {args.name}")
+    else:
+        for alias_name, name in conn.execute('''
+        SELECT a.alias, t.name FROM team_aliases a JOIN teams t USING (team_id) ORDER BY t.name, a.alias
+        '''):
+            print(f"{alias_name} -> {name}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
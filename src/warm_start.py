@@ -0,0 +1,197 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, log_loss
+
+# --------------------------------------------------------------------------------
+# 最終モデルの差分再学習 (ウォームスタート)
+# 前回の最終モデルに、前回以降に結果が出た試合で木を追加する (LightGBM の init_model)。
+# 次の場合は全データでの再学習 (full) にする:
+# - 前回の全データ学習から WARM_START_MAX_DAYS 日以上経過した
+# - 特徴量のスキーマ (カラム・型・チームのカテゴリ・ラベル) が変わった
+# - 全データ学習以降の試合の特徴量の分布が変化した (PSI が DRIFT_PSI_THRESHOLD 以上)
+# --------------------------------------------------------------------------------
+
+# 前回の全データ学習からこの日数が経過したら全データで学習し直す
+WARM_START_MAX_DAYS = 7
+
+# ウォームスタートで追加する木の数 (1クラスあたり)
+WARM_START_ROUNDS = 10
+
+# ウォームスタートに使う最小の試合数。新しい試合が少ない場合は直近の試合を含めてこの件数にする
+# (min_child_samples より少ない件数では木が分岐できないため)
+WARM_START_MIN_ROWS = 200
+
+# 特徴量の分布の変化 (PSI: Population Stability Index) の閾値。0.2 以上は大きな変化とみなす
+DRIFT_PSI_THRESHOLD = 0.2
+
+# 分布の変化を判定する最小の試合数 (これより少ない場合は判定しない)
+DRIFT_MIN_ROWS = 50
+
+# PSI を計算するときの分位点による区間数
+DRIFT_BINS = 10
+
+# メタデータの日時の形式 (最終モデルの meta.json の trained_at と同じ)
+TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+def schema_hash(input_x, target_labels):
+    """特徴量のカラム・型・カテゴリ、ラベルの順序から、スキーマのハッシュ値を作成する"""
+    schema = {
+        "columns": [[col, str(dtype)] for col, dtype in input_x.dtypes.items()],
+        "categories": {col: input_x[col].cat.categories.astype(str).tolist()
+                       for col in input_x.columns if isinstance(input_x[col].dtype, pd.CategoricalDtype)},
+        "labels": [str(label) for label in target_labels],
+    }
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def feature_reference(input_x):
+    """数値の特徴量ごとに、分位点の区間の境界と各区間の割合を返す (PSI の基準分布)"""
+    reference = {}
+    for col in input_x.columns:
+        if isinstance(input_x[col].dtype, pd.CategoricalDtype):
+            continue
+        values = input_x[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            continue
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, DRIFT_BINS + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+        reference[col] = {"edges": edges.tolist(), "proportions": (counts / counts.sum()).tolist()}
+    return reference
+
+
+def population_stability(reference, input_x):
+    """特徴量ごとの PSI (基準分布に対する input_x の分布の変化) を返す"""
+    psi = {}
+    for col, ref in reference.items():
+        if col not in input_x.columns:
+            continue
+        values = input_x[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            continue
+        counts = np.bincount(np.searchsorted(ref["edges"], values, side="right"), minlength=len(ref["edges"]) + 1)
+        # 0 の区間があると対数が発散するため、小さな値で下限を設ける
+        expected = np.clip(np.asarray(ref["proportions"]), 1e-4, None)
+        actual = np.clip(counts / counts.sum(), 1e-4, None)
+        psi[col] = float(np.sum((actual - expected) * np.log(actual / expected)))
+    return psi
+
+
+def training_meta(input_x, dates, target_labels):
+    """ウォームスタートの判定に使う、学習データの情報 (最終モデルのメタデータに記録する)"""
+    return {
+        "trained_through": pd.Timestamp(dates.max()).isoformat(),
+        "schema_hash": schema_hash(input_x, target_labels),
+        "target_labels": [str(label) for label in target_labels],
+        "feature_reference": feature_reference(input_x),
+    }
+
+
+def retrain_decision(meta, input_x, dates, target_labels, model_params, now=None):
+    """
+    前回の最終モデルのメタデータ (モデルレジストリの meta.json) から、再学習の方法を決める。
+    ("full" | "warm" | "keep", 理由) を返す。keep は新しい試合がなく、前回のモデルをそのまま使う場合。
+    """
+    now = now or datetime.now()
+    if not meta or "full_trained_at" not in meta:
+        return "full", "前回のモデルの記録がありません"
+    if meta["schema_hash"] != schema_hash(input_x, target_labels):
+        return "full", "特徴量のスキーマが変わりました"
+    if meta["params"] != model_params:
+        return "full", "学習パラメータが変わりました"
+
+    elapsed = now - datetime.strptime(meta["full_trained_at"], TIME_FORMAT)
+    if elapsed.days >= WARM_START_MAX_DAYS:
+        return "full", f"前回の全データ学習から {elapsed.days} 日経過しました"
+
+    # 全データ学習以降の試合の特徴量の分布を、全データ学習時の分布と比較する
+    since_full = (dates > pd.Timestamp(meta["full_trained_through"])).to_numpy()
+    if since_full.sum() >= DRIFT_MIN_ROWS:
+        psi = population_stability(meta["feature_reference"], input_x[since_full])
+        # 比較できるカラムがない場合 (新しい行で全て欠損値・カラムがないなど) は PSI が空になる
+        if psi:
+            col, value = max(psi.items(), key=lambda item: item[1])
+            if value >= DRIFT_PSI_THRESHOLD:
+                return "full", f"特徴量の分布が変化しました ({col}: PSI {value:.3f})"
+
+    if not (dates > pd.Timestamp(meta["trained_through"])).any():
+        return "keep", "前回の学習以降に結果が出た試合はありません"
+    return "warm", f"前回の全データ学習から {elapsed.days} 日"
+
+
+def warm_start_rows(dates, trained_through, min_rows=WARM_START_MIN_ROWS):
+    """
+    ウォームスタートに使う行番号: trained_through より後の試合。
+    件数が min_rows より少ない場合は、直近の試合を含めて min_rows 件にする。
+    """
+    dates = pd.Series(dates).reset_index(drop=True)
+    order = np.argsort(dates.to_numpy(), kind="stable")
+    n_new = int((dates > pd.Timestamp(trained_through)).sum())
+    return np.sort(order[-max(n_new, min(min_rows, len(order))):])
+
+
+def continue_training(model, train_params, dataset, rows, num_rounds=WARM_START_ROUNDS):
+    """前回のモデル (lgb.Booster) に、dataset の rows 行で num_rounds 回分の木を追加したモデルを返す"""
+    return lgb.train(train_params, dataset.subset(rows), num_boost_round=num_rounds, init_model=model)
+
+
+# --------------------------------------------------------------------------------
+# ウォームスタートと全データ学習の比較 (時系列のfold)
+# --------------------------------------------------------------------------------
+def evaluate_warm_start(dates, dataset, input_x, folds, train_params, num_boost_round, warm_days=WARM_START_MAX_DAYS):
+    """
+    各foldで、学習期間の最後 warm_days 日を除いて学習したモデルにウォームスタートで木を追加した場合と、
+    学習期間の全データで学習した場合の、検証データでの精度・logloss・学習時間を比較する。
+    """
+    dates = pd.Series(pd.to_datetime(dates)).reset_index(drop=True)
+    y = dataset.get_label().astype(int)
+    labels = np.unique(y)
+    results = []
+    for nfold, fold in enumerate(folds):
+        train_end = pd.Timestamp(fold["train_end"])
+        base_end = train_end - pd.Timedelta(days=warm_days)
+        val_rows = np.flatnonzero(((dates >= pd.Timestamp(fold["val_start"])) & (dates <= pd.Timestamp(fold["val_end"]))).to_numpy())
+        train_rows = np.flatnonzero((dates <= train_end).to_numpy())
+        base_rows = np.flatnonzero((dates <= base_end).to_numpy())
+        if len(val_rows) == 0 or len(base_rows) == 0:
+            continue
+
+        start = time.perf_counter()
+        full_model = lgb.train(train_params, dataset.subset(train_rows), num_boost_round=num_boost_round)
+        full_time = time.perf_counter() - start
+
+        base_model = lgb.train(train_params, dataset.subset(base_rows), num_boost_round=num_boost_round)
+        start = time.perf_counter()
+        warm_rows = train_rows[warm_start_rows(dates[train_rows], base_end)]
+        warm_model = continue_training(base_model, train_params, dataset, warm_rows)
+        warm_time = time.perf_counter() - start
+
+        x_val, y_val = input_x.iloc[val_rows], y[val_rows]
+        for mode, model, seconds in [("full", full_model, full_time), ("warm", warm_model, warm_time)]:
+            proba = model.predict(x_val)
+            results.append({
+                "nfold": nfold, "mode": mode, "new_rows": len(train_rows) - len(base_rows),
+                "accuracy": accuracy_score(y_val, proba.argmax(axis=1)),
+                "log_loss": log_loss(y_val, proba, labels=labels), "train_seconds": seconds,
+            })
+
+    df_results = pd.DataFrame(results)
+    print("-" * 10, f"ウォームスタートの評価 (最後の {warm_days} 日分を追加学習)", "-" * 10)
+    if df_results.empty:
+        print("⚠️ 評価できるfoldがありません。")
+        return df_results
+    print(df_results.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    summary = df_results.groupby("mode")[["accuracy", "log_loss", "train_seconds"]].mean()
+    print(f"平均: full 精度 {summary.loc['full', 'accuracy']:.4f} / logloss {summary.loc['full', 'log_loss']:.4f} / "
+          f"{summary.loc['full', 'train_seconds']:.2f} s, "
+          f"warm 精度 {summary.loc['warm', 'accuracy']:.4f} / logloss {summary.loc['warm', 'log_loss']:.4f} / "
+          f"{summary.loc['warm', 'train_seconds']:.2f} s")
+    return df_results
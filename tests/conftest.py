@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src/ のスクリプトを import できるようにする
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
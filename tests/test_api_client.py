@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from api_client import ApiClient
+
+# 受信時刻の許容誤差 (秒)
+TOLERANCE = 0.05
+
+
+class StubApi:
+    """
+    ローカルのスタブ HTTP サーバー。responses の応答 (ステータス, ヘッダー, 本文) を受信順に返し、
+    なくなった後は 200 (errors なし) を返す。受信時刻を記録する。
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.received = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.received.append(time.monotonic())
+                    if stub.responses:
+                        status, headers, body = stub.responses.pop(0)
+                    else:
+                        status, headers, body = 200, {}, {"errors": [], "response": [self.path]}
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_api():
+    stubs = []
+
+    def start(responses=()):
+        stub = StubApi(responses)
+        stubs.append(stub)
+        return stub
+
+    yield start
+    for stub in stubs:
+        stub.close()
+
+
+def test_retries_and_keeps_rate_limit_with_concurrency(stub_api):
+    rate_limited = {"errors": {"rateLimit": "Too many requests"}, "response": []}
+    stub = stub_api([
+        (429, {"Retry-After": "1"}, {"message": "Too many requests"}),
+        (500, {}, {"message": "Internal Server Error"}),
+        (200, {}, rate_limited),
+    ])
+    requests_per_minute = 300
+    client = ApiClient("test-key", requests_per_minute=requests_per_minute, max_concurrency=4,
+                       backoff_base=0.01, base_url=stub.url)
+
+    params_list = [{"fixture": fixture_id} for fixture_id in range(6)]
+    results = list(client.fetch_many("fixtures/statistics", params_list))
+
+    assert [error for _, _, error in results] == [None] * len(params_list)
+    assert all(data["errors"] == [] for _, data, _ in results)
+    # 3回のエラー応答がそれぞれ1回ずつリトライされる
+    assert len(stub.received) == len(params_list) + 3
+
+    # 全スレッドのリクエストが 1分あたりの上限の間隔 (60 / requests_per_minute 秒) 以上空いている
+    received = sorted(stub.received)
+    interval = 60 / requests_per_minute
+    assert min(b - a for a, b in zip(received, received[1:])) >= interval - TOLERANCE
+    # 429 の後は Retry-After の間、どのスレッドもリクエストを送らない
+    assert received[1] - received[0] >= 1 - TOLERANCE
+
+
+def test_gives_up_after_max_retries(stub_api):
+    stub = stub_api([(503, {}, {"message": "Service Unavailable"})] * 3)
+    client = ApiClient("test-key", requests_per_minute=600, max_retries=2, backoff_base=0.01, base_url=stub.url)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get("fixtures/statistics", {"fixture": 1})
+    assert len(stub.received) == 3
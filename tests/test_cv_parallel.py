@@ -0,0 +1,40 @@
+import contextlib
+import io
+
+import pytest
+
+from benchmark import make_cv_data
+from prediction_pipeline1 import build_lgb_dataset, fit_fold, make_fold_tasks, train_lgb
+
+# --------------------------------------------------------------------------------
+# CVの並列実行 (train_lgb の n_workers) が逐次実行と同じ評価値になること
+# --------------------------------------------------------------------------------
+
+
+@pytest.fixture(scope="module")
+def cv_data():
+    return make_cv_data(1, 3)
+
+
+def test_parallel_folds_match_sequential(cv_data):
+    train_df, features, folds = cv_data
+    with contextlib.redirect_stdout(io.StringIO()):
+        sequential = train_lgb(train_df, train_df[features], train_df["target"], folds, n_workers=1)
+        parallel = train_lgb(train_df, train_df[features], train_df["target"], folds, n_workers=2)
+
+    # KPI (平均精度・平均F1)、ラベルの順序、最終モデルの木の数
+    assert sequential[:2] == parallel[:2]
+    assert list(sequential[2]) == list(parallel[2])
+    assert sequential[3] == parallel[3]
+
+
+def test_fold_result_does_not_depend_on_thread_count(cv_data):
+    # 並列実行では各モデルのスレッド数が (コア数 / 並列数) になるため、スレッド数だけを変えて比較する
+    train_df, features, folds = cv_data
+    input_x = train_df[features]
+    labels, _ = train_df["target"].factorize()
+    dataset = build_lgb_dataset(input_x, labels)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, train_rows, val_rows = make_fold_tasks(train_df, folds)[-1]
+    results = [fit_fold(dataset, input_x.iloc[val_rows], train_rows, val_rows, n_jobs=n_jobs) for n_jobs in (1, 4)]
+    assert results[0] == results[1]
@@ -0,0 +1,152 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import make_season_matches
+from feature_store import TEAM_FEATURE_COLUMNS, FeatureStore
+
+# --------------------------------------------------------------------------------
+# 特徴量ストアの差分更新 (update) が全再計算 (rebuild) と同じ特徴量・チームの状態になること
+# --------------------------------------------------------------------------------
+
+
+def with_results(df):
+    """スコアから勝敗のカラムを作り直す (未開始の試合はスコアなし)"""
+    df = df.copy()
+    df["status"] = np.where(df["home_score"].isna(), "NS", "FT")
+    df["target"] = np.select([df["home_score"] > df["away_score"], df["home_score"] == df["away_score"],
+                              df["home_score"] < df["away_score"]], ["H", "D", "A"], default=None)
+    df["is_home_win"] = (df["target"] == "H").astype(np.int8)
+    df["is_away_win"] = (df["target"] == "A").astype(np.int8)
+    df["home_goal_difference"] = df["home_score"] - df["away_score"]
+    df["away_goal_difference"] = df["away_score"] - df["home_score"]
+    return df.sort_values(["date", "fixture_id"]).reset_index(drop=True)
+
+
+@pytest.fixture(scope="module")
+def season():
+    """全ての試合に結果のある 2023〜2025 シーズンの試合データ (as_of で日付ごとに結果を公開する)"""
+    df = make_season_matches(1, seed=3)
+    df = df[df["season"] >= 2023].copy()
+    df["home_team"] = df["home_team"].astype(str)
+    df["away_team"] = df["away_team"].astype(str)
+    rng = np.random.default_rng(3)
+    df["home_score"] = rng.poisson(1.5, len(df)).astype(float)
+    df["away_score"] = rng.poisson(1.2, len(df)).astype(float)
+    df["fixture_id"] = np.arange(len(df)) + 5000
+    return df.reset_index(drop=True)
+
+
+def as_of(season, day):
+    """day までの試合は結果あり、それより後の試合は NS (スコアなし) の状態の試合データ"""
+    df = season.copy()
+    df.loc[df["date"] >= day, ["home_score", "away_score"]] = np.nan
+    return with_results(df)
+
+
+def assert_same_as_rebuild(store, df, result, tmp_path):
+    expected_store = FeatureStore(str(tmp_path / "expected.db"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = expected_store.rebuild(df)
+        pd.testing.assert_frame_equal(result[TEAM_FEATURE_COLUMNS], expected[TEAM_FEATURE_COLUMNS])
+        assert store.load_team_state() == expected_store.load_team_state()
+    finally:
+        expected_store.close()
+
+
+def update(store, df):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = store.update(df)
+    return result, output.getvalue()
+
+
+@pytest.mark.parametrize("first_day", ["2025-03-01", "2024-08-03"])
+def test_daily_appends_match_rebuild(season, tmp_path, first_day):
+    # シーズンの途中と、シーズンの変わり目 (ローリング窓の分だけ前シーズンの試合を残す必要がある) の日次の更新
+    days = pd.date_range(first_day, periods=4, freq="7D")
+    store = FeatureStore(str(tmp_path / "store.db"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store.rebuild(as_of(season, days[0]))
+        for day in days[1:]:
+            df = as_of(season, day)
+            result, output = update(store, df)
+            # 結果が出た試合は全て状態の最後の FT 試合より後なので、保存済みの状態から計算を続ける
+            assert "保存済みのチームの状態から計算" in output
+            assert_same_as_rebuild(store, df, result, tmp_path)
+    finally:
+        store.close()
+
+
+def test_new_fixtures_are_appended(season, tmp_path):
+    day = pd.Timestamp("2025-03-01")
+    store = FeatureStore(str(tmp_path / "store.db"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store.rebuild(as_of(season[season["date"] < day + pd.Timedelta(days=14)], day))
+        # 日程の追加 (新しい fixture_id の NS 試合) と、既存の試合の結果
+        df = as_of(season[season["date"] < day + pd.Timedelta(days=28)], day + pd.Timedelta(days=7))
+        result, _ = update(store, df)
+        assert_same_as_rebuild(store, df, result, tmp_path)
+    finally:
+        store.close()
+
+
+def test_corrected_past_score_matches_rebuild(season, tmp_path):
+    day = pd.Timestamp("2025-03-01")
+    store = FeatureStore(str(tmp_path / "store.db"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store.rebuild(as_of(season, day))
+        corrected = season.copy()
+        past = corrected.index[(corrected["date"] < day - pd.Timedelta(days=60))][-1]
+        corrected.loc[past, "home_score"] += 3
+        df = as_of(corrected, day)
+        result, output = update(store, df)
+        assert "直前の試合を含む" in output
+        assert_same_as_rebuild(store, df, result, tmp_path)
+
+        # 過去から計算し直した後の状態から、日次の更新を続けられる
+        df = as_of(corrected, day + pd.Timedelta(days=7))
+        result, output = update(store, df)
+        assert "保存済みのチームの状態から計算" in output
+        assert_same_as_rebuild(store, df, result, tmp_path)
+    finally:
+        store.close()
+
+
+def test_removed_fixture_matches_rebuild(season, tmp_path):
+    day = pd.Timestamp("2025-03-01")
+    store = FeatureStore(str(tmp_path / "store.db"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store.rebuild(as_of(season, day))
+        df = as_of(season, day)
+        # 過去の FT 試合と、未開始の試合をそれぞれ1つ削除する
+        removed = [df.loc[df["date"] < day - pd.Timedelta(days=30), "fixture_id"].iloc[-1],
+                   df.loc[df["status"] == "NS", "fixture_id"].iloc[0]]
+        df = df[~df["fixture_id"].isin(removed)].reset_index(drop=True)
+        result, _ = update(store, df)
+        assert_same_as_rebuild(store, df, result, tmp_path)
+        stored_ids = {row[0] for row in store.conn.execute("SELECT fixture_id FROM team_features")}
+        assert stored_ids == set(df["fixture_id"])
+    finally:
+        store.close()
+
+
+def test_unchanged_input_reuses_stored_features(season, tmp_path):
+    df = as_of(season, pd.Timestamp("2025-03-01"))
+    store = FeatureStore(str(tmp_path / "store.db"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store.rebuild(df)
+        result, output = update(store, df)
+        assert "変化した試合はありません" in output
+        assert_same_as_rebuild(store, df, result, tmp_path)
+    finally:
+        store.close()
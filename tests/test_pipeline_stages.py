@@ -0,0 +1,131 @@
+import contextlib
+import io
+import os
+import sqlite3
+
+import pytest
+
+import data_access
+import pipeline_stages
+import prediction_pipeline1
+import team_registry
+from benchmark import make_match_db
+
+# --------------------------------------------------------------------------------
+# ステージの出力の再利用 (入力の指紋)・--force・保存済みの出力の削除 (LRU)
+# ingest (一時ディレクトリの DB から読み込み) と folds を使う。features は順位表・特徴量ストアが必要なため、
+# ingest の出力から folds に必要な値だけを持つ記録を作って代用する。
+# --------------------------------------------------------------------------------
+
+
+@pytest.fixture
+def stages(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "matches.db")
+    make_match_db(db_path, 2)
+    monkeypatch.setattr(pipeline_stages, "ARTIFACT_DIR", str(tmp_path / "artifacts"))
+    monkeypatch.setattr(pipeline_stages, "DB_PATH", db_path)
+    monkeypatch.setattr(prediction_pipeline1, "DB_PATH", db_path)
+    monkeypatch.setattr(pipeline_stages, "LEAGUE_ID", 1)
+    monkeypatch.setattr(prediction_pipeline1, "LEAGUE_ID", 1)
+    return db_path
+
+
+def run(*stage_names, force=False):
+    """ステージを順番に実行し、(各ステージの記録, 標準出力) を返す"""
+    output = io.StringIO()
+    manifests = {}
+    with contextlib.redirect_stdout(output):
+        for stage in stage_names:
+            if stage == "features":
+                manifests[stage] = features_from_ingest()
+            else:
+                manifests[stage] = pipeline_stages.run_stage(stage, force=force)
+    return manifests, output.getvalue()
+
+
+def features_from_ingest():
+    """ingest の出力から、folds の入力 (学習データの最新の試合日) だけを持つ features の記録を作る"""
+    ingest = pipeline_stages.load_manifest("ingest")
+    matches = pipeline_stages.load_frame(ingest, "matches")
+    latest = matches.loc[matches["status"] == "FT", "date"].max()
+    key = pipeline_stages.value_hash(ingest["outputs"])[:16]
+    return pipeline_stages.save_artifact("features", key, {"ingest": ingest["outputs"]},
+                                         values={"latest_match_date": latest, "n_matches": len(matches)})
+
+
+def update_score(db_path, fixture_id, score):
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE matches SET home_score = ? WHERE fixture_id = ?", (score, fixture_id))
+    conn.commit()
+    conn.close()
+
+
+def test_second_run_is_a_no_op(stages):
+    first, output = run("ingest", "features", "folds")
+    assert "✅ ingest: 試合データ" in output
+    assert first["ingest"]["values"] == {} and first["folds"]["values"]["folds"]
+    saved = {stage: os.path.getmtime(pipeline_stages.artifact_path(stage, manifest["key"], "manifest.json"))
+             for stage, manifest in first.items()}
+    artifacts = [(stage, key) for _, stage, key, _ in pipeline_stages.list_artifacts()]
+
+    second, output = run("ingest", "features", "folds")
+    assert "✅ ingest: 入力に変更がないため" in output
+    assert "✅ folds: 入力に変更がないため" in output
+    assert {stage: manifest["key"] for stage, manifest in second.items()} == \
+           {stage: manifest["key"] for stage, manifest in first.items()}
+    assert second["ingest"]["created_at"] == first["ingest"]["created_at"]
+    assert [(stage, key) for _, stage, key, _ in pipeline_stages.list_artifacts()] == artifacts
+    # 出力は作り直さず、最後に使われた日時だけを更新する
+    assert all(os.path.getmtime(pipeline_stages.artifact_path(stage, second[stage]["key"], "manifest.json"))
+               >= saved[stage] for stage in saved)
+
+
+def test_force_reruns_with_the_same_key(stages):
+    first, _ = run("ingest")
+    forced, output = run("ingest", force=True)
+    assert "✅ ingest: 試合データ" in output
+    assert forced["ingest"]["key"] == first["ingest"]["key"]
+
+
+def test_changed_input_gives_a_new_key(stages):
+    first, _ = run("ingest", "features", "folds")
+    update_score(stages, 100000, 9)
+    second, output = run("ingest", "features", "folds")
+    assert "✅ ingest: 試合データ" in output
+    assert second["ingest"]["key"] != first["ingest"]["key"]
+    assert second["ingest"]["outputs"]["matches"] != first["ingest"]["outputs"]["matches"]
+    # 学習データの最新の試合日は変わらないため、folds は保存済みの出力を使う
+    assert "✅ folds: 入力に変更がないため" in output
+    assert second["folds"]["key"] == first["folds"]["key"]
+
+
+def test_stage_code_covers_called_modules():
+    assert data_access in pipeline_stages.STAGE_CODE["ingest"]
+    assert team_registry in pipeline_stages.STAGE_CODE["features"]
+
+
+def test_eviction_removes_least_recently_used_and_keeps_latest(stages):
+    keys = []
+    for score in (None, 7, 8):
+        if score is not None:
+            update_score(stages, 100000, score)
+        manifests, _ = run("ingest")
+        keys.append(manifests["ingest"]["key"])
+    # 2番目の出力を使い直す (最新になる)。残りは 1番目 (最後に使われたのが最も古い) と 3番目
+    update_score(stages, 100000, 7)
+    manifests, _ = run("ingest")
+    assert manifests["ingest"]["key"] == keys[1]
+    assert pipeline_stages.latest_key("ingest") == keys[1]
+
+    sizes = {key: size for _, stage, key, size in pipeline_stages.list_artifacts()}
+    budget_mb = (sum(sizes.values()) - sizes[keys[0]]) / 1024 / 1024
+    with contextlib.redirect_stdout(io.StringIO()):
+        removed = pipeline_stages.evict_artifacts(budget_mb)
+    assert removed == [f"ingest/{keys[0]}"]
+
+    # 上限が 0 でも各ステージの最新の出力 (LATEST) は残す
+    with contextlib.redirect_stdout(io.StringIO()):
+        removed = pipeline_stages.evict_artifacts(0)
+    assert removed == [f"ingest/{keys[2]}"]
+    assert [key for _, _, key, _ in pipeline_stages.list_artifacts()] == [keys[1]]
+    assert pipeline_stages.load_manifest("ingest")["key"] == keys[1]
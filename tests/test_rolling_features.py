@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import backfill_with_loops
+from rolling_features import (
+    AWAY_OVERALL_COLUMNS, AWAY_ROLLING_COLUMNS, HOME_OVERALL_COLUMNS, HOME_ROLLING_COLUMNS,
+    add_team_features, fill_not_started_features,
+)
+
+FILLED_COLUMNS = HOME_ROLLING_COLUMNS + AWAY_ROLLING_COLUMNS + HOME_OVERALL_COLUMNS + AWAY_OVERALL_COLUMNS
+
+
+def make_ns_matches(season, ns_weeks, newcomer, seed=0):
+    """
+    6チームの2シーズン分 (前シーズンと season) の試合データを作成する。
+    season は総当たりの途中まで FT、残りの ns_weeks 節分を NS にする。
+    newcomer を指定した場合、FT 試合のないチームとして NS 試合にだけ追加する。
+    """
+    rng = np.random.default_rng(seed)
+    teams = [f"Team {i}" for i in range(6)]
+    fixtures = [(home, away) for home in teams for away in teams if home != away]
+    rows = []
+    for year in (season - 1, season):
+        start = pd.Timestamp(f"{year - 1}-08-10")
+        order = rng.permutation(len(fixtures))
+        for week, offset in enumerate(range(0, len(order), 3)):
+            for i, position in enumerate(order[offset:offset + 3]):
+                home, away = fixtures[position]
+                rows.append({"date": start + pd.Timedelta(days=7 * week, hours=i), "season": year,
+                             "home_team": home, "away_team": away})
+    df = pd.DataFrame(rows)
+    last_weeks = df[df["season"] == season]["date"].dt.to_period("W").drop_duplicates().iloc[-ns_weeks:]
+    ns = (df["season"] == season) & df["date"].dt.to_period("W").isin(last_weeks)
+    df["status"] = np.where(ns, "NS", "FT")
+    if newcomer is not None:
+        first_ns = df.loc[ns, "date"].min()
+        df = pd.concat([df, pd.DataFrame([
+            {"date": first_ns + pd.Timedelta(days=1), "season": season, "home_team": newcomer, "away_team": teams[0]},
+            {"date": first_ns + pd.Timedelta(days=8), "season": season, "home_team": teams[1], "away_team": newcomer},
+        ]).assign(status="NS")], ignore_index=True)
+
+    ns = df["status"] == "NS"
+    df["fixture_id"] = np.arange(len(df)) + 1000
+    df["home_score"] = np.where(ns, np.nan, rng.integers(0, 4, len(df)))
+    df["away_score"] = np.where(ns, np.nan, rng.integers(0, 4, len(df)))
+    df = df.sort_values(["date", "fixture_id"]).reset_index(drop=True)
+
+    df["target"] = np.select([df["home_score"] > df["away_score"], df["home_score"] == df["away_score"],
+                              df["home_score"] < df["away_score"]], ["H", "D", "A"], default=None)
+    df["is_home_win"] = (df["target"] == "H").astype(np.int8)
+    df["is_away_win"] = (df["target"] == "A").astype(np.int8)
+    df["home_goal_difference"] = df["home_score"] - df["away_score"]
+    df["away_goal_difference"] = df["away_score"] - df["home_score"]
+    return add_team_features(df)
+
+
+@pytest.mark.parametrize("season, ns_weeks", [(2025, 1), (2025, 3), (2031, 4)])
+def test_fill_not_started_features_matches_loops(season, ns_weeks):
+    df = make_ns_matches(season, ns_weeks, newcomer="Newcomer")
+    assert df.loc[df["status"] == "NS", "date"].dt.to_period("W").nunique() >= ns_weeks
+
+    expected = backfill_with_loops(df.copy(), season)
+    result = fill_not_started_features(df.copy())
+
+    pd.testing.assert_frame_equal(result[FILLED_COLUMNS], expected[FILLED_COLUMNS], check_dtype=False)
+    # 補完されるのは NS 試合だけ
+    ft = df["status"] == "FT"
+    pd.testing.assert_frame_equal(result.loc[ft, FILLED_COLUMNS], df.loc[ft, FILLED_COLUMNS])
+
+
+def test_team_without_finished_match_is_not_filled():
+    df = make_ns_matches(2031, 2, newcomer="Newcomer")
+    result = fill_not_started_features(df.copy())
+
+    home = df["home_team"] == "Newcomer"
+    away = df["away_team"] == "Newcomer"
+    assert home.any() and away.any()
+    # FT 試合のないチームの側の特徴量は置き換え元がないため、そのまま残る
+    pd.testing.assert_frame_equal(result.loc[home, HOME_ROLLING_COLUMNS + HOME_OVERALL_COLUMNS],
+                                  df.loc[home, HOME_ROLLING_COLUMNS + HOME_OVERALL_COLUMNS])
+    pd.testing.assert_frame_equal(result.loc[away, AWAY_ROLLING_COLUMNS + AWAY_OVERALL_COLUMNS],
+                                  df.loc[away, AWAY_ROLLING_COLUMNS + AWAY_OVERALL_COLUMNS])
+    # 相手チームの側は補完される
+    opponent_home = df.loc[away, "home_team"].iloc[0]
+    last_home = df[(df["status"] == "FT") & (df["home_team"] == opponent_home)].iloc[-1]
+    assert result.loc[away, HOME_ROLLING_COLUMNS].iloc[0].tolist() == last_home[HOME_ROLLING_COLUMNS].tolist()